@@ -4,6 +4,9 @@
 -- Enable UUID extension
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
 
+-- Trigram matching for post search on cashtags and addresses
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Users table (for authentication)
 CREATE TABLE IF NOT EXISTS users (
     id SERIAL PRIMARY KEY,
@@ -31,30 +34,80 @@ CREATE TABLE IF NOT EXISTS kols (
     tags TEXT[],
     verification_status VARCHAR(50) DEFAULT 'unverified',
     influence_score INTEGER DEFAULT 0,
+    best_channel VARCHAR(255),
     last_activity TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- User posts table
+-- User posts table, range-partitioned by month of the post's date so time
+-- windows prune to a few partitions and retention drops whole partitions.
+-- Keys must include the partition key, hence (id, date) and the
+-- (channel_id, message_id, date) upsert key; a post's date never changes.
+-- An unpartitioned user_posts from before this layout is renamed here and
+-- copied over below.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'user_posts' AND relkind = 'r') THEN
+        ALTER TABLE user_posts RENAME TO user_posts_unpartitioned;
+        ALTER TABLE user_posts_unpartitioned DROP CONSTRAINT IF EXISTS user_posts_pkey;
+        ALTER TABLE user_posts_unpartitioned DROP CONSTRAINT IF EXISTS user_posts_uuid_key;
+        DROP INDEX IF EXISTS idx_user_posts_username, idx_user_posts_date, idx_user_posts_channel_message,
+            idx_user_posts_search, idx_user_posts_text_trgm, idx_user_posts_author;
+    END IF;
+END $$;
+
 CREATE TABLE IF NOT EXISTS user_posts (
-    id SERIAL PRIMARY KEY,
-    uuid UUID DEFAULT uuid_generate_v4() UNIQUE,
+    id BIGSERIAL,
+    uuid UUID DEFAULT uuid_generate_v4(),
     username VARCHAR(255) NOT NULL,
     telegram_username VARCHAR(255),
     text TEXT,
     views INTEGER DEFAULT 0,
     forwards INTEGER DEFAULT 0,
-    date TIMESTAMP,
+    date TIMESTAMP NOT NULL,
     message_id BIGINT,
     channel_id BIGINT,
     channel_title VARCHAR(255),
     engagement_rate DECIMAL(5,2) DEFAULT 0.0,
     sentiment_score DECIMAL(3,2) DEFAULT 0.5,
     volume_data JSONB DEFAULT '{}',
+    author_id BIGINT,
+    search_vector TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', coalesce(text, ''))) STORED,
     fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, date)
+) PARTITION BY RANGE (date);
+CREATE TABLE IF NOT EXISTS user_posts_default PARTITION OF user_posts DEFAULT;
+
+-- Copy posts from the unpartitioned table into monthly partitions
+DO $$
+DECLARE
+    month DATE;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'user_posts_unpartitioned') THEN
+        ALTER TABLE user_posts_unpartitioned ADD COLUMN IF NOT EXISTS author_id BIGINT;
+        FOR month IN
+            SELECT DISTINCT date_trunc('month', COALESCE(date, created_at, CURRENT_TIMESTAMP))::date
+            FROM user_posts_unpartitioned
+        LOOP
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF user_posts FOR VALUES FROM (%L) TO (%L)',
+                'user_posts_' || to_char(month, 'YYYY_MM'), month, (month + INTERVAL '1 month')::date
+            );
+        END LOOP;
+        INSERT INTO user_posts (id, uuid, username, telegram_username, text, views, forwards, date, message_id,
+                                channel_id, channel_title, engagement_rate, sentiment_score, volume_data,
+                                author_id, fetched_at, created_at)
+        SELECT id, uuid, username, telegram_username, text, views, forwards,
+               COALESCE(date, created_at, CURRENT_TIMESTAMP), message_id, channel_id, channel_title,
+               engagement_rate, sentiment_score, volume_data, author_id, fetched_at, created_at
+        FROM user_posts_unpartitioned;
+        PERFORM setval(pg_get_serial_sequence('user_posts', 'id'),
+                       GREATEST((SELECT MAX(id) FROM user_posts), 1));
+        DROP TABLE user_posts_unpartitioned;
+    END IF;
+END $$;
 
 -- Bot detections table
 CREATE TABLE IF NOT EXISTS bot_detections (
@@ -117,10 +170,33 @@ CREATE TABLE IF NOT EXISTS channel_scans (
     scan_results JSONB DEFAULT '{}',
     messages_analyzed INTEGER DEFAULT 0,
     kols_found INTEGER DEFAULT 0,
+    status VARCHAR(20) DEFAULT 'completed',
+    stage VARCHAR(50),
+    progress JSONB DEFAULT '{}',
+    requested_by VARCHAR(255),
+    attempts INTEGER DEFAULT 0,
+    error TEXT,
+    started_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    completed_at TIMESTAMP,
     scanned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Scan job columns for databases created before the job queue existed
+ALTER TABLE channel_scans ADD COLUMN IF NOT EXISTS status VARCHAR(20) DEFAULT 'completed';
+ALTER TABLE channel_scans ADD COLUMN IF NOT EXISTS stage VARCHAR(50);
+ALTER TABLE channel_scans ADD COLUMN IF NOT EXISTS progress JSONB DEFAULT '{}';
+ALTER TABLE channel_scans ADD COLUMN IF NOT EXISTS requested_by VARCHAR(255);
+ALTER TABLE channel_scans ADD COLUMN IF NOT EXISTS attempts INTEGER DEFAULT 0;
+ALTER TABLE channel_scans ADD COLUMN IF NOT EXISTS error TEXT;
+ALTER TABLE channel_scans ADD COLUMN IF NOT EXISTS started_at TIMESTAMP;
+ALTER TABLE channel_scans ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE channel_scans ADD COLUMN IF NOT EXISTS completed_at TIMESTAMP;
+
+-- Leaderboard columns for databases created before scans upserted KOLs
+ALTER TABLE kols ADD COLUMN IF NOT EXISTS best_channel VARCHAR(255);
+
 -- Session storage table (for Telegram sessions)
 CREATE TABLE IF NOT EXISTS telegram_sessions (
     id SERIAL PRIMARY KEY,
@@ -136,6 +212,52 @@ CREATE TABLE IF NOT EXISTS telegram_sessions (
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
+-- Pending OTP logins, shared so verification can land on any worker
+CREATE TABLE IF NOT EXISTS auth_sessions (
+    session_id VARCHAR(255) PRIMARY KEY,
+    user_id VARCHAR(255) NOT NULL,
+    phone_number VARCHAR(20) NOT NULL,
+    phone_code_hash VARCHAR(255) NOT NULL,
+    session_data BYTEA NOT NULL,
+    attempts INTEGER DEFAULT 0,
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+-- Which worker currently drives each Telegram session (multi-worker mode)
+CREATE TABLE IF NOT EXISTS session_leases (
+    session_key VARCHAR(255) PRIMARY KEY,
+    owner_id VARCHAR(64) NOT NULL,
+    owner_address VARCHAR(255),
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+-- Scan snapshots for growth charts, partitioned by month; old partitions are dropped for retention
+CREATE TABLE IF NOT EXISTS metric_samples (
+    entity_type VARCHAR(20) NOT NULL,
+    entity_id BIGINT NOT NULL,
+    metric VARCHAR(50) NOT NULL,
+    value DOUBLE PRECISION NOT NULL,
+    recorded_at TIMESTAMP NOT NULL
+) PARTITION BY RANGE (recorded_at);
+CREATE TABLE IF NOT EXISTS metric_samples_default PARTITION OF metric_samples DEFAULT;
+
+-- Hourly and daily aggregates of metric_samples, updated on every insert
+CREATE TABLE IF NOT EXISTS metric_rollups (
+    entity_type VARCHAR(20) NOT NULL,
+    entity_id BIGINT NOT NULL,
+    metric VARCHAR(50) NOT NULL,
+    bucket VARCHAR(10) NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    samples INTEGER NOT NULL,
+    total DOUBLE PRECISION NOT NULL,
+    min_value DOUBLE PRECISION NOT NULL,
+    max_value DOUBLE PRECISION NOT NULL,
+    last_value DOUBLE PRECISION NOT NULL,
+    last_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (entity_type, entity_id, metric, bucket, bucket_start)
+);
+
 -- Game results table (for KOL battle games, etc.)
 CREATE TABLE IF NOT EXISTS game_results (
     id SERIAL PRIMARY KEY,
@@ -155,14 +277,28 @@ CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
 CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id);
 CREATE INDEX IF NOT EXISTS idx_kols_telegram_username ON kols(telegram_username);
 CREATE INDEX IF NOT EXISTS idx_kols_created_at ON kols(created_at);
+CREATE INDEX IF NOT EXISTS idx_kols_influence_score ON kols(influence_score DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_kols_last_activity ON kols(last_activity DESC, id DESC) WHERE last_activity IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_kols_tags ON kols USING GIN(tags);
 CREATE INDEX IF NOT EXISTS idx_user_posts_username ON user_posts(username);
 CREATE INDEX IF NOT EXISTS idx_user_posts_date ON user_posts(date);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_user_posts_channel_message ON user_posts(channel_id, message_id, date);
+CREATE INDEX IF NOT EXISTS idx_user_posts_channel_date ON user_posts(channel_id, date DESC, message_id DESC);
+CREATE INDEX IF NOT EXISTS idx_user_posts_search ON user_posts USING GIN(search_vector);
+CREATE INDEX IF NOT EXISTS idx_user_posts_text_trgm ON user_posts USING GIN(text gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_user_posts_author ON user_posts(author_id, date DESC, id DESC) WHERE author_id IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_bot_detections_username ON bot_detections(username);
 CREATE INDEX IF NOT EXISTS idx_bot_detections_analyzed_at ON bot_detections(analyzed_at);
+CREATE INDEX IF NOT EXISTS idx_bot_detections_telegram_id ON bot_detections(telegram_id);
+CREATE INDEX IF NOT EXISTS idx_bot_detections_username_lower ON bot_detections(lower(username), analyzed_at DESC);
 CREATE INDEX IF NOT EXISTS idx_kol_analyses_username ON kol_analyses(username);
 CREATE INDEX IF NOT EXISTS idx_discovered_kols_discovered_from ON discovered_kols(discovered_from);
 CREATE INDEX IF NOT EXISTS idx_channel_scans_channel_name ON channel_scans(channel_name);
+CREATE INDEX IF NOT EXISTS idx_channel_scans_pending ON channel_scans(created_at) WHERE status IN ('queued', 'running');
 CREATE INDEX IF NOT EXISTS idx_telegram_sessions_user_id ON telegram_sessions(user_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_telegram_sessions_session_name ON telegram_sessions(session_name);
+CREATE INDEX IF NOT EXISTS idx_auth_sessions_expires_at ON auth_sessions(expires_at);
+CREATE INDEX IF NOT EXISTS idx_metric_samples_series ON metric_samples(entity_type, entity_id, metric, recorded_at);
 CREATE INDEX IF NOT EXISTS idx_game_results_user_id ON game_results(user_id);
 
 -- Create trigger to update updated_at timestamp
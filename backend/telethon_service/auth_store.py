@@ -0,0 +1,294 @@
+import asyncio
+import heapq
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from telethon import TelegramClient
+from telethon.sessions import StringSession
+
+from rpc_accounting import AccountedTelegramClient
+
+logger = logging.getLogger(__name__)
+
+AUTH_SESSION_TTL = int(os.getenv('AUTH_SESSION_TTL', '600'))
+AUTH_SESSION_MAX_PENDING = int(os.getenv('AUTH_SESSION_MAX_PENDING', '500'))
+AUTH_SESSION_STORE = os.getenv('AUTH_SESSION_STORE', 'postgres')
+AUTH_SESSION_PURGE_INTERVAL = 60
+
+
+class AuthSessionLimitError(Exception):
+    """Raised when too many OTP logins are pending"""
+
+
+@dataclass
+class AuthSession:
+    """A pending OTP login: the half-authorized client and its code hash"""
+    session_id: str
+    user_id: str
+    phone_number: str
+    phone_code_hash: str
+    session_string: str
+    expires_at: float
+    attempts: int = 0
+    client: Optional[TelegramClient] = field(default=None, repr=False, compare=False)
+
+
+class MemoryAuthSessionStore:
+    """Process-local pending logins, evicted in expiry order
+
+    A min-heap of (expires_at, session_id) lets the reaper sleep exactly
+    until the next expiry, so expired clients are disconnected promptly
+    instead of on a fixed sweep. Replaced or popped sessions leave stale
+    heap entries that are skipped when they surface.
+    """
+
+    def __init__(self, api_id: int, api_hash: str, ttl: int = AUTH_SESSION_TTL,
+                 max_pending: int = AUTH_SESSION_MAX_PENDING):
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self._sessions: Dict[str, AuthSession] = {}
+        self._expiries: List[Tuple[float, str]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._reaper: Optional[asyncio.Task] = None
+        self.created = 0
+        self.expired = 0
+        self.rejected = 0
+
+    def new_expiry(self) -> float:
+        return time.time() + self.ttl
+
+    def _track(self, session: AuthSession):
+        self._sessions[session.session_id] = session
+        heapq.heappush(self._expiries, (session.expires_at, session.session_id))
+        if self._wakeup and self._expiries[0][1] == session.session_id:
+            self._wakeup.set()
+
+    def _pop_expired(self, now: float) -> List[AuthSession]:
+        expired = []
+        while self._expiries and self._expiries[0][0] <= now:
+            expires_at, session_id = heapq.heappop(self._expiries)
+            session = self._sessions.get(session_id)
+            if session is not None and session.expires_at == expires_at:
+                del self._sessions[session_id]
+                expired.append(session)
+        return expired
+
+    async def _release(self, sessions: List[AuthSession]):
+        for session in sessions:
+            self.expired += 1
+            await _disconnect(session.client)
+            logger.info(f"Expired auth session: {session.session_id}")
+
+    async def create(self, session: AuthSession):
+        await self._release(self._pop_expired(time.time()))
+        if len(self._sessions) >= self.max_pending:
+            self.rejected += 1
+            raise AuthSessionLimitError(f"{len(self._sessions)} logins already pending")
+        self._track(session)
+        self.created += 1
+
+    async def get(self, session_id: str) -> Optional[AuthSession]:
+        session = self._sessions.get(session_id)
+        if session is not None and session.expires_at <= time.time():
+            await self.pop(session_id)
+            self.expired += 1
+            return None
+        return session
+
+    async def record_attempt(self, session: AuthSession) -> int:
+        session.attempts += 1
+        return session.attempts
+
+    async def pop(self, session_id: str, disconnect: bool = True):
+        """Forget a session; disconnect=False hands its client over to the caller"""
+        session = self._sessions.pop(session_id, None)
+        if session and disconnect:
+            await _disconnect(session.client)
+
+    async def client_for(self, session: AuthSession) -> TelegramClient:
+        """The session's client, rebuilt from its StringSession if it lives elsewhere"""
+        if session.client is None:
+            session.client = AccountedTelegramClient(StringSession(session.session_string), self.api_id, self.api_hash)
+            await session.client.connect()
+            self._track(session)
+        return session.client
+
+    async def _purge(self):
+        """Hook for stores with shared state to drop expired rows"""
+
+    async def start(self):
+        if not self._reaper:
+            self._wakeup = asyncio.Event()
+            self._reaper = asyncio.create_task(self._reap())
+
+    async def _reap(self):
+        last_purge = 0.0
+        while True:
+            try:
+                now = time.time()
+                await self._release(self._pop_expired(now))
+                if now - last_purge >= AUTH_SESSION_PURGE_INTERVAL:
+                    await self._purge()
+                    last_purge = now
+                timeout = AUTH_SESSION_PURGE_INTERVAL
+                if self._expiries:
+                    timeout = min(timeout, max(self._expiries[0][0] - time.time(), 0))
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in auth session reaper: {e}")
+                await asyncio.sleep(5)
+
+    async def stop(self):
+        if self._reaper:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+            self._reaper = None
+        for session in list(self._sessions.values()):
+            await _disconnect(session.client)
+        self._sessions.clear()
+        self._expiries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'store': 'memory',
+            'pending': len(self._sessions),
+            'max_pending': self.max_pending,
+            'created': self.created,
+            'expired': self.expired,
+            'rejected': self.rejected,
+            'next_expiry_in': round(self._expiries[0][0] - time.time(), 1) if self._expiries else None
+        }
+
+
+class PostgresAuthSessionStore(MemoryAuthSessionStore):
+    """Pending logins shared through the auth_sessions table
+
+    Any worker can verify an OTP: if it did not send the code it rebuilds
+    the client from the stored StringSession. Clients this worker holds
+    are still tracked in the local heap so they are released on expiry.
+    Falls back to process-local behaviour while the database is down.
+    """
+
+    def __init__(self, api_id: int, api_hash: str, db=None, **kwargs):
+        super().__init__(api_id, api_hash, **kwargs)
+        self.db = db
+
+    @property
+    def db_available(self) -> bool:
+        return self.db is not None and getattr(self.db, 'is_connected', False)
+
+    async def create(self, session: AuthSession):
+        if not self.db_available:
+            return await super().create(session)
+        await self._release(self._pop_expired(time.time()))
+        row = await self.db.fetch_one(
+            query="""
+                INSERT INTO auth_sessions (session_id, user_id, phone_number, phone_code_hash, session_data, expires_at)
+                SELECT :session_id, :user_id, :phone_number, :phone_code_hash, :session_data, to_timestamp(:expires_at)
+                WHERE (SELECT COUNT(*) FROM auth_sessions WHERE expires_at > NOW()) < :max_pending
+                RETURNING session_id
+            """,
+            values={
+                'session_id': session.session_id,
+                'user_id': session.user_id,
+                'phone_number': session.phone_number,
+                'phone_code_hash': session.phone_code_hash,
+                'session_data': session.session_string.encode(),
+                'expires_at': session.expires_at,
+                'max_pending': self.max_pending
+            }
+        )
+        if not row:
+            self.rejected += 1
+            raise AuthSessionLimitError(f"{self.max_pending} logins already pending")
+        self._track(session)
+        self.created += 1
+
+    async def get(self, session_id: str) -> Optional[AuthSession]:
+        if not self.db_available:
+            return await super().get(session_id)
+        row = await self.db.fetch_one(
+            query="""
+                SELECT session_id, user_id, phone_number, phone_code_hash, session_data, attempts,
+                       EXTRACT(EPOCH FROM expires_at) AS expires_at
+                FROM auth_sessions
+                WHERE session_id = :session_id AND expires_at > NOW()
+            """,
+            values={'session_id': session_id}
+        )
+        local = self._sessions.get(session_id)
+        if not row:
+            if local:
+                await super().pop(session_id)
+            return None
+        if local:
+            # The shared row is authoritative for attempts made on other workers
+            local.attempts = row['attempts']
+            return local
+        return AuthSession(
+            session_id=row['session_id'],
+            user_id=row['user_id'],
+            phone_number=row['phone_number'],
+            phone_code_hash=row['phone_code_hash'],
+            session_string=bytes(row['session_data']).decode(),
+            expires_at=float(row['expires_at']),
+            attempts=row['attempts']
+        )
+
+    async def record_attempt(self, session: AuthSession) -> int:
+        if not self.db_available:
+            return await super().record_attempt(session)
+        attempts = await self.db.fetch_val(
+            query="UPDATE auth_sessions SET attempts = attempts + 1 WHERE session_id = :session_id RETURNING attempts",
+            values={'session_id': session.session_id}
+        )
+        session.attempts = attempts if attempts is not None else session.attempts + 1
+        return session.attempts
+
+    async def pop(self, session_id: str, disconnect: bool = True):
+        await super().pop(session_id, disconnect)
+        if self.db_available:
+            await self.db.execute(
+                query="DELETE FROM auth_sessions WHERE session_id = :session_id",
+                values={'session_id': session_id}
+            )
+
+    async def _purge(self):
+        if not self.db_available:
+            return
+        try:
+            await self.db.execute("DELETE FROM auth_sessions WHERE expires_at <= NOW()")
+        except Exception as e:
+            logger.warning(f"Could not purge expired auth sessions: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats['store'] = 'postgres' if self.db_available else 'memory'
+        stats['local_clients'] = stats.pop('pending')
+        return stats
+
+
+async def _disconnect(client: Optional[TelegramClient]):
+    if client is None:
+        return
+    try:
+        await client.disconnect()
+    except Exception as e:
+        logger.debug(f"Error disconnecting auth client: {e}")
+
+
+def create_auth_session_store(api_id: int, api_hash: str, db=None) -> MemoryAuthSessionStore:
+    if AUTH_SESSION_STORE == 'memory':
+        return MemoryAuthSessionStore(api_id, api_hash)
+    return PostgresAuthSessionStore(api_id, api_hash, db)
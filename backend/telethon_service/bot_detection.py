@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Union
+
+from telethon.tl.functions.users import GetFullUserRequest
+
+logger = logging.getLogger(__name__)
+
+BOT_DETECTION_CACHE_TTL = int(os.getenv('BOT_DETECTION_CACHE_TTL', '86400'))
+BOT_DETECTION_CONCURRENCY = int(os.getenv('BOT_DETECTION_CONCURRENCY', '5'))
+
+
+def parse_target(target: Union[str, int]) -> Union[str, int]:
+    """Numeric inputs are Telegram ids, anything else a username"""
+    if isinstance(target, int):
+        return target
+    target = target.strip().lstrip('@')
+    return int(target) if target.lstrip('-').isdigit() else target
+
+
+def cache_key(target: Union[str, int]) -> Union[str, int]:
+    return target.lower() if isinstance(target, str) else target
+
+
+def score_user(username: str, user, full_user=None) -> Dict[str, Any]:
+    """Bot probability from the User flags and the bio/common chats only present on UserFull"""
+    analysis = {
+        'username': username,
+        'telegram_id': getattr(user, 'id', None),
+        'is_bot': getattr(user, 'bot', False),
+        'is_verified': getattr(user, 'verified', False),
+        'is_scam': getattr(user, 'scam', False),
+        'is_fake': getattr(user, 'fake', False),
+        'first_name': getattr(user, 'first_name', ''),
+        'last_name': getattr(user, 'last_name', ''),
+        'phone': getattr(user, 'phone', ''),
+        'bio': getattr(full_user, 'about', '') or '',
+        'common_chats_count': getattr(full_user, 'common_chats_count', 0),
+        'bot_probability': 0.0,
+        'analysis_factors': []
+    }
+
+    # Calculate bot probability based on various factors
+    bot_score = 0
+
+    if analysis['is_bot']:
+        bot_score += 100
+        analysis['analysis_factors'].append("Marked as bot by Telegram")
+
+    if analysis['is_scam']:
+        bot_score += 80
+        analysis['analysis_factors'].append("Marked as scam account")
+
+    if analysis['is_fake']:
+        bot_score += 70
+        analysis['analysis_factors'].append("Marked as fake account")
+
+    if not analysis['first_name'] and not analysis['last_name']:
+        bot_score += 20
+        analysis['analysis_factors'].append("No name set")
+
+    # Without the full user we cannot tell whether a bio exists, so don't penalize
+    if full_user is not None and not analysis['bio']:
+        bot_score += 10
+        analysis['analysis_factors'].append("No bio/description")
+
+    analysis['bot_probability'] = min(bot_score, 100) / 100
+    return analysis
+
+
+async def detect_bot(client, target: Union[str, int]) -> Dict[str, Any]:
+    """Resolve one user, fetch their full profile and score it"""
+    user = await client.get_entity(target)
+    try:
+        full = await client(GetFullUserRequest(user))
+        full_user = full.full_user
+    except Exception as e:
+        logger.debug(f"Could not get full user for {target}: {e}")
+        full_user = None
+    return score_user(getattr(user, 'username', None) or str(target), user, full_user)
+
+
+STORE_VERDICT = """
+    INSERT INTO bot_detections (username, display_name, telegram_id, is_bot, confidence, status,
+                                profile_analysis, analyzed_at)
+    VALUES (:username, :display_name, :telegram_id, :is_bot, :confidence, :status,
+            CAST(:profile_analysis AS JSONB), CURRENT_TIMESTAMP)
+"""
+
+
+def verdict_row(analysis: Dict[str, Any]) -> Dict[str, Any]:
+    probability = analysis['bot_probability']
+    return {
+        'username': analysis['username'][:255],
+        'display_name': f"{analysis['first_name'] or ''} {analysis['last_name'] or ''}".strip()[:255],
+        'telegram_id': analysis['telegram_id'],
+        'is_bot': probability >= 0.5,
+        'confidence': probability,
+        'status': 'likely_bot' if probability >= 0.5 else 'likely_human',
+        'profile_analysis': json.dumps(analysis, default=str)
+    }
+
+
+class BotVerdictCache:
+    """TTL cache of bot-detection verdicts stored in bot_detections"""
+
+    def __init__(self, db=None, ttl_seconds: int = BOT_DETECTION_CACHE_TTL, buffer=None):
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self.buffer = buffer
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def available(self) -> bool:
+        return self.db is not None and getattr(self.db, 'is_connected', False)
+
+    async def lookup(self, targets: List[Union[str, int]]) -> Dict[Union[str, int], Dict[str, Any]]:
+        """Fresh verdicts keyed by lowercase username or telegram id"""
+        if not self.available or not targets:
+            return {}
+        usernames = [t.lower() for t in targets if isinstance(t, str)]
+        telegram_ids = [t for t in targets if isinstance(t, int)]
+        try:
+            rows = await self.db.fetch_all(
+                query="""
+                    SELECT username, telegram_id, profile_analysis, analyzed_at
+                    FROM bot_detections
+                    WHERE (lower(username) = ANY(:usernames) OR telegram_id = ANY(:telegram_ids))
+                      AND analyzed_at > CURRENT_TIMESTAMP - make_interval(secs => :ttl)
+                    ORDER BY analyzed_at DESC
+                """,
+                values={'usernames': usernames, 'telegram_ids': telegram_ids, 'ttl': float(self.ttl_seconds)}
+            )
+        except Exception as e:
+            logger.warning(f"Bot verdict cache lookup failed: {e}")
+            return {}
+
+        verdicts = {}
+        for row in rows:
+            analysis = row['profile_analysis']
+            if isinstance(analysis, str):
+                analysis = json.loads(analysis)
+            analysis['analyzed_at'] = row['analyzed_at'].isoformat() if row['analyzed_at'] else None
+            # Rows are newest first, so keep the first verdict seen per key
+            if row['username']:
+                verdicts.setdefault(row['username'].lower(), analysis)
+            if row['telegram_id'] is not None:
+                verdicts.setdefault(row['telegram_id'], analysis)
+        found = sum(1 for target in targets if cache_key(target) in verdicts)
+        self.hits += found
+        self.misses += len(targets) - found
+        return verdicts
+
+    async def store(self, analysis: Dict[str, Any]):
+        """Save a verdict, through the write-behind buffer when one is attached"""
+        if not self.available:
+            return
+        row = verdict_row(analysis)
+        if self.buffer is not None:
+            await self.buffer.put('bot_detections', [row])
+            return
+        try:
+            await self.write(self.db, [row])
+        except Exception as e:
+            logger.warning(f"Could not cache bot verdict for {analysis['username']}: {e}")
+
+    @staticmethod
+    async def write(db, rows: List[Dict[str, Any]]):
+        await db.execute_many(STORE_VERDICT, rows)
+
+
+async def detect_bots_batch(client, targets: List[Union[str, int]], cache: BotVerdictCache,
+                            concurrency: int = BOT_DETECTION_CONCURRENCY,
+                            force_refresh: bool = False) -> List[Dict[str, Any]]:
+    """Verdicts for many users: cached ones first, the rest resolved with bounded concurrency"""
+    parsed = [parse_target(t) for t in targets]
+    cached = {} if force_refresh else await cache.lookup(parsed)
+    semaphore = asyncio.Semaphore(concurrency)
+    inflight: Dict[Union[str, int], asyncio.Future] = {}
+
+    async def resolve(target):
+        async with semaphore:
+            analysis = await detect_bot(client, target)
+        await cache.store(analysis)
+        return analysis
+
+    # Duplicate inputs share one lookup
+    for target in parsed:
+        key = cache_key(target)
+        if key not in cached and key not in inflight:
+            inflight[key] = asyncio.ensure_future(resolve(target))
+
+    results = []
+    for original, target in zip(targets, parsed):
+        key = cache_key(target)
+        if key in cached:
+            results.append({**cached[key], 'input': original, 'cached': True})
+            continue
+        try:
+            analysis = await inflight[key]
+            results.append({**analysis, 'input': original, 'cached': False})
+        except Exception as e:
+            logger.warning(f"Bot detection failed for {original}: {e}")
+            results.append({'input': original, 'error': str(e)})
+    return results
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import os
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import aiohttp
+import uvicorn
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+# 'all' serves HTTP and drives Telegram in one process; 'api' processes only
+# handle HTTP and hand scans to 'scan-worker' processes through the job queue
+SERVICE_ROLE = os.getenv('SERVICE_ROLE', 'all')
+API_ROLE = 'api'
+SCAN_WORKER_ROLE = 'scan-worker'
+CLUSTER_MODE = os.getenv('CLUSTER_MODE', '').lower() in ('1', 'true', 'yes') or SERVICE_ROLE != 'all'
+CLUSTER_LEASE_TTL = int(os.getenv('CLUSTER_LEASE_TTL', '30'))
+CLUSTER_BIND_HOST = os.getenv('CLUSTER_BIND_HOST', '127.0.0.1')
+CLUSTER_ADVERTISE_HOST = os.getenv('CLUSTER_ADVERTISE_HOST', CLUSTER_BIND_HOST)
+CLUSTER_INTERNAL_PORT = int(os.getenv('CLUSTER_INTERNAL_PORT', '0'))
+CLUSTER_PROXY_TIMEOUT = int(os.getenv('CLUSTER_PROXY_TIMEOUT', '300'))
+
+MAIN_SESSION = 'main'
+ROUTED_HEADER = 'X-KOL-Routed-By'
+HOP_BY_HOP_HEADERS = {'host', 'connection', 'keep-alive', 'transfer-encoding', 'content-length', 'upgrade'}
+
+
+def user_session_key(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+class SessionLeases:
+    """Postgres leases deciding which worker drives each Telegram session
+
+    A Telethon session must only be connected from one process at a time.
+    Each worker holds time-limited leases (session_leases rows) for the
+    sessions it has connected and renews them every ttl/3 seconds; a lease
+    whose owner stops renewing expires and can be taken over. Without
+    CLUSTER_MODE or a database every acquire succeeds locally.
+    """
+
+    def __init__(self, db=None, ttl: int = CLUSTER_LEASE_TTL, enabled: bool = CLUSTER_MODE):
+        self.db = db
+        self.ttl = ttl
+        self.cluster_mode = enabled
+        self.worker_id = uuid.uuid4().hex
+        self.address: Optional[str] = None
+        self.held: Set[str] = set()
+        self.claims: List[str] = []
+        self.on_acquired: Optional[Callable[[str], Awaitable[None]]] = None
+        self.on_lost: Optional[Callable[[str], Awaitable[None]]] = None
+        self.acquired = 0
+        self.lost = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.cluster_mode and self.address is not None and \
+            self.db is not None and getattr(self.db, 'is_connected', False)
+
+    def holds(self, key: str) -> bool:
+        return not self.enabled or key in self.held
+
+    async def acquire(self, key: str, force: bool = False) -> bool:
+        """Take the lease if it is free, expired or already ours; force steals it"""
+        if not self.enabled:
+            return True
+        try:
+            row = await self.db.fetch_one(
+                query="""
+                    INSERT INTO session_leases (session_key, owner_id, owner_address, expires_at)
+                    VALUES (:key, :owner, :address, NOW() + make_interval(secs => :ttl))
+                    ON CONFLICT (session_key) DO UPDATE
+                    SET owner_id = EXCLUDED.owner_id, owner_address = EXCLUDED.owner_address,
+                        expires_at = EXCLUDED.expires_at
+                    WHERE session_leases.owner_id = EXCLUDED.owner_id
+                       OR session_leases.expires_at < NOW() OR :force
+                    RETURNING owner_id
+                """,
+                values={'key': key, 'owner': self.worker_id, 'address': self.address,
+                        'ttl': float(self.ttl), 'force': force}
+            )
+        except Exception as e:
+            logger.warning(f"Could not acquire lease {key}: {e}")
+            return False
+        if not row:
+            return False
+        if key not in self.held:
+            self.held.add(key)
+            self.acquired += 1
+            logger.info(f"Acquired session lease {key}")
+        return True
+
+    async def release(self, key: str):
+        if key not in self.held:
+            return
+        self.held.discard(key)
+        if not self.enabled:
+            return
+        try:
+            await self.db.execute(
+                query="DELETE FROM session_leases WHERE session_key = :key AND owner_id = :owner",
+                values={'key': key, 'owner': self.worker_id}
+            )
+        except Exception as e:
+            logger.warning(f"Could not release lease {key}: {e}")
+
+    async def owner_address(self, key: str) -> Optional[str]:
+        """Internal address of the other worker holding key, or None if it is ours or free"""
+        if not self.enabled or key in self.held:
+            return None
+        row = await self.db.fetch_one(
+            query="""
+                SELECT owner_id, owner_address FROM session_leases
+                WHERE session_key = :key AND expires_at > NOW()
+            """,
+            values={'key': key}
+        )
+        if not row or row['owner_id'] == self.worker_id:
+            return None
+        return row['owner_address']
+
+    async def start(self, claims: Optional[List[str]] = None):
+        """Renew held leases and keep trying to take over the claimed ones"""
+        self.claims = list(claims or [])
+        if self.cluster_mode and not self._task:
+            self._task = asyncio.create_task(self._maintain())
+
+    async def _maintain(self):
+        interval = max(self.ttl / 3, 1)
+        while True:
+            await asyncio.sleep(interval)
+            if not self.enabled:
+                continue
+            try:
+                await self._renew()
+                for key in self.claims:
+                    if key not in self.held and await self.acquire(key) and self.on_acquired:
+                        await self.on_acquired(key)
+            except Exception as e:
+                logger.error(f"Error maintaining session leases: {e}")
+
+    async def _renew(self):
+        if not self.held:
+            return
+        keys = list(self.held)
+        rows = await self.db.fetch_all(
+            query="""
+                UPDATE session_leases SET expires_at = NOW() + make_interval(secs => :ttl)
+                WHERE owner_id = :owner AND session_key = ANY(:keys)
+                RETURNING session_key
+            """,
+            values={'ttl': float(self.ttl), 'owner': self.worker_id, 'keys': keys}
+        )
+        renewed = {row['session_key'] for row in rows}
+        for key in keys:
+            if key not in renewed and key in self.held:
+                self.held.discard(key)
+                self.lost += 1
+                logger.warning(f"Lost session lease {key} to another worker")
+                if self.on_lost:
+                    await self.on_lost(key)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for key in list(self.held):
+            await self.release(key)
+
+    def stats(self) -> Dict:
+        return {
+            'cluster_mode': self.cluster_mode,
+            'enabled': self.enabled,
+            'worker_id': self.worker_id,
+            'address': self.address,
+            'held': sorted(self.held),
+            'acquired': self.acquired,
+            'lost': self.lost
+        }
+
+
+class _InternalServer(uvicorn.Server):
+    def install_signal_handlers(self):
+        # The worker's public server already handles signals
+        pass
+
+
+class InternalListener:
+    """Per-worker HTTP listener other workers use to reach this one
+
+    Workers share the public port, so a request can only be routed to a
+    specific worker through its own internal address.
+    """
+
+    def __init__(self, app, host: str = CLUSTER_BIND_HOST, port: int = CLUSTER_INTERNAL_PORT):
+        self.server = _InternalServer(uvicorn.Config(app, host=host, port=port, lifespan='off', log_level='warning'))
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> str:
+        self._task = asyncio.create_task(self.server.serve())
+        while not self.server.started:
+            if self._task.done():
+                self._task.result()
+            await asyncio.sleep(0.01)
+        port = self.server.servers[0].sockets[0].getsockname()[1]
+        return f"http://{CLUSTER_ADVERTISE_HOST}:{port}"
+
+    async def stop(self):
+        if self._task:
+            self.server.should_exit = True
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+class RequestProxy:
+    """Forwards a request to the worker that owns its Telegram session"""
+
+    def __init__(self, worker_id: str, timeout: int = CLUSTER_PROXY_TIMEOUT):
+        self.worker_id = worker_id
+        self.timeout = timeout
+        self.proxied = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def forward(self, request: Request, address: str) -> StreamingResponse:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+        headers[ROUTED_HEADER] = self.worker_id
+        url = f"{address}{request.url.path}"
+        if request.url.query:
+            url = f"{url}?{request.url.query}"
+
+        response = await self._session.request(request.method, url, headers=headers, data=await request.body())
+        self.proxied += 1
+
+        async def body():
+            # Streamed so SSE scans keep their incremental delivery through the proxy
+            try:
+                async for chunk in response.content.iter_any():
+                    yield chunk
+            finally:
+                response.release()
+
+        return StreamingResponse(
+            body(),
+            status_code=response.status,
+            headers={k: v for k, v in response.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+        )
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,151 @@
+import logging
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '256'))
+DB_COMMAND_TIMEOUT = float(os.getenv('DB_COMMAND_TIMEOUT', '30'))
+DB_MAX_INACTIVE_LIFETIME = float(os.getenv('DB_MAX_INACTIVE_LIFETIME', '300'))
+
+# :name placeholders, skipping ::type casts
+_NAMED_PARAM = re.compile(r'(?<![:\w]):([A-Za-z_]\w*)')
+
+
+@lru_cache(maxsize=1024)
+def compile_query(query: str) -> Tuple[str, Tuple[str, ...]]:
+    """Rewrite :name placeholders to asyncpg's $n, returning the SQL and parameter order"""
+    names: List[str] = []
+
+    def placeholder(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    return _NAMED_PARAM.sub(placeholder, query), tuple(names)
+
+
+def _args(names: Sequence[str], values: Optional[Dict[str, Any]]) -> List[Any]:
+    values = values or {}
+    missing = [name for name in names if name not in values]
+    if missing:
+        raise ValueError(f"Missing query parameters: {', '.join(missing)}")
+    return [values[name] for name in names]
+
+
+class Database:
+    """Tuned asyncpg pool behind the fetch_one/fetch_all/execute interface
+
+    Queries keep the :name placeholder style used across the service; each
+    distinct query string is compiled to positional SQL once, and asyncpg's
+    per-connection statement cache then reuses its prepared statement, so
+    hot queries are parsed and planned once per connection.
+    """
+
+    def __init__(self, url: str, min_size: int = DB_POOL_MIN_SIZE, max_size: int = DB_POOL_MAX_SIZE,
+                 statement_cache_size: int = DB_STATEMENT_CACHE_SIZE, command_timeout: float = DB_COMMAND_TIMEOUT):
+        self.url = url.replace('postgresql+asyncpg://', 'postgresql://')
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_cache_size = statement_cache_size
+        self.command_timeout = command_timeout
+        self.pool: Optional[asyncpg.Pool] = None
+        self.acquires = 0
+        self.acquire_wait_total = 0.0
+        self.acquire_wait_max = 0.0
+        self.queries = 0
+        self.errors = 0
+
+    @property
+    def is_connected(self) -> bool:
+        return self.pool is not None and not self.pool.is_closing()
+
+    async def connect(self):
+        self.pool = await asyncpg.create_pool(
+            self.url,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            statement_cache_size=self.statement_cache_size,
+            command_timeout=self.command_timeout,
+            max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME
+        )
+        logger.info(f"PostgreSQL pool ready ({self.min_size}-{self.max_size} connections)")
+
+    async def disconnect(self):
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+
+    @asynccontextmanager
+    async def connection(self):
+        started = time.perf_counter()
+        async with self.pool.acquire() as connection:
+            waited = time.perf_counter() - started
+            self.acquires += 1
+            self.acquire_wait_total += waited
+            self.acquire_wait_max = max(self.acquire_wait_max, waited)
+            yield connection
+
+    async def _run(self, method: str, query: str, values: Optional[Dict[str, Any]], *extra):
+        sql, names = compile_query(query)
+        args = _args(names, values)
+        self.queries += 1
+        try:
+            async with self.connection() as connection:
+                return await getattr(connection, method)(sql, *args, *extra)
+        except Exception:
+            self.errors += 1
+            raise
+
+    async def fetch_one(self, query: str, values: Optional[Dict[str, Any]] = None) -> Optional[asyncpg.Record]:
+        return await self._run('fetchrow', query, values)
+
+    async def fetch_all(self, query: str, values: Optional[Dict[str, Any]] = None) -> List[asyncpg.Record]:
+        return await self._run('fetch', query, values)
+
+    async def fetch_val(self, query: str, values: Optional[Dict[str, Any]] = None, column: int = 0) -> Any:
+        return await self._run('fetchval', query, values, column)
+
+    async def execute(self, query: str, values: Optional[Dict[str, Any]] = None) -> str:
+        return await self._run('execute', query, values)
+
+    async def execute_many(self, query: str, values: List[Dict[str, Any]]):
+        """Run one statement for many parameter sets, prepared once and pipelined"""
+        if not values:
+            return
+        sql, names = compile_query(query)
+        rows = [_args(names, row) for row in values]
+        self.queries += 1
+        try:
+            async with self.connection() as connection:
+                await connection.executemany(sql, rows)
+        except Exception:
+            self.errors += 1
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        size = self.pool.get_size() if self.is_connected else 0
+        idle = self.pool.get_idle_size() if self.is_connected else 0
+        return {
+            'connected': self.is_connected,
+            'size': size,
+            'in_use': size - idle,
+            'idle': idle,
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+            'acquires': self.acquires,
+            'acquire_wait_avg_ms': round(self.acquire_wait_total / self.acquires * 1000, 2) if self.acquires else 0,
+            'acquire_wait_max_ms': round(self.acquire_wait_max * 1000, 2),
+            'queries': self.queries,
+            'errors': self.errors,
+            'compiled_queries': compile_query.cache_info().currsize
+        }
@@ -0,0 +1,273 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from inspect import CO_COROUTINE
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import REGISTRY, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from profiling import code_label
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.1'))
+# A callback holding the loop this long is logged with the coroutine running it
+SLOW_CALLBACK_SECONDS = float(os.getenv('SLOW_CALLBACK_SECONDS', '0.25'))
+# /ready answers 503 while p95 lag over the last LOOP_LAG_WINDOW seconds is above this
+LOOP_LAG_READY_P95 = float(os.getenv('LOOP_LAG_READY_P95', '0.25'))
+LOOP_LAG_WINDOW = float(os.getenv('LOOP_LAG_WINDOW', '300'))
+# Written by the watchdog thread even while the loop is blocked; keep-alive-wrapper.py reads it
+LOOP_STATUS_FILE = os.getenv('LOOP_STATUS_FILE', '')
+
+# Scan phases: entity, history, participants, detector, persistence, plus total
+SCAN_STAGE_SECONDS = Histogram(
+    'kol_scan_stage_seconds', 'Latency of each channel scan phase', ['stage'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+SCANS_IN_FLIGHT = Gauge('kol_scans_in_flight', 'Channel scans currently running', multiprocess_mode='livesum')
+HTTP_REQUEST_SECONDS = Histogram(
+    'kol_http_request_duration_seconds', 'HTTP request latency until the response starts',
+    ['method', 'route', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    'kol_event_loop_lag_seconds', 'How late the event loop ran a timer that should have fired on time',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+EVENT_LOOP_SLOW_CALLBACKS = Counter(
+    'kol_event_loop_slow_callbacks_total', 'Times a single callback held the event loop past SLOW_CALLBACK_SECONDS'
+)
+SCAN_CONTEXT_REQUESTS = Counter(
+    'kol_scan_context_requests_total', 'Telegram fetches per scan, made or served from the scan cache', ['result']
+)
+
+# name -> () -> (hits, misses), read at scrape time from the caches' own counters
+_cache_sources: Dict[str, Callable[[], Tuple[int, int]]] = {}
+# name -> (help, () -> value)
+_gauge_sources: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+
+def register_cache(name: str, counts: Callable[[], Tuple[int, int]]):
+    _cache_sources[name] = counts
+
+
+def register_gauge(name: str, documentation: str, value: Callable[[], float]):
+    _gauge_sources[name] = (documentation, value)
+
+
+class _SourceCollector:
+    """Exports cache hit ratios and service gauges from the components' stats"""
+
+    def collect(self):
+        requests = CounterMetricFamily('kol_cache_requests', 'Cache lookups by result', labels=['cache', 'result'])
+        ratio = GaugeMetricFamily('kol_cache_hit_ratio', 'Share of cache lookups that were hits', labels=['cache'])
+        for name, counts in _cache_sources.items():
+            try:
+                hits, misses = counts()
+            except Exception as e:
+                logger.debug(f"Could not read {name} cache counters: {e}")
+                continue
+            requests.add_metric([name, 'hit'], hits)
+            requests.add_metric([name, 'miss'], misses)
+            ratio.add_metric([name], hits / (hits + misses) if hits + misses else 0.0)
+        yield requests
+        yield ratio
+        for name, (documentation, value) in _gauge_sources.items():
+            try:
+                yield GaugeMetricFamily(name, documentation, value=float(value()))
+            except Exception as e:
+                logger.debug(f"Could not read gauge {name}: {e}")
+
+
+_source_collector = _SourceCollector()
+REGISTRY.register(_source_collector)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Prometheus text exposition; with WORKERS > 1 set PROMETHEUS_MULTIPROC_DIR
+    so histograms and counters are summed across worker processes"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        # Cache and gauge sources are this worker's own
+        registry.register(_source_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+@contextmanager
+def time_stage(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        SCAN_STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+
+
+def observe_request(method: str, route: str, status: int, seconds: float):
+    HTTP_REQUEST_SECONDS.labels(method, route, str(status)).observe(seconds)
+
+
+class LoopLagMonitor:
+    """Event-loop lag from a timer that should fire every interval, plus a
+    watchdog thread that notices when the loop stops ticking
+
+    When the loop is held longer than slow_callback, the watchdog grabs the
+    loop thread's stack so the stall is recorded with the task and coroutine
+    that caused it. The watchdog also writes status() to status_file every
+    second, so a supervisor can tell a saturated process from a dead one
+    even while the loop is too busy to answer HTTP.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, slow_callback: float = SLOW_CALLBACK_SECONDS,
+                 window: float = LOOP_LAG_WINDOW, ready_p95: float = LOOP_LAG_READY_P95,
+                 status_file: str = LOOP_STATUS_FILE):
+        self.interval = interval
+        self.slow_callback = slow_callback
+        self.window = window
+        self.ready_p95 = ready_p95
+        self.status_file = status_file
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.lags: Deque[float] = deque(maxlen=max(10, int(window / interval)))
+        self.slow_callbacks: Deque[Dict[str, Any]] = deque(maxlen=50)
+        self.slow_callback_count = 0
+        # time.monotonic() of the last tick; read by the watchdog thread
+        self.beat = 0.0
+        self._stall: Optional[Dict[str, Any]] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        if self._timer:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        self._schedule(self._loop.time())
+        self._stopping.clear()
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watchdog.start()
+
+    def _schedule(self, now: float):
+        due = now + self.interval
+        self._timer = self._loop.call_at(due, self._tick, due)
+
+    def _tick(self, due: float):
+        now = self._loop.time()
+        lag = max(0.0, now - due)
+        self.beat = time.monotonic()
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.lags.append(lag)
+        EVENT_LOOP_LAG_SECONDS.observe(lag)
+
+        stall, self._stall = self._stall, None
+        if lag >= self.slow_callback:
+            # The watchdog can miss stalls shorter than its poll interval
+            stall = stall or {'at': datetime.utcnow().isoformat(), 'task': None, 'coroutine': None,
+                              'blocking_in': None, 'stack': []}
+            stall['duration_ms'] = round(lag * 1000, 1)
+            self.slow_callbacks.append(stall)
+            self.slow_callback_count += 1
+            EVENT_LOOP_SLOW_CALLBACKS.inc()
+            logger.warning(f"Event loop blocked for {lag:.2f}s by {stall['coroutine'] or 'unknown'} "
+                           f"(task {stall['task']}, in {stall['blocking_in']})")
+        self._schedule(now)
+
+    def _watch(self):
+        next_write = 0.0
+        while not self._stopping.wait(min(0.05, self.interval / 2)):
+            beat = self.beat
+            if self._stall is None and time.monotonic() - beat > self.interval + self.slow_callback:
+                self._capture(beat)
+            if self.status_file and time.monotonic() >= next_write:
+                next_write = time.monotonic() + 1.0
+                self._write_status()
+
+    def _capture(self, beat: float):
+        """Record what the loop thread is running (called from the watchdog)"""
+        try:
+            frame = sys._current_frames().get(self._loop_thread)
+            task = asyncio.current_task(self._loop)
+        except Exception as e:
+            logger.debug(f"Could not inspect blocked loop: {e}")
+            return
+        stack, coroutines = [], []
+        while frame is not None:
+            label = code_label(frame.f_code)
+            stack.append(label)
+            if frame.f_code.co_flags & CO_COROUTINE:
+                coroutines.append(label)
+            frame = frame.f_back
+        if self.beat != beat:
+            # The loop moved on while we looked
+            return
+        self._stall = {
+            'at': datetime.utcnow().isoformat(),
+            'task': task.get_name() if task else None,
+            # Outermost coroutine is the task's own; innermost is where it stopped yielding
+            'coroutine': coroutines[-1] if coroutines else None,
+            'blocking_in': coroutines[0] if coroutines else (stack[0] if stack else None),
+            'stack': stack[:20]
+        }
+
+    def lag_percentiles(self) -> Dict[str, float]:
+        lags = sorted(self.lags)
+        if not lags:
+            return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+        pick = lambda q: round(lags[min(len(lags) - 1, int(len(lags) * q))] * 1000, 2)
+        return {'p50': pick(0.5), 'p95': pick(0.95), 'p99': pick(0.99), 'max': round(lags[-1] * 1000, 2)}
+
+    def status(self) -> Dict[str, Any]:
+        lag_ms = self.lag_percentiles()
+        stall = self._stall
+        stalled_for = max(0.0, time.monotonic() - self.beat - self.interval) if stall else 0.0
+        return {
+            'pid': os.getpid(),
+            'written_at': time.time(),
+            'ready': stall is None and lag_ms['p95'] <= self.ready_p95 * 1000,
+            'stalled_for': round(stalled_for, 2),
+            'current_stall': stall,
+            'lag_ms': {'last': round(self.last_lag * 1000, 2), **lag_ms},
+            'ready_p95_ms': self.ready_p95 * 1000,
+            'window_seconds': self.window,
+            'samples': len(self.lags),
+            'slow_callbacks': self.slow_callback_count,
+            'recent_slow_callbacks': list(self.slow_callbacks)[-10:]
+        }
+
+    def _write_status(self):
+        tmp = f"{self.status_file}.tmp"
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.status(), f, default=str)
+            os.replace(tmp, self.status_file)
+        except Exception as e:
+            logger.debug(f"Could not write loop status to {self.status_file}: {e}")
+
+    async def stop(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if self._watchdog:
+            self._stopping.set()
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+            if self.status_file:
+                try:
+                    os.remove(self.status_file)
+                except OSError:
+                    pass
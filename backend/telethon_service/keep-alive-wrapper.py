@@ -6,6 +6,7 @@ Ensures the Telethon service stays running on Render with auto-restart on failur
 """
 
 import asyncio
+import json
 import subprocess
 import signal
 import time
@@ -13,6 +14,7 @@ import os
 import sys
 import logging
 import aiohttp
+import tempfile
 from datetime import datetime, timedelta
 
 # Configuration
@@ -20,9 +22,20 @@ HEALTH_CHECK_INTERVAL = int(os.getenv('HEALTH_CHECK_INTERVAL', '300'))  # 5 minu
 RESTART_DELAY = 5  # 5 seconds
 MAX_RESTART_ATTEMPTS = 10
 RESTART_WINDOW = 3600  # 1 hour
+READINESS_TIMEOUT = int(os.getenv('READINESS_TIMEOUT', '10'))
+# While the service is alive but its event loop is saturated, check this often instead
+SATURATED_CHECK_INTERVAL = int(os.getenv('SATURATED_CHECK_INTERVAL', '30'))
+# Restart anyway once it has been saturated this long
+SATURATED_RESTART_AFTER = int(os.getenv('SATURATED_RESTART_AFTER', '900'))
+# The service's watchdog thread rewrites this every second, even while its event loop is blocked
+LOOP_STATUS_FILE = os.getenv('LOOP_STATUS_FILE') or os.path.join(tempfile.gettempdir(), 'kol-telethon-loop-status.json')
+LOOP_STATUS_STALE_AFTER = 30
+
+HEALTHY, SATURATED, DEAD = 'healthy', 'saturated', 'dead'
 
 restart_count = 0
 last_restart_time = 0
+saturated_since = None
 telethon_process = None
 is_shutting_down = False
 
@@ -66,11 +79,15 @@ async def start_telethon():
     logger.info("🚀 Starting KOL Tracker Telethon Service...")
 
     try:
+        # A status file left by the previous process must not vouch for the new one
+        if os.path.exists(LOOP_STATUS_FILE):
+            os.remove(LOOP_STATUS_FILE)
+
         telethon_process = await asyncio.create_subprocess_exec(
             'python', 'main.py',
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.STDOUT,
-            env=os.environ.copy()
+            env={**os.environ, 'LOOP_STATUS_FILE': LOOP_STATUS_FILE}
         )
 
         # Monitor process output
@@ -147,27 +164,60 @@ async def restart_telethon():
     # Start new process
     await start_telethon()
 
+def describe_stall(status):
+    """One line on what is holding the service's event loop"""
+    stall = status.get('current_stall') or (status.get('recent_slow_callbacks') or [{}])[-1]
+    lag = status.get('lag_ms', {})
+    return (f"p95 lag {lag.get('p95')}ms, stalled {status.get('stalled_for', 0)}s, "
+            f"last blocked by {stall.get('coroutine') or 'unknown'} (task {stall.get('task')})")
+
+def read_loop_status():
+    """The watchdog's status file, or None if it is missing or stale"""
+    try:
+        with open(LOOP_STATUS_FILE) as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - status.get('written_at', 0) > LOOP_STATUS_STALE_AFTER:
+        return None
+    return status
+
 async def perform_health_check():
-    """Perform health check on Telethon service"""
+    """Classify the Telethon service as healthy, saturated (alive, event loop busy) or dead"""
+    if not telethon_process or telethon_process.returncode is not None:
+        logger.warning("⚠️  Telethon process is not running")
+        return DEAD
+
     try:
         port = os.getenv('PORT', '8000')
-        url = f"http://localhost:{port}/health"
+        url = f"http://localhost:{port}/ready"
         
-        timeout = aiohttp.ClientTimeout(total=10)
+        timeout = aiohttp.ClientTimeout(total=READINESS_TIMEOUT)
         async with aiohttp.ClientSession(timeout=timeout) as session:
             async with session.get(url) as response:
                 if response.status == 200:
-                    return True
-                else:
-                    logger.warning(f"⚠️  Health check failed with status: {response.status}")
-                    return False
+                    return HEALTHY
+                if response.status == 503:
+                    body = await response.json(content_type=None)
+                    logger.warning(f"🐢 Telethon is saturated: {describe_stall(body.get('detail', {}))}")
+                    return SATURATED
+                logger.warning(f"⚠️  Health check failed with status: {response.status}")
+                return DEAD
                     
     except Exception as error:
         logger.warning(f"⚠️  Health check error: {error}")
-        return False
+
+    # No answer over HTTP: the watchdog thread keeps writing its status file while the loop is blocked
+    status = read_loop_status()
+    if status is None:
+        logger.warning("⚠️  No fresh event-loop status from Telethon")
+        return DEAD
+    logger.warning(f"🐢 Telethon is alive but not answering: {describe_stall(status)}")
+    return SATURATED
 
 async def health_check_loop():
     """Run periodic health checks"""
+    global saturated_since
     logger.info(f"🏥 Health check started (interval: {HEALTH_CHECK_INTERVAL}s)")
     
     # Wait for service to start up
@@ -176,12 +226,26 @@ async def health_check_loop():
     while not is_shutting_down:
         logger.info("🏥 Performing health check...")
         
-        is_healthy = await perform_health_check()
+        state = await perform_health_check()
         
-        if is_healthy:
+        if state == HEALTHY:
             logger.info("✅ Health check passed")
+            saturated_since = None
+        elif state == SATURATED:
+            saturated_since = saturated_since or time.time()
+            saturated_for = time.time() - saturated_since
+            if saturated_for < SATURATED_RESTART_AFTER:
+                logger.warning(f"⏳ Not restarting: saturated for {saturated_for:.0f}s "
+                               f"(restart after {SATURATED_RESTART_AFTER}s)")
+                await asyncio.sleep(SATURATED_CHECK_INTERVAL)
+                continue
+            logger.error(f"❌ Saturated for {saturated_for:.0f}s - restarting Telethon")
+            saturated_since = None
+            await restart_telethon()
+            break  # Exit loop as restart will create new health check
         else:
             logger.error("❌ Health check failed - restarting Telethon")
+            saturated_since = None
             await restart_telethon()
             break  # Exit loop as restart will create new health check
             
@@ -241,6 +305,7 @@ async def main():
     logger.info("🌟 KOL Tracker Telethon Keep-Alive Wrapper Starting...")
     logger.info("📊 Configuration:")
     logger.info(f"   - Health Check Interval: {HEALTH_CHECK_INTERVAL}s")
+    logger.info(f"   - Restart When Saturated After: {SATURATED_RESTART_AFTER}s")
     logger.info(f"   - Max Restart Attempts: {MAX_RESTART_ATTEMPTS}")
     logger.info(f"   - Keep Alive: {'Enabled' if os.getenv('KEEP_ALIVE') == 'true' else 'Disabled'}")
 
@@ -5,6 +5,8 @@ from typing import List, Dict, Optional, Any
 from dataclasses import dataclass
 import asyncio
 
+from message_records import MessageRecord, project_messages
+
 logger = logging.getLogger(__name__)
 
 @dataclass
@@ -29,7 +31,7 @@ class KOLMetrics:
     is_admin: bool
     is_verified: bool
     follower_count: int
-    recent_posts: List[Dict]
+    recent_posts: List[MessageRecord]
     engagement_rate: float
     avg_views: float
     avg_forwards: float
@@ -45,21 +47,32 @@ class KOLMetrics:
 class AdvancedKOLDetector:
     """Advanced KOL detection system with sophisticated filtering"""
     
+    # Channel messages scanned per participant when looking for their posts
+    history_limit = 200
+    
     def __init__(self, criteria: KOLCriteria = None):
         self.criteria = criteria or KOLCriteria()
         
-    async def analyze_potential_kols(self, client, channel, participants: List[Any]) -> List[KOLMetrics]:
-        """Analyze a list of participants to identify genuine KOLs"""
+    async def analyze_potential_kols(self, client, channel, participants: List[Any], on_kol=None,
+                                     channel_posts: Optional[List[MessageRecord]] = None) -> List[KOLMetrics]:
+        """Analyze a list of participants to identify genuine KOLs
+        
+        on_kol, when given, is awaited with each KOL as soon as it qualifies.
+        channel_posts, when given, replaces the per-user history fetch with
+        already collected MessageRecords.
+        """
         kol_candidates = []
         
         logger.info(f"Analyzing {len(participants)} participants for KOL potential")
         
         for participant in participants:
             try:
-                metrics = await self._analyze_single_user(client, channel, participant)
+                metrics = await self._analyze_single_user(client, channel, participant, channel_posts)
                 if metrics and metrics.qualifies_as_kol:
                     kol_candidates.append(metrics)
                     logger.info(f"Found KOL candidate: {metrics.username or metrics.first_name} (Score: {metrics.influence_score:.2f})")
+                    if on_kol:
+                        await on_kol(metrics)
                 
             except Exception as e:
                 logger.warning(f"Error analyzing participant {getattr(participant, 'user_id', 'unknown')}: {e}")
@@ -71,7 +84,7 @@ class AdvancedKOLDetector:
         logger.info(f"Identified {len(kol_candidates)} genuine KOLs from {len(participants)} participants")
         return kol_candidates
     
-    async def _analyze_single_user(self, client, channel, participant) -> Optional[KOLMetrics]:
+    async def _analyze_single_user(self, client, channel, participant, channel_posts: Optional[List[MessageRecord]] = None) -> Optional[KOLMetrics]:
         """Analyze a single user for KOL potential"""
         try:
             user_id = getattr(participant, 'user_id', None)
@@ -88,7 +101,7 @@ class AdvancedKOLDetector:
                     return None
             
             # Get user's recent messages in this channel
-            recent_posts = await self._get_user_recent_posts(client, channel, user_id)
+            recent_posts = await self._get_user_recent_posts(client, channel, user_id, channel_posts=channel_posts)
             
             # Calculate all metrics
             metrics = await self._calculate_user_metrics(user, participant, recent_posts)
@@ -102,38 +115,23 @@ class AdvancedKOLDetector:
             logger.warning(f"Error analyzing user {user_id}: {e}")
             return None
     
-    async def _get_user_recent_posts(self, client, channel, user_id: int, limit: int = 50) -> List[Dict]:
+    async def _get_user_recent_posts(self, client, channel, user_id: int, limit: int = 50,
+                                     channel_posts: Optional[List[MessageRecord]] = None) -> List[MessageRecord]:
         """Get recent posts by user in the channel"""
         try:
-            # Get recent messages from the channel
-            messages = await client.get_messages(channel, limit=200)  # Get more to find user's posts
+            if channel_posts is None:
+                # Get recent messages from the channel
+                channel_posts = project_messages(await client.get_messages(channel, limit=self.history_limit))  # Get more to find user's posts
             
-            user_posts = []
-            for msg in messages:
-                if msg.from_id and hasattr(msg.from_id, 'user_id') and msg.from_id.user_id == user_id:
-                    if msg.message:  # Only count messages with content
-                        post_data = {
-                            'id': msg.id,
-                            'date': msg.date,
-                            'text': msg.message,
-                            'views': getattr(msg, 'views', 0),
-                            'forwards': getattr(msg, 'forwards', 0),
-                            'replies': getattr(msg, 'replies', {}).get('replies', 0) if hasattr(msg, 'replies') else 0,
-                            'reactions': len(getattr(msg, 'reactions', {}).get('results', [])) if hasattr(msg, 'reactions') else 0,
-                            'length': len(msg.message)
-                        }
-                        user_posts.append(post_data)
-                
-                if len(user_posts) >= limit:
-                    break
-                    
+            # Only count messages with content
+            user_posts = [post for post in channel_posts if post.user_id == user_id and post.text]
             return user_posts[:limit]
             
         except Exception as e:
             logger.warning(f"Error getting posts for user {user_id}: {e}")
             return []
     
-    async def _calculate_user_metrics(self, user, participant, recent_posts: List[Dict]) -> KOLMetrics:
+    async def _calculate_user_metrics(self, user, participant, recent_posts: List[MessageRecord]) -> KOLMetrics:
         """Calculate comprehensive metrics for a user"""
         
         # Basic user info
@@ -179,10 +177,10 @@ class AdvancedKOLDetector:
             )
         
         # Calculate engagement metrics
-        total_views = sum(post['views'] for post in recent_posts)
-        total_forwards = sum(post['forwards'] for post in recent_posts)
-        total_reactions = sum(post['reactions'] for post in recent_posts)
-        total_replies = sum(post['replies'] for post in recent_posts)
+        total_views = sum(post.views for post in recent_posts)
+        total_forwards = sum(post.forwards for post in recent_posts)
+        total_reactions = sum(post.reactions for post in recent_posts)
+        total_replies = sum(post.replies for post in recent_posts)
         
         avg_views = total_views / len(recent_posts) if recent_posts else 0
         avg_forwards = total_forwards / len(recent_posts) if recent_posts else 0
@@ -194,7 +192,7 @@ class AdvancedKOLDetector:
         
         # Calculate posting frequency (posts per week)
         if len(recent_posts) >= 2:
-            time_span = recent_posts[0]['date'] - recent_posts[-1]['date']
+            time_span = recent_posts[0].date - recent_posts[-1].date
             days_span = max(time_span.days, 1)
             posting_frequency = (len(recent_posts) / days_span) * 7
         else:
@@ -242,7 +240,7 @@ class AdvancedKOLDetector:
             specialty_tags=specialty_tags
         )
     
-    def _calculate_content_quality(self, posts: List[Dict]) -> float:
+    def _calculate_content_quality(self, posts: List[MessageRecord]) -> float:
         """Calculate content quality score based on post analysis"""
         if not posts:
             return 0.0
@@ -250,9 +248,9 @@ class AdvancedKOLDetector:
         quality_factors = []
         
         for post in posts:
-            text = post['text']
-            length = post['length']
-            views = post['views']
+            text = post.text
+            length = len(text)
+            views = post.views
             
             # Length factor (not too short, not too long)
             length_score = 1.0
@@ -294,7 +292,7 @@ class AdvancedKOLDetector:
             
         return sum(quality_factors) / len(quality_factors)
     
-    def _calculate_bot_probability(self, user, posts: List[Dict]) -> float:
+    def _calculate_bot_probability(self, user, posts: List[MessageRecord]) -> float:
         """Calculate probability that user is a bot"""
         bot_score = 0.0
         
@@ -312,12 +310,12 @@ class AdvancedKOLDetector:
         if posts:
             # Very frequent posting (more than 20 posts per day) suggests bot
             if len(posts) >= 20:
-                time_span = posts[0]['date'] - posts[-1]['date']
+                time_span = posts[0].date - posts[-1].date
                 if time_span.days <= 1:
                     bot_score += 0.4
                     
             # Check for repetitive content
-            texts = [post['text'][:100] for post in posts]  # First 100 chars
+            texts = [post.text[:100] for post in posts]  # First 100 chars
             unique_texts = set(texts)
             if len(unique_texts) < len(texts) * 0.5:  # Less than 50% unique content
                 bot_score += 0.3
@@ -360,12 +358,12 @@ class AdvancedKOLDetector:
             
         return min(base_score, 1.0) * 100  # Convert to 0-100 scale
     
-    def _determine_specialties(self, posts: List[Dict]) -> List[str]:
+    def _determine_specialties(self, posts: List[MessageRecord]) -> List[str]:
         """Determine user's specialty areas based on post content"""
         if not posts:
             return []
             
-        all_text = ' '.join(post['text'].lower() for post in posts)
+        all_text = ' '.join(post.text.lower() for post in posts)
         
         specialties = []
         
@@ -0,0 +1,176 @@
+import logging
+import os
+from collections import deque
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+
+from telethon import events
+
+from message_records import MessageRecord, project_message
+
+logger = logging.getLogger(__name__)
+
+LIVE_BUFFER_SIZE = int(os.getenv('LIVE_BUFFER_SIZE', '2000'))
+LIVE_SEED_LIMIT = int(os.getenv('LIVE_SEED_LIMIT', '200'))
+
+
+@dataclass
+class UserAggregate:
+    """Rolling activity totals for one user over a channel's buffered messages"""
+    user_id: int
+    message_count: int = 0
+    total_views: int = 0
+    total_forwards: int = 0
+    total_replies: int = 0
+    total_reactions: int = 0
+    last_seen: Optional[datetime] = None
+
+
+class ChannelWatch:
+    """Bounded ring buffer of a watched channel's messages with per-user aggregates"""
+
+    def __init__(self, channel_id: int, title: str, username: Optional[str], buffer_size: int = LIVE_BUFFER_SIZE):
+        self.channel_id = channel_id
+        self.title = title
+        self.username = username
+        self.buffer_size = buffer_size
+        self.ids: deque = deque()  # message ids, oldest first
+        self.by_id: Dict[int, MessageRecord] = {}
+        self.user_aggregates: Dict[int, UserAggregate] = {}
+        self.watched_since = datetime.now()
+        self.new_messages = 0
+        self.edited_messages = 0
+        self.handlers: List[tuple] = []
+
+    def _apply(self, post: MessageRecord, sign: int):
+        user_id = post.user_id
+        if not user_id:
+            return
+        aggregate = self.user_aggregates.get(user_id)
+        if aggregate is None:
+            if sign < 0:
+                return
+            aggregate = self.user_aggregates[user_id] = UserAggregate(user_id=user_id)
+        aggregate.message_count += sign
+        aggregate.total_views += sign * post.views
+        aggregate.total_forwards += sign * post.forwards
+        aggregate.total_replies += sign * post.replies
+        aggregate.total_reactions += sign * post.reactions
+        if sign > 0 and (aggregate.last_seen is None or post.date > aggregate.last_seen):
+            aggregate.last_seen = post.date
+        if aggregate.message_count <= 0:
+            del self.user_aggregates[user_id]
+
+    def add(self, post: MessageRecord):
+        if post.id in self.by_id:
+            self.edit(post)
+            return
+        if len(self.ids) >= self.buffer_size:
+            evicted = self.by_id.pop(self.ids.popleft(), None)
+            if evicted:
+                self._apply(evicted, -1)
+        self.ids.append(post.id)
+        self.by_id[post.id] = post
+        self._apply(post, 1)
+
+    def edit(self, post: MessageRecord):
+        current = self.by_id.get(post.id)
+        if current is None:
+            # Edits to messages older than the buffer are ignored
+            return
+        self._apply(current, -1)
+        self.by_id[post.id] = post
+        self._apply(post, 1)
+
+    def recent(self, limit: Optional[int] = None) -> List[MessageRecord]:
+        """Buffered posts, newest first like get_messages"""
+        posts = [self.by_id[message_id] for message_id in reversed(self.ids)]
+        return posts[:limit] if limit else posts
+
+    def stats(self, top_users: int = 10) -> Dict[str, Any]:
+        top = sorted(self.user_aggregates.values(), key=lambda a: a.message_count, reverse=True)[:top_users]
+        return {
+            'channel_id': self.channel_id,
+            'title': self.title,
+            'username': self.username,
+            'buffered_messages': len(self.ids),
+            'buffer_size': self.buffer_size,
+            'tracked_users': len(self.user_aggregates),
+            'new_messages': self.new_messages,
+            'edited_messages': self.edited_messages,
+            'watched_since': self.watched_since.isoformat(),
+            'top_users': [asdict(a) for a in top]
+        }
+
+
+class LiveIngestManager:
+    """Registers NewMessage/MessageEdited handlers for watched channels"""
+
+    def __init__(self, buffer_size: int = LIVE_BUFFER_SIZE, seed_limit: int = LIVE_SEED_LIMIT):
+        self.buffer_size = buffer_size
+        self.seed_limit = seed_limit
+        self.watches: Dict[int, ChannelWatch] = {}
+
+    def get(self, channel_id: Optional[int]) -> Optional[ChannelWatch]:
+        return self.watches.get(channel_id) if channel_id is not None else None
+
+    def find(self, key: str) -> Optional[ChannelWatch]:
+        """Look up a watch by channel username or numeric id"""
+        key = key.lstrip('@').lower()
+        for watch in self.watches.values():
+            if str(watch.channel_id) == key or (watch.username or '').lower() == key:
+                return watch
+        return None
+
+    async def watch(self, client, channel) -> ChannelWatch:
+        existing = self.watches.get(channel.id)
+        if existing:
+            return existing
+
+        watch = ChannelWatch(
+            channel.id,
+            getattr(channel, 'title', ''),
+            getattr(channel, 'username', None),
+            self.buffer_size
+        )
+
+        # Seed with recent history once so the buffer is useful immediately
+        if self.seed_limit:
+            messages = await client.get_messages(channel, limit=min(self.seed_limit, self.buffer_size))
+            for msg in reversed(messages):
+                watch.add(project_message(msg))
+
+        async def on_new_message(event):
+            watch.new_messages += 1
+            watch.add(project_message(event.message))
+
+        async def on_message_edited(event):
+            watch.edited_messages += 1
+            watch.edit(project_message(event.message))
+
+        new_filter = events.NewMessage(chats=channel)
+        edit_filter = events.MessageEdited(chats=channel)
+        client.add_event_handler(on_new_message, new_filter)
+        client.add_event_handler(on_message_edited, edit_filter)
+        watch.handlers = [(client, on_new_message, new_filter), (client, on_message_edited, edit_filter)]
+
+        self.watches[channel.id] = watch
+        logger.info(f"Watching channel {watch.title} ({channel.id}) with {len(watch.ids)} seeded messages")
+        return watch
+
+    def unwatch(self, channel_id: int) -> bool:
+        watch = self.watches.pop(channel_id, None)
+        if not watch:
+            return False
+        for client, callback, event_filter in watch.handlers:
+            try:
+                client.remove_event_handler(callback, event_filter)
+            except Exception as e:
+                logger.debug(f"Could not remove live handler: {e}")
+        logger.info(f"Stopped watching channel {watch.title} ({channel_id})")
+        return True
+
+    def stop_all(self):
+        for channel_id in list(self.watches):
+            self.unwatch(channel_id)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Throughput of the service at different worker counts.
+Starts `uvicorn main:app --workers N` for each N, drives PATH with CONCURRENCY
+clients for DURATION seconds and prints requests/second and latency
+percentiles. Point --path at an endpoint that does real work (e.g. a
+/jobs/{id} lookup or /channel/analyze with a user session) for numbers that
+matter; /health measures framework overhead only.
+
+    python load_test.py --workers 1 2 4 --path /health
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+
+async def wait_until_up(url: str, timeout: float = 60):
+    deadline = time.time() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.time() < deadline:
+            try:
+                async with session.get(url) as response:
+                    if response.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"Service at {url} did not come up")
+
+
+async def drive(url: str, concurrency: int, duration: float):
+    latencies = []
+    errors = 0
+    deadline = time.time() + duration
+
+    async def client(session):
+        nonlocal errors
+        while time.time() < deadline:
+            started = time.perf_counter()
+            try:
+                async with session.get(url) as response:
+                    await response.read()
+                    if response.status >= 500:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+    return latencies, errors
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0
+
+
+def run(workers: int, port: int, path: str, concurrency: int, duration: float):
+    env = dict(os.environ, CLUSTER_MODE='1' if workers > 1 else os.getenv('CLUSTER_MODE', ''))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env
+    )
+    try:
+        url = f"http://127.0.0.1:{port}{path}"
+        asyncio.run(wait_until_up(url))
+        latencies, errors = asyncio.run(drive(url, concurrency, duration))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return {
+        'workers': workers,
+        'requests': len(latencies),
+        'rps': len(latencies) / duration,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'errors': errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--path', default='/health')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=15)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, {args.concurrency} concurrent clients, {args.duration:.0f}s per run, GET {args.path}")
+    baseline = None
+    for workers in args.workers:
+        result = run(workers, args.port, args.path, args.concurrency, args.duration)
+        baseline = baseline or result['rps']
+        print(f"  workers={result['workers']:<3} {result['rps']:8.1f} req/s  ({result['rps'] / baseline:.2f}x)  "
+              f"p50={result['p50_ms']:.1f}ms  p95={result['p95_ms']:.1f}ms  errors={result['errors']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,14 @@ import os
 import asyncio
 import logging
 import json
+import time
 import traceback
 import uuid
 from typing import Optional, List, Dict, Any
-from datetime import datetime, timedelta
-from fastapi import FastAPI, HTTPException
+from datetime import datetime, timedelta, timezone
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 from telethon import TelegramClient, events
 from telethon.errors import SessionPasswordNeededError, PhoneCodeInvalidError, PasswordHashInvalidError
@@ -17,11 +19,30 @@ from telethon.tl.functions.channels import GetFullChannelRequest
 from telethon.tl.types import PeerChannel, InputPeerChannel, ChannelParticipantsSearch, ChannelParticipantsAdmins, ChannelParticipantsRecent
 from telethon.sessions import StringSession
 import asyncpg
-from databases import Database
+from database import Database
+from repositories import (kol_from_dict, upsert_kols, leaderboard_page, LEADERBOARD_SORTS, posts_from_records,
+                          upsert_posts, search_posts, SEARCH_MODES, post_history_page, post_history_summary)
+from partitions import MonthlyPartitions, month_start
+from write_behind import WriteBehindBuffer
+from rpc_accounting import AccountedTelegramClient, RpcBudgetExceeded, process_rpcs, scan_rpc_ledger
+from profiling import RequestProfile, profiling_allowed
+from instrumentation import (LoopLagMonitor, SCANS_IN_FLIGHT, SCAN_CONTEXT_REQUESTS, observe_request, register_cache,
+                             register_gauge, render_metrics, time_stage)
+from timeseries import MetricsStore, channel_samples, BUCKETS, CHANNEL_METRICS, KOL_METRICS
 import uvicorn
 
 # Import our advanced KOL detection system
 from kol_detector import AdvancedKOLDetector, KOLCriteria
+from scan_jobs import create_scan_job_queue
+from live_ingest import LiveIngestManager
+from rescan_scheduler import create_rescan_scheduler
+from scan_context import ScanContext
+from participant_snapshots import ParticipantSnapshotStore
+from message_records import project_message, project_messages, truncate_text
+from bot_detection import BotVerdictCache, detect_bot, detect_bots_batch, parse_target, cache_key
+from user_sessions import UserClientPool
+from auth_store import AuthSession, AuthSessionLimitError, create_auth_session_store
+from cluster import SessionLeases, InternalListener, RequestProxy, MAIN_SESSION, ROUTED_HEADER, user_session_key, SERVICE_ROLE, API_ROLE
 
 # Configure logging
 logging.basicConfig(
@@ -36,6 +57,12 @@ API_HASH = os.getenv('API_HASH', '766760d2838474a5e6dd734d785aa7ad')
 SESSION_NAME = os.getenv('SESSION_NAME', 'telegram_session')
 DATABASE_URL = os.getenv('DATABASE_URL', 'postgresql://localhost:5432/kol_tracker')
 PORT = int(os.getenv('PORT', '8000'))
+ENHANCED_RPC_TIMEOUT = float(os.getenv('ENHANCED_RPC_TIMEOUT', '15'))
+# How long an API-role process waits on a queued scan before returning the job id instead
+SCAN_JOB_WAIT_TIMEOUT = float(os.getenv('SCAN_JOB_WAIT_TIMEOUT', '300'))
+BOT_DETECTION_BATCH_LIMIT = int(os.getenv('BOT_DETECTION_BATCH_LIMIT', '100'))
+# Months of posts kept in user_posts; older monthly partitions are dropped
+POST_RETENTION_MONTHS = int(os.getenv('POST_RETENTION_MONTHS', '12'))
 
 logger.info(f"API_ID: {API_ID}")
 logger.info(f"API_HASH: {'set' if API_HASH else 'not set'}")
@@ -80,16 +107,26 @@ class OTPVerifyRequest(BaseModel):
     session_id: Optional[str] = None
     phone_code_hash: Optional[str] = None
 
-# Store active authentication sessions in memory
-# In production, use Redis or a database
-auth_sessions = {}
+class ScanJobRequest(BaseModel):
+    username: str
+    user_id: Optional[str] = None
+    max_rpcs: Optional[int] = None
+
+class BotDetectionBatchRequest(BaseModel):
+    users: List[str]
+    user_id: Optional[str] = None
+    force_refresh: bool = False
+
+# Pending OTP logins, shared through Postgres so any worker can verify them
+auth_store = create_auth_session_store(API_ID, API_HASH)
 
 class TelegramScanner:
     def __init__(self):
         self.client = None
         self.db = None
         self.connected = False
-        self.user_clients = {}  # Store user-specific clients
+        self.leases = SessionLeases()  # Which worker drives each Telegram session
+        self.user_sessions = UserClientPool(API_ID, API_HASH, leases=self.leases)  # Persisted user sessions, LRU of live clients
     
     async def connect(self):
         try:
@@ -101,22 +138,10 @@ class TelegramScanner:
             # Test PostgreSQL connection
             await self.db.fetch_one("SELECT 1")
             logger.info("Connected to PostgreSQL successfully")
+            self.user_sessions.db = self.db
+            self.leases.db = self.db
             
-            logger.info("Creating Telegram client...")
-            # Create Telegram client
-            self.client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
-            
-            logger.info("Starting Telegram client...")
-            await self.client.connect()
-            
-            if not await self.client.is_user_authorized():
-                logger.warning("Main client not authorized. Attempting to start client anyway for user sessions.")
-                logger.warning("For real analysis, users must authenticate via the frontend.")
-            else:
-                logger.info("✅ Main Telegram client authenticated successfully!")
-                me = await self.client.get_me()
-                logger.info(f"👤 Logged in as: {me.first_name} {me.last_name or ''} (@{me.username or 'No username'})")
-                
+            await self.connect_main_client()
             self.connected = True
             
         except Exception as e:
@@ -124,38 +149,63 @@ class TelegramScanner:
             # Don't raise the error, allow service to start for user authentication
             self.connected = True
     
+    async def connect_main_client(self):
+        if SERVICE_ROLE == API_ROLE:
+            logger.info("API role: Telegram sessions are driven by scan-worker processes")
+            return
+        if not await self.leases.acquire(MAIN_SESSION):
+            logger.info("Main Telegram session is owned by another worker; requests needing it are routed there")
+            return
+        
+        logger.info("Creating Telegram client...")
+        # Create Telegram client
+        self.client = AccountedTelegramClient(SESSION_NAME, API_ID, API_HASH)
+        
+        logger.info("Starting Telegram client...")
+        await self.client.connect()
+        
+        if not await self.client.is_user_authorized():
+            logger.warning("Main client not authorized. Attempting to start client anyway for user sessions.")
+            logger.warning("For real analysis, users must authenticate via the frontend.")
+        else:
+            logger.info("✅ Main Telegram client authenticated successfully!")
+            me = await self.client.get_me()
+            logger.info(f"👤 Logged in as: {me.first_name} {me.last_name or ''} (@{me.username or 'No username'})")
+    
+    async def disconnect_main_client(self):
+        if self.client:
+            await self.client.disconnect()
+            self.client = None
+    
     async def disconnect(self):
         if self.client:
             await self.client.disconnect()
         
-        # Disconnect all user clients
-        for client in self.user_clients.values():
-            try:
-                await client.disconnect()
-            except:
-                pass
-        self.user_clients.clear()
+        # Disconnect all user clients; their sessions stay persisted
+        await self.user_sessions.close()
+        # Leases are released only once nothing here is connected any more
+        await self.leases.stop()
         self.connected = False
 
     async def create_user_client(self, user_id: str) -> TelegramClient:
         """Create a new Telegram client for a specific user"""
-        session_name = f"user_{user_id}_session"
-        client = TelegramClient(StringSession(), API_ID, API_HASH)
+        client = AccountedTelegramClient(StringSession(), API_ID, API_HASH)
         await client.connect()
         return client
 
     async def get_user_client(self, user_id: str) -> Optional[TelegramClient]:
-        """Get existing user client or None"""
-        client = self.user_clients.get(user_id)
+        """Get the user's client, reconnecting from the stored session if needed"""
+        try:
+            client = await self.user_sessions.get(user_id)
+        except Exception as e:
+            logger.warning(f"Could not restore session for {user_id}: {e}")
+            client = None
         logger.info(f"Getting client for {user_id}: {'found' if client else 'not found'}")
-        logger.info(f"Current stored clients: {list(self.user_clients.keys())}")
         return client
     
-    async def store_user_client(self, user_id: str, client: TelegramClient):
-        """Store user client for reuse"""
-        self.user_clients[user_id] = client
-        logger.info(f"Stored client for {user_id}. Total clients: {len(self.user_clients)}")
-        logger.info(f"Current stored clients: {list(self.user_clients.keys())}")
+    async def store_user_client(self, user_id: str, client: TelegramClient, phone_number: Optional[str] = None):
+        """Persist the user's session and keep the client for reuse"""
+        await self.user_sessions.store(user_id, client, phone_number)
     
     async def get_channel_info(self, channel_url: str):
         try:
@@ -204,8 +254,8 @@ class TelegramScanner:
             # Get channel entity
             channel = await self.client.get_entity(username)
             
-            # Get recent messages
-            messages = await self.client.get_messages(channel, limit=limit)
+            # Get recent messages, projected so the raw Message objects can be released
+            messages = project_messages(await self.client.get_messages(channel, limit=limit))
             
             analysis = {
                 'total_messages': len(messages),
@@ -222,16 +272,9 @@ class TelegramScanner:
             total_forwards = 0
             total_reactions = 0
             
-            for msg in messages:
-                if msg.message:
-                    message_data = {
-                        'id': msg.id,
-                        'date': msg.date.isoformat(),
-                        'message': msg.message[:200] + '...' if len(msg.message) > 200 else msg.message,
-                        'views': getattr(msg, 'views', 0),
-                        'forwards': getattr(msg, 'forwards', 0),
-                        'reactions': len(getattr(msg, 'reactions', [])) if hasattr(msg, 'reactions') and msg.reactions else 0
-                    }
+            for post in messages:
+                if post.text:
+                    message_data = self._message_summary(post)
                     
                     analysis['messages'].append(message_data)
                     total_views += message_data['views']
@@ -253,18 +296,264 @@ class TelegramScanner:
         except Exception as e:
             logger.error(f"Error analyzing channel: {e}")
             raise HTTPException(status_code=400, detail=str(e))
+    
+    async def analyze_channel_messages_streaming(self, channel_url: str, limit: int = 1000, page_size: int = 50, cursor: Optional[int] = None):
+        """Analyze a deep history window in constant memory with a cursor-paginated listing
+        
+        Without a cursor, statistics are accumulated over the whole window while
+        iterating and only the first page of messages is kept. With a cursor
+        (the next_cursor of a previous page) only that listing page is fetched.
+        """
+        try:
+            if not self.connected:
+                raise HTTPException(status_code=503, detail="Service not connected")
+                
+            # Extract channel username from URL
+            if 't.me/' in channel_url:
+                username = channel_url.split('t.me/')[-1]
+            else:
+                username = channel_url
+                
+            # Get channel entity
+            channel = await self.client.get_entity(username)
+            
+            page = []
+            next_cursor = None
+            
+            if cursor is not None:
+                fetched = 0
+                async for msg in self.client.iter_messages(channel, limit=page_size, offset_id=cursor):
+                    post = project_message(msg)
+                    fetched += 1
+                    next_cursor = post.id
+                    if post.text:
+                        page.append(self._message_summary(post))
+                return {
+                    'messages': page,
+                    'next_cursor': next_cursor if fetched >= page_size else None,
+                    'statistics': None
+                }
+            
+            total_messages = 0
+            total_views = 0
+            total_forwards = 0
+            total_reactions = 0
+            newest_date = None
+            oldest_date = None
+            
+            async for msg in self.client.iter_messages(channel, limit=limit):
+                post = project_message(msg)
+                total_messages += 1
+                if newest_date is None:
+                    newest_date = post.date
+                oldest_date = post.date
+                
+                if post.text:
+                    total_views += post.views
+                    total_forwards += post.forwards
+                    total_reactions += post.reactions
+                    
+                    # Keep only the first page; everything else is folded into the totals
+                    if len(page) < page_size:
+                        page.append(self._message_summary(post))
+                        next_cursor = post.id
+            
+            statistics = {
+                'avg_views': 0,
+                'avg_forwards': 0,
+                'total_reactions': 0,
+                'message_frequency': 0
+            }
+            if total_messages > 0:
+                statistics['avg_views'] = total_views / total_messages
+                statistics['avg_forwards'] = total_forwards / total_messages
+                statistics['total_reactions'] = total_reactions
+                
+                # Calculate message frequency (messages per day)
+                if total_messages > 1:
+                    time_diff = newest_date - oldest_date
+                    statistics['message_frequency'] = total_messages / max(time_diff.days, 1)
+            
+            return {
+                'total_messages': total_messages,
+                'statistics': statistics,
+                'messages': page,
+                'next_cursor': next_cursor if len(page) >= page_size else None
+            }
+            
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error analyzing channel: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    @staticmethod
+    def _message_summary(post) -> dict:
+        return {
+            'id': post.id,
+            'date': post.date.isoformat(),
+            'message': truncate_text(post.text),
+            'views': post.views,
+            'forwards': post.forwards,
+            'reactions': post.reactions
+        }
 
 # Global scanner instance
 scanner = TelegramScanner()
 
+# Watched channels fed by live NewMessage/MessageEdited events
+live_ingest = LiveIngestManager()
+
+# Bot-detection verdicts cached in bot_detections
+bot_verdicts = BotVerdictCache()
+
+# Scan snapshots for growth charts
+metrics_store = MetricsStore()
+
+# Monthly user_posts partitions, created ahead of writes and dropped past retention
+post_partitions = MonthlyPartitions('user_posts', POST_RETENTION_MONTHS)
+
+# Scan results are written behind the response, batched per table
+write_buffer = WriteBehindBuffer()
+
+# Event-loop lag sampled for /metrics
+loop_lag = LoopLagMonitor()
+
+# Last participant lists per channel, refreshed with Telegram's hash so unchanged lists aren't resent
+participant_snapshots = ParticipantSnapshotStore()
+
+# Read at scrape time by /metrics
+register_cache('participant_snapshots', lambda: (participant_snapshots.hits, participant_snapshots.misses))
+register_cache('bot_verdicts', lambda: (bot_verdicts.hits, bot_verdicts.misses))
+register_gauge('kol_write_buffer_depth', 'Rows waiting in the write-behind buffer', lambda: write_buffer.depth)
+register_gauge('kol_db_connections_in_use', 'Pool connections checked out',
+               lambda: scanner.db.stats()['in_use'] if scanner.db else 0)
+register_gauge('kol_user_clients_live', 'Connected per-user Telegram clients', lambda: len(scanner.user_sessions.live))
+register_gauge('kol_watched_channels', 'Channels with live ingest', lambda: len(live_ingest.watches))
+register_gauge('kol_event_loop_lag_last_seconds', 'Most recent event-loop lag sample', lambda: loop_lag.last_lag)
+register_gauge('kol_event_loop_lag_p95_seconds', 'p95 event-loop lag over LOOP_LAG_WINDOW',
+               lambda: loop_lag.lag_percentiles()['p95'] / 1000)
+
 @app.on_event("startup")
 async def startup_event():
     logger.info("Starting FastAPI server...")
+    loop_lag.start()
+    if scanner.leases.cluster_mode:
+        scanner.leases.address = await internal_listener.start()
+        logger.info(f"Cluster worker {scanner.leases.worker_id} reachable at {scanner.leases.address}")
     await scanner.connect()
+    scanner.leases.on_acquired = on_lease_acquired
+    scanner.leases.on_lost = on_lease_lost
+    await scanner.leases.start(claims=[] if SERVICE_ROLE == API_ROLE else [MAIN_SESSION])
+    write_buffer.db = scanner.db
+    write_buffer.register('user_posts', write_posts)
+    write_buffer.register('kols', upsert_kols)
+    write_buffer.register('metric_samples', metrics_store.write)
+    write_buffer.register('bot_detections', bot_verdicts.write)
+    await write_buffer.start()
+    bot_verdicts.db = scanner.db
+    bot_verdicts.buffer = write_buffer
+    metrics_store.db = scanner.db
+    await metrics_store.start()
+    if scanner.db and scanner.db.is_connected:
+        post_partitions.start(scanner.db)
+    await scanner.user_sessions.start()
+    auth_store.db = scanner.db
+    await auth_store.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await scan_jobs.close()
+    await rescan_scheduler.stop()
+    await auth_store.stop()
+    await metrics_store.stop()
+    await post_partitions.stop()
+    live_ingest.stop_all()
+    # Drain queued writes while the pool is still open
+    await write_buffer.stop()
     await scanner.disconnect()
+    await request_proxy.close()
+    await internal_listener.stop()
+    await loop_lag.stop()
+
+# Multi-worker mode: each Telegram session is driven by the worker holding its lease,
+# and requests that need a session are forwarded to that worker's internal listener
+internal_listener = InternalListener(app)
+request_proxy = RequestProxy(scanner.leases.worker_id)
+CLUSTER_ROUTED_PREFIXES = ('/channel/info/', '/channel/analyze/', '/bot-detection/', '/watch', '/schedule', '/user-session/')
+if SERVICE_ROLE != API_ROLE:
+    # API processes hand scans to the job queue instead of forwarding them
+    CLUSTER_ROUTED_PREFIXES += ('/scan/',)
+
+async def on_lease_acquired(key: str):
+    if key == MAIN_SESSION:
+        logger.info("Took over the main Telegram session")
+        await scanner.connect_main_client()
+        if scan_jobs.available:
+            await scan_jobs.start()
+
+async def on_lease_lost(key: str):
+    if key == MAIN_SESSION:
+        live_ingest.stop_all()
+        await scan_jobs.stop()
+        await scanner.disconnect_main_client()
+    else:
+        await scanner.user_sessions.drop(key.split(':', 1)[1])
+
+async def session_owner_address(request) -> Optional[str]:
+    """Internal address of the worker that should serve request, None to serve it here"""
+    leases = scanner.leases
+    user_id = request.query_params.get('user_id')
+    if request.url.path.startswith('/user-session/'):
+        user_id = request.url.path.split('/')[2]
+    if user_id:
+        key = user_session_key(user_id)
+        address = await leases.owner_address(key)
+        if address or key in leases.held or await scanner.user_sessions.has_session(user_id):
+            return address
+    # No session of the user's own, so the request falls back to the main client
+    return await leases.owner_address(MAIN_SESSION)
+
+@app.middleware("http")
+async def route_to_session_owner(request, call_next):
+    if scanner.leases.enabled and not request.headers.get(ROUTED_HEADER) \
+            and request.url.path.startswith(CLUSTER_ROUTED_PREFIXES):
+        try:
+            address = await session_owner_address(request)
+        except Exception as e:
+            logger.warning(f"Could not resolve session owner: {e}")
+            address = None
+        if address:
+            request.state.forwarded = True
+            return await request_proxy.forward(request, address)
+    return await call_next(request)
+
+@app.middleware("http")
+async def record_request_latency(request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get('route')
+        if route is not None:
+            name = route.path
+        else:
+            name = 'forwarded' if getattr(request.state, 'forwarded', False) else 'unmatched'
+        observe_request(request.method, name, status, time.perf_counter() - started)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/cluster")
+async def cluster_status():
+    """This worker's leases and routing counters"""
+    return {**scanner.leases.stats(), 'pid': os.getpid(), 'proxied_requests': request_proxy.proxied}
 
 # Authentication endpoints
 @app.post("/auth/request-otp")
@@ -281,14 +570,19 @@ async def request_otp(request: OTPRequest):
         
         # Store session information
         session_id = f"auth_{request.user_id}_{uuid.uuid4().hex[:8]}"
-        auth_sessions[session_id] = {
-            'client': client,
-            'phone_number': request.phone_number,
-            'user_id': request.user_id,
-            'phone_code_hash': sent_code.phone_code_hash,
-            'created_at': datetime.now(),
-            'attempts': 0
-        }
+        try:
+            await auth_store.create(AuthSession(
+                session_id=session_id,
+                user_id=request.user_id,
+                phone_number=request.phone_number,
+                phone_code_hash=sent_code.phone_code_hash,
+                session_string=client.session.save(),
+                expires_at=auth_store.new_expiry(),
+                client=client
+            ))
+        except AuthSessionLimitError:
+            await client.disconnect()
+            raise HTTPException(status_code=429, detail="Too many pending logins, please try again shortly")
         
         logger.info(f"OTP sent successfully to {request.phone_number}")
         
@@ -310,18 +604,18 @@ async def verify_otp(request: OTPVerifyRequest):
         logger.info(f"OTP verification for {request.phone_number}")
         
         # Find the authentication session
-        session = auth_sessions.get(request.session_id)
+        session = await auth_store.get(request.session_id)
         if not session:
             raise HTTPException(status_code=400, detail="Invalid or expired session")
         
-        client = session['client']
+        client = await auth_store.client_for(session)
         
         try:
             # Attempt to sign in with the verification code
             user = await client.sign_in(
                 phone=request.phone_number,
                 code=request.otp_code,
-                phone_code_hash=session['phone_code_hash']
+                phone_code_hash=session.phone_code_hash
             )
             
         except SessionPasswordNeededError:
@@ -340,24 +634,19 @@ async def verify_otp(request: OTPVerifyRequest):
                 raise HTTPException(status_code=400, detail="Invalid 2FA password")
                 
         except PhoneCodeInvalidError:
-            session['attempts'] += 1
-            if session['attempts'] >= 3:
+            if await auth_store.record_attempt(session) >= 3:
                 # Clean up session after too many attempts
-                auth_sessions.pop(request.session_id, None)
-                try:
-                    await client.disconnect()
-                except:
-                    pass
+                await auth_store.pop(request.session_id)
             raise HTTPException(status_code=400, detail="Invalid verification code")
         
         # Get user information
         me = await client.get_me()
         
-        # Store the authenticated client for this user
-        await scanner.store_user_client(request.user_id, client)
+        # Clean up auth session; the client now belongs to the user session pool
+        await auth_store.pop(request.session_id, disconnect=False)
         
-        # Clean up auth session
-        auth_sessions.pop(request.session_id, None)
+        # Store the authenticated client for this user
+        await scanner.store_user_client(request.user_id, client, request.phone_number)
         
         # Create user info response
         user_info = {
@@ -385,38 +674,6 @@ async def verify_otp(request: OTPVerifyRequest):
         logger.error(f"Error verifying OTP: {e}")
         raise HTTPException(status_code=500, detail=f"Verification failed: {str(e)}")
 
-# Cleanup expired sessions periodically
-@app.on_event("startup")
-async def start_cleanup_task():
-    async def cleanup_expired_sessions():
-        while True:
-            try:
-                now = datetime.now()
-                expired_sessions = []
-                
-                for session_id, session in auth_sessions.items():
-                    # Sessions expire after 10 minutes
-                    if now - session['created_at'] > timedelta(minutes=10):
-                        expired_sessions.append(session_id)
-                
-                for session_id in expired_sessions:
-                    session = auth_sessions.pop(session_id, None)
-                    if session and 'client' in session:
-                        try:
-                            await session['client'].disconnect()
-                        except:
-                            pass
-                    logger.info(f"Cleaned up expired session: {session_id}")
-                
-                # Sleep for 5 minutes before next cleanup
-                await asyncio.sleep(300)
-                
-            except Exception as e:
-                logger.error(f"Error in cleanup task: {e}")
-                await asyncio.sleep(60)  # Try again in 1 minute
-    
-    asyncio.create_task(cleanup_expired_sessions())
-
 @app.get("/health")
 async def health_check():
     return {
@@ -425,76 +682,225 @@ async def health_check():
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Ready while the event loop keeps up; 503 with lag percentiles and the
+    coroutines behind recent slow callbacks when it doesn't"""
+    status = loop_lag.status()
+    if not status['ready']:
+        raise HTTPException(status_code=503, detail=status)
+    return status
+
 @app.get("/channel/info/{channel_url:path}")
 async def get_channel_info(channel_url: str):
     return await scanner.get_channel_info(channel_url)
 
+def check_profiling(profile: bool, admin_token: Optional[str]):
+    if profile and not profiling_allowed(admin_token):
+        raise HTTPException(status_code=403, detail="Profiling requires a valid X-Admin-Token")
+
+async def run_profiled(name: str, coro) -> dict:
+    """Await coro under a sampling profiler and attach the report to its result"""
+    result, report = await RequestProfile(name).run(coro)
+    return {**result, 'profile': report}
+
 @app.get("/channel/analyze/{channel_url:path}")
-async def analyze_channel(channel_url: str, limit: int = 100):
+async def analyze_channel(channel_url: str, limit: int = 100, stream: bool = False, page_size: int = 50, cursor: Optional[int] = None,
+                          profile: bool = False, x_admin_token: Optional[str] = Header(None)):
+    check_profiling(profile, x_admin_token)
+    if stream or cursor is not None:
+        if profile:
+            raise HTTPException(status_code=400, detail="profile is not supported with stream or cursor")
+        return await scanner.analyze_channel_messages_streaming(channel_url, limit, page_size, cursor)
+    if profile:
+        return await run_profiled(f"analyze {channel_url}", scanner.analyze_channel_messages(channel_url, limit))
     return await scanner.analyze_channel_messages(channel_url, limit)
 
-@app.get("/scan/{username}")
-async def scan_channel(username: str, user_id: str = None):
-    try:
-        logger.info(f"Scanning channel: {username}")
-        
-        # Try to get user-specific client first
-        client = None
-        if user_id:
-            client = await scanner.get_user_client(user_id)
-            logger.info(f"User-specific client for {user_id}: {'found' if client else 'not found'}")
-        
-        # Fall back to main client if no user client
-        if not client:
-            if not scanner.connected or not scanner.client:
-                raise HTTPException(status_code=503, detail="Service not connected")
-            client = scanner.client
-            
-            if not await client.is_user_authorized():
-                raise HTTPException(status_code=401, detail="Authentication required. Please connect your Telegram account first using the 'Connect Telegram' button.")
-        
-        # Get channel entity
-        channel = await client.get_entity(username)
+async def resolve_scan_client(user_id: Optional[str] = None) -> TelegramClient:
+    """Pick the user's own client when available, otherwise the authorized main client"""
+    # Try to get user-specific client first
+    client = None
+    if user_id:
+        client = await scanner.get_user_client(user_id)
+        logger.info(f"User-specific client for {user_id}: {'found' if client else 'not found'}")
+    
+    # Fall back to main client if no user client
+    if not client:
+        if not scanner.connected or not scanner.client:
+            raise HTTPException(status_code=503, detail="Service not connected")
+        client = scanner.client
         
+        if not await client.is_user_authorized():
+            raise HTTPException(status_code=401, detail="Authentication required. Please connect your Telegram account first using the 'Connect Telegram' button.")
+    
+    return client
+
+def build_basic_analysis(channel, username: str, message_count: int) -> dict:
+    """Scan fields that only need the channel entity"""
+    return {
+        'channel_id': getattr(channel, 'id', None),
+        'title': getattr(channel, 'title', username),
+        'username': getattr(channel, 'username', username),
+        'description': getattr(channel, 'about', ''),
+        'member_count': getattr(channel, 'participants_count', 0),
+        'verified': getattr(channel, 'verified', False),
+        'scam': getattr(channel, 'scam', False),
+        'fake': getattr(channel, 'fake', False),
+        'message_count': message_count,
+        'recent_activity': [],
+        'enhanced_data': False,
+        'live_data': False,
+        'active_members': 0,
+        'kol_count': 0,
+        'kol_details': [],
+        'admin_count': 0,
+        'bot_count': 0
+    }
+
+async def run_basic_stage(client, channel, username: str, watch=None) -> dict:
+    """Basic analysis from recent messages, read from the live buffer for watched channels"""
+    if watch:
+        posts = watch.recent(50)
+    else:
         # Get recent messages for analysis
-        messages = await client.get_messages(channel, limit=50)
-        
-        # Basic analysis that always works
-        analysis = {
+        try:
+            with time_stage('history'):
+                posts = await client.get_message_records(channel, limit=50)
+        except RpcBudgetExceeded as e:
+            logger.info(f"Skipping history of {username}: {e}")
+            posts = []
+    
+    # Basic analysis that always works
+    analysis = build_basic_analysis(channel, username, len(posts))
+    analysis['live_data'] = watch is not None
+    
+    # Process recent messages
+    for post in posts[:10]:  # Last 10 messages
+        if post.text:
+            analysis['recent_activity'].append({
+                'id': post.id,
+                'date': post.date.isoformat(),
+                'text': truncate_text(post.text),
+                'views': post.views,
+                'forwards': post.forwards
+            })
+    return analysis
+
+async def perform_channel_scan(client: TelegramClient, username: str, checkpoint: Optional[dict] = None, on_stage=None, emit=None,
+                               max_rpcs: Optional[int] = None) -> dict:
+    """Run the scan stages in order, skipping stages already recorded in the checkpoint
+    
+    emit, when given, is awaited with (event, data) as each phase completes.
+    All Telegram fetches go through one ScanContext so nothing is downloaded twice.
+    max_rpcs caps the Telegram requests the scan may send; once spent, the
+    remaining fetches are skipped and whatever was gathered is returned.
+    The requests sent, per TL method, are reported under 'rpc'.
+    """
+    with SCANS_IN_FLIGHT.track_inprogress(), time_stage('total'), scan_rpc_ledger(max_rpcs) as rpcs:
+        analysis = await run_channel_scan(client, username, checkpoint, on_stage, emit)
+        analysis['rpc'] = rpcs.summary()
+        return analysis
+
+async def run_channel_scan(client: TelegramClient, username: str, checkpoint: Optional[dict], on_stage, emit) -> dict:
+    checkpoint = checkpoint or {}
+    completed_stages = checkpoint.get('completed_stages', [])
+    
+    # Fetch the detector's history window up front; the scan's own 50 messages are a slice of it
+    client = ScanContext(client, min_message_window=kol_detector.history_limit)
+    
+    # Get channel entity
+    with time_stage('entity'):
+        channel = await client.get_entity(username)
+    
+    if emit:
+        await emit('entity', {
+            'channel_id': getattr(channel, 'id', None),
             'title': getattr(channel, 'title', username),
             'username': getattr(channel, 'username', username),
-            'description': getattr(channel, 'about', ''),
             'member_count': getattr(channel, 'participants_count', 0),
             'verified': getattr(channel, 'verified', False),
             'scam': getattr(channel, 'scam', False),
-            'fake': getattr(channel, 'fake', False),
-            'message_count': len(messages),
-            'recent_activity': [],
-            'enhanced_data': False,
-            'active_members': 0,
-            'kol_count': 0,
-            'kol_details': [],
-            'admin_count': 0,
-            'bot_count': 0
-        }
+            'fake': getattr(channel, 'fake', False)
+        })
+    
+    watch = live_ingest.get(getattr(channel, 'id', None))
+    
+    # The enhanced-phase requests don't depend on history, so they overlap the basic stage
+    enhanced_inputs = asyncio.ensure_future(fetch_enhanced_inputs(client, channel))
+    try:
+        if 'basic' in completed_stages and checkpoint.get('analysis'):
+            analysis = dict(checkpoint['analysis'])
+        else:
+            analysis = await run_basic_stage(client, channel, username, watch)
+            if on_stage:
+                await on_stage('basic', analysis)
         
-        # Process recent messages
-        for msg in messages[:10]:  # Last 10 messages
-            if msg.message:
-                analysis['recent_activity'].append({
-                    'id': msg.id,
-                    'date': msg.date.isoformat(),
-                    'text': msg.message[:200] + '...' if len(msg.message) > 200 else msg.message,
-                    'views': getattr(msg, 'views', 0),
-                    'forwards': getattr(msg, 'forwards', 0)
-                })
+        if emit:
+            await emit('basic', analysis)
         
         # Enhanced analysis for public groups or groups where user is admin
+        channel_posts = []
         try:
-            await enhance_channel_analysis(client, channel, analysis)
+            if watch:
+                channel_posts = watch.recent()
+            else:
+                with time_stage('history'):
+                    channel_posts = await client.get_message_records(channel, limit=kol_detector.history_limit)
+            await enhance_channel_analysis(
+                client, channel, analysis, emit=emit, channel_posts=channel_posts, inputs=await enhanced_inputs
+            )
         except Exception as e:
             logger.warning(f"Could not fetch enhanced data for {username}: {str(e)}")
             # Continue with basic analysis
+    finally:
+        enhanced_inputs.cancel()
+    
+    analysis['fetch_stats'] = client.stats()
+    SCAN_CONTEXT_REQUESTS.labels('fetched').inc(client.rpc_calls)
+    SCAN_CONTEXT_REQUESTS.labels('reused').inc(client.rpcs_saved)
+    with time_stage('persistence'):
+        await persist_scan_posts(channel, channel_posts)
+        await persist_scan_kols(analysis)
+        await record_scan_metrics(analysis)
+    
+    if on_stage:
+        await on_stage('enhanced', analysis)
+    
+    return analysis
+
+async def scan_via_job_queue(username: str, user_id: Optional[str], max_rpcs: Optional[int] = None) -> dict:
+    """API role: queue the scan for a scan worker and wait for its result"""
+    if not scan_jobs.available:
+        raise HTTPException(status_code=503, detail="Job queue unavailable: database not connected")
+    job_id = await scan_jobs.enqueue(username, user_id, max_rpcs)
+    job = None
+    async for job in scan_jobs.watch(job_id, SCAN_JOB_WAIT_TIMEOUT):
+        pass
+    if job and job['status'] == 'completed':
+        return job['result']
+    if job and job['status'] == 'failed':
+        raise HTTPException(status_code=400, detail=job['error'] or f"Scan of {username} failed")
+    raise HTTPException(status_code=504, detail={'message': 'Scan still running', 'job_id': job_id, 'status_url': f"/jobs/{job_id}"})
+
+def check_rpc_budget(max_rpcs: Optional[int]):
+    if max_rpcs is not None and max_rpcs < 1:
+        raise HTTPException(status_code=400, detail="max_rpcs must be at least 1")
+
+@app.get("/scan/{username}")
+async def scan_channel(username: str, user_id: str = None, max_rpcs: Optional[int] = None, profile: bool = False,
+                       x_admin_token: Optional[str] = Header(None)):
+    check_rpc_budget(max_rpcs)
+    check_profiling(profile, x_admin_token)
+    if SERVICE_ROLE == API_ROLE:
+        if profile:
+            raise HTTPException(status_code=400, detail="profile needs a scanning instance; this one only queues scans")
+        return await scan_via_job_queue(username, user_id, max_rpcs)
+    try:
+        logger.info(f"Scanning channel: {username}")
+        
+        client = await resolve_scan_client(user_id)
+        scan = perform_channel_scan(client, username, max_rpcs=max_rpcs)
+        analysis = await (run_profiled(f"scan {username}", scan) if profile else scan)
         
         logger.info(f"Channel scan completed for: {username}")
         return analysis
@@ -509,38 +915,459 @@ async def scan_channel(username: str, user_id: str = None):
         logger.error(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=400, detail=error_msg)
 
+async def run_scheduled_scan(channel: str, user_id: Optional[str] = None) -> dict:
+    """Scan a channel on behalf of the re-scan scheduler"""
+    client = await resolve_scan_client(user_id)
+    return await perform_channel_scan(client, channel)
 
-async def enhance_channel_analysis(client: TelegramClient, channel, analysis: dict):
+rescan_scheduler = create_rescan_scheduler(run_scheduled_scan)
+
+@app.on_event("startup")
+async def start_rescan_scheduler():
+    await rescan_scheduler.start()
+
+@app.post("/schedule/{username}")
+async def schedule_channel(username: str, user_id: str = None):
+    """Keep a channel fresh with activity-adaptive background re-scans"""
+    entry = rescan_scheduler.add(username, user_id)
+    return {'success': True, 'schedule': entry.to_dict()}
+
+@app.delete("/schedule/{username}")
+async def unschedule_channel(username: str):
+    if not rescan_scheduler.remove(username):
+        raise HTTPException(status_code=404, detail="Channel is not scheduled")
+    return {'success': True, 'message': f'Stopped re-scanning {username}'}
+
+@app.get("/schedule")
+async def get_schedule():
+    """Per-channel next-due times and RPC budget usage"""
+    return rescan_scheduler.snapshot()
+
+@app.post("/watch/{username}")
+async def watch_channel(username: str, user_id: str = None):
+    """Subscribe to live messages of a channel so scans read from memory"""
+    client = await resolve_scan_client(user_id)
+    try:
+        channel = await client.get_entity(username)
+        watch = await live_ingest.watch(client, channel)
+        return {'success': True, 'watch': watch.stats()}
+    except Exception as e:
+        logger.error(f"Error watching channel {username}: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/watch/{username}")
+async def unwatch_channel(username: str):
+    watch = live_ingest.find(username)
+    if not watch:
+        raise HTTPException(status_code=404, detail="Channel is not watched")
+    live_ingest.unwatch(watch.channel_id)
+    return {'success': True, 'message': f'Stopped watching {username}'}
+
+@app.get("/watch")
+async def list_watched_channels():
+    return {'channels': [watch.stats(top_users=0) for watch in live_ingest.watches.values()]}
+
+@app.get("/watch/{username}")
+async def get_watched_channel(username: str, top_users: int = 10):
+    watch = live_ingest.find(username)
+    if not watch:
+        raise HTTPException(status_code=404, detail="Channel is not watched")
+    return watch.stats(top_users=top_users)
+
+def format_sse(event: str, data) -> str:
+    """Encode one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.get("/scan/{username}/stream")
+async def scan_channel_stream(username: str, user_id: str = None, max_rpcs: Optional[int] = None):
+    """Stream scan phases as server-sent events instead of waiting for the whole scan"""
+    check_rpc_budget(max_rpcs)
+    if SERVICE_ROLE == API_ROLE:
+        return await stream_via_job_queue(username, user_id, max_rpcs)
+    # Resolve the client up front so auth failures still return proper status codes
+    client = await resolve_scan_client(user_id)
+    logger.info(f"Streaming scan of channel: {username}")
+    
+    events_queue: asyncio.Queue = asyncio.Queue()
+    
+    async def emit(event: str, data):
+        await events_queue.put((event, data))
+    
+    async def run():
+        try:
+            analysis = await perform_channel_scan(client, username, emit=emit, max_rpcs=max_rpcs)
+            await emit('complete', analysis)
+        except Exception as e:
+            error_msg = str(e) if str(e) else f"Unknown error occurred while scanning {username}"
+            logger.error(f"Error streaming scan of {username}: {error_msg}")
+            await emit('error', {'detail': error_msg})
+        finally:
+            await events_queue.put(None)
+    
+    async def event_stream():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                item = await events_queue.get()
+                if item is None:
+                    break
+                yield format_sse(*item)
+        finally:
+            # Client went away or stream finished; stop any remaining scan work
+            task.cancel()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+async def stream_via_job_queue(username: str, user_id: Optional[str], max_rpcs: Optional[int] = None) -> StreamingResponse:
+    """API role: stream a queued scan's progress as it is checkpointed by a scan worker"""
+    if not scan_jobs.available:
+        raise HTTPException(status_code=503, detail="Job queue unavailable: database not connected")
+    job_id = await scan_jobs.enqueue(username, user_id, max_rpcs)
+    
+    async def event_stream():
+        yield format_sse('job', {'job_id': job_id, 'status_url': f"/jobs/{job_id}"})
+        job = None
+        async for job in scan_jobs.watch(job_id, SCAN_JOB_WAIT_TIMEOUT):
+            if job['status'] == 'completed':
+                yield format_sse('complete', job['result'])
+            elif job['status'] == 'failed':
+                yield format_sse('error', {'detail': job['error']})
+            else:
+                yield format_sse('progress', {'status': job['status'], 'stage': job['stage'], 'progress': job['progress']})
+        if not job or job['status'] not in ('completed', 'failed'):
+            yield format_sse('error', {'detail': 'Scan still running', 'job_id': job_id})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+async def run_scan_job(job: dict, checkpoint: dict, on_stage) -> dict:
+    """Execute a queued scan job, resuming from its persisted checkpoint"""
+    client = await resolve_scan_client(job.get('requested_by'))
+    return await perform_channel_scan(client, job['channel_name'], checkpoint=checkpoint, on_stage=on_stage,
+                                      max_rpcs=checkpoint.get('max_rpcs'))
+
+scan_jobs = create_scan_job_queue(None, run_scan_job)
+
+@app.on_event("startup")
+async def start_scan_job_workers():
+    scan_jobs.db = scanner.db
+    if scan_jobs.available:
+        await scan_jobs.listen(DATABASE_URL)
+    if scan_jobs.available and SERVICE_ROLE == API_ROLE:
+        logger.info("API role: scans are queued for scan-worker processes")
+    elif scan_jobs.available and not scanner.leases.holds(MAIN_SESSION):
+        logger.info("Scan job workers run on the worker holding the main Telegram session")
+    elif scan_jobs.available:
+        await scan_jobs.start()
+    else:
+        logger.warning("PostgreSQL unavailable; scan job workers not started")
+
+@app.post("/jobs/scan")
+async def create_scan_job(request: ScanJobRequest):
+    """Queue a channel scan and return its job id immediately"""
+    if not scan_jobs.available:
+        raise HTTPException(status_code=503, detail="Job queue unavailable: database not connected")
+    
+    check_rpc_budget(request.max_rpcs)
+    job_id = await scan_jobs.enqueue(request.username, request.user_id, request.max_rpcs)
+    return {
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f"/jobs/{job_id}"
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_scan_job(job_id: str):
+    """Report stage progress and, once finished, the result of a scan job"""
+    if not scan_jobs.available:
+        raise HTTPException(status_code=503, detail="Job queue unavailable: database not connected")
+    
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    job = await scan_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+def kol_metrics_to_dict(kol_metrics) -> dict:
+    """Convert detector metrics to the KOL shape returned by the API"""
+    return {
+        'user_id': kol_metrics.user_id,
+        'username': kol_metrics.username,
+        'first_name': kol_metrics.first_name,
+        'last_name': kol_metrics.last_name,
+        'is_admin': kol_metrics.is_admin,
+        'is_verified': kol_metrics.is_verified,
+        'influence_score': kol_metrics.influence_score,
+        'engagement_rate': kol_metrics.engagement_rate,
+        'avg_views': kol_metrics.avg_views,
+        'posting_frequency': kol_metrics.posting_frequency,
+        'content_quality_score': kol_metrics.content_quality_score,
+        'bot_probability': kol_metrics.bot_probability,
+        'specialty_tags': kol_metrics.specialty_tags,
+        'follower_count': kol_metrics.follower_count
+    }
+
+async def persist_scan_posts(channel, posts):
+    """Queue a scan's messages for user_posts so they can be searched without rescanning
+    
+    Posts older than the retention window are skipped.
+    """
+    cutoff = post_partitions.cutoff()
+    posts = [post for post in posts if post.text and month_start(post.date) >= cutoff]
+    if posts:
+        await write_buffer.put('user_posts', posts_from_records(channel, posts))
+
+async def write_posts(db, posts):
+    """Create the posts' monthly partitions first so none land in the default partition"""
+    await post_partitions.ensure(db, [post.date for post in posts])
+    await upsert_posts(db, posts)
+
+async def persist_scan_kols(analysis: dict):
+    """Queue a scan's KOLs for the kols leaderboard, which keeps each KOL's best score"""
+    kols = analysis.get('kol_details') or []
+    channel = analysis.get('username') or analysis.get('title')
+    await write_buffer.put('kols', [kol_from_dict(kol, channel) for kol in kols])
+
+async def record_scan_metrics(analysis: dict):
+    """Queue this scan's channel and KOL metrics for the time series"""
+    await write_buffer.put('metric_samples', metrics_store.sample_rows(channel_samples(analysis)))
+
+def parse_timestamp(value: Optional[str], name: str) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO 8601 timestamp")
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+async def metric_timeseries(entity_type: str, entity_id: int, metric: str, metrics: tuple, bucket: str,
+                            start: Optional[str], end: Optional[str]) -> dict:
+    if not metrics_store.available:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    if metric not in metrics:
+        raise HTTPException(status_code=400, detail=f"metric must be one of {', '.join(metrics)}")
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of {', '.join(BUCKETS)}")
+    points = await metrics_store.series(entity_type, entity_id, metric, bucket,
+                                        parse_timestamp(start, 'start'), parse_timestamp(end, 'end'))
+    return {entity_type + '_id': entity_id, 'metric': metric, 'bucket': bucket, 'points': points}
+
+@app.get("/channel/{channel_id}/timeseries")
+async def channel_timeseries(channel_id: int, metric: str = 'member_count', bucket: str = 'day',
+                             start: Optional[str] = None, end: Optional[str] = None):
+    """Growth of a channel metric over time, from hourly/daily rollups (or raw samples)"""
+    return await metric_timeseries('channel', channel_id, metric, CHANNEL_METRICS, bucket, start, end)
+
+@app.get("/kol/{user_id}/timeseries")
+async def kol_timeseries(user_id: int, metric: str = 'influence_score', bucket: str = 'day',
+                         start: Optional[str] = None, end: Optional[str] = None):
+    return await metric_timeseries('kol', user_id, metric, KOL_METRICS, bucket, start, end)
+
+@app.get("/leaderboard/kols")
+async def kol_leaderboard(limit: int = 50, sort: str = 'score', specialty: Optional[str] = None,
+                          cursor: Optional[str] = None):
+    """Top KOLs across all scanned channels, paged with the returned next_cursor"""
+    if not (scanner.db and scanner.db.is_connected):
+        raise HTTPException(status_code=503, detail="Database not connected")
+    if sort not in LEADERBOARD_SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(LEADERBOARD_SORTS)}")
+    limit = max(1, min(limit, 200))
+    
+    started = datetime.now()
+    try:
+        kols, next_cursor = await leaderboard_page(scanner.db, sort, limit, specialty, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        'kols': [
+            {
+                'username': kol.telegram_username,
+                'display_name': kol.display_name,
+                'influence_score': kol.influence_score,
+                'specialty_tags': kol.tags,
+                'best_channel': kol.best_channel,
+                'last_activity': kol.last_activity.isoformat() if kol.last_activity else None,
+                **kol.stats
+            }
+            for kol in kols
+        ],
+        'next_cursor': next_cursor,
+        'query_ms': round((datetime.now() - started).total_seconds() * 1000, 2)
+    }
+
+def post_to_dict(post) -> dict:
+    return {
+        'channel_id': post.channel_id,
+        'channel': post.telegram_username or post.username,
+        'channel_title': post.channel_title,
+        'message_id': post.message_id,
+        'author_id': post.author_id,
+        'date': post.date.isoformat() if post.date else None,
+        'text': post.text,
+        'views': post.views,
+        'forwards': post.forwards,
+        'engagement_rate': post.engagement_rate
+    }
+
+async def stored_post_history(filters: dict, key: str, since: Optional[str], until: Optional[str],
+                              limit: int, cursor: Optional[str]) -> dict:
+    """A page of stored posts, plus window aggregates on the first page"""
+    if not (scanner.db and scanner.db.is_connected):
+        raise HTTPException(status_code=503, detail="Database not connected")
+    limit = max(1, min(limit, 200))
+    since_at, until_at = parse_timestamp(since, 'since'), parse_timestamp(until, 'until')
+    
+    started = datetime.now()
+    try:
+        page = post_history_page(scanner.db, filters, since_at, until_at, key, limit, cursor)
+        if cursor:
+            (posts, next_cursor), summary = await page, None
+        else:
+            (posts, next_cursor), summary = await asyncio.gather(
+                page, post_history_summary(scanner.db, filters, since_at, until_at)
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        'posts': [post_to_dict(post) for post in posts],
+        'next_cursor': next_cursor,
+        'summary': summary,
+        'query_ms': round((datetime.now() - started).total_seconds() * 1000, 2)
+    }
+
+@app.get("/channel/{channel_id}/messages")
+async def channel_message_history(channel_id: int, since: Optional[str] = None, until: Optional[str] = None,
+                                  author_id: Optional[int] = None, limit: int = 50, cursor: Optional[str] = None):
+    """Stored messages of a channel, newest first, paged over (date, message_id)"""
+    return {
+        'channel_id': channel_id,
+        **await stored_post_history({'channel_id': channel_id, 'author_id': author_id}, 'message_id',
+                                    since, until, limit, cursor)
+    }
+
+@app.get("/kol/{user_id}/posts")
+async def kol_post_history(user_id: int, since: Optional[str] = None, until: Optional[str] = None,
+                           channel_id: Optional[int] = None, limit: int = 50, cursor: Optional[str] = None):
+    """Stored posts by one user across channels, newest first, paged over (date, id)"""
+    return {
+        'user_id': user_id,
+        **await stored_post_history({'author_id': user_id, 'channel_id': channel_id}, 'id',
+                                    since, until, limit, cursor)
+    }
+
+@app.get("/search/posts")
+async def search_stored_posts(q: str, mode: str = 'auto', channel: Optional[str] = None,
+                              author_id: Optional[int] = None, since: Optional[str] = None,
+                              until: Optional[str] = None, limit: int = 50, cursor: Optional[str] = None):
+    """Search stored posts by words, exact phrase or cashtag/address, newest first
+    
+    channel takes a channel id or username; page with the returned next_cursor.
+    """
+    if not (scanner.db and scanner.db.is_connected):
+        raise HTTPException(status_code=503, detail="Database not connected")
+    if mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(SEARCH_MODES)}")
+    if len(q.strip()) < 2:
+        raise HTTPException(status_code=400, detail="q must be at least 2 characters")
+    limit = max(1, min(limit, 200))
+    channel_id = int(channel) if channel and channel.lstrip('-').isdigit() else None
+    
+    started = datetime.now()
+    try:
+        posts, next_cursor = await search_posts(
+            scanner.db, q, mode,
+            channel_id=channel_id,
+            channel=None if channel_id is not None else channel,
+            author_id=author_id,
+            since=parse_timestamp(since, 'since'),
+            until=parse_timestamp(until, 'until'),
+            limit=limit,
+            cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        'posts': [post_to_dict(post) for post in posts],
+        'next_cursor': next_cursor,
+        'query_ms': round((datetime.now() - started).total_seconds() * 1000, 2)
+    }
+
+async def fetch_rpc(request_coro, description: str, timeout: float = ENHANCED_RPC_TIMEOUT):
+    """Await one Telegram request with a timeout, returning None instead of raising"""
+    try:
+        return await asyncio.wait_for(request_coro, timeout)
+    except asyncio.TimeoutError:
+        logger.debug(f"Timed out after {timeout}s getting {description}")
+    except Exception as e:
+        logger.debug(f"Could not get {description}: {e}")
+    return None
+
+async def fetch_enhanced_inputs(client: TelegramClient, channel) -> dict:
+    """Issue the independent enhanced-scan requests concurrently, tolerating partial failure"""
+    snapshot_counters = {'hits': 0, 'misses': 0, 'bytes_fetched': 0, 'bytes_avoided': 0}
+    with time_stage('participants'):
+        full_channel, admin_participants, recent_participants = await asyncio.gather(
+            fetch_rpc(client(GetFullChannelRequest(channel)), 'full channel info'),
+            fetch_rpc(participant_snapshots.fetch(
+                client, channel, ChannelParticipantsAdmins(), offset=0, limit=100, counters=snapshot_counters
+            ), 'admin participants'),
+            fetch_rpc(participant_snapshots.fetch(
+                # Get more recent members to analyze activity
+                client, channel, ChannelParticipantsRecent(), offset=0, limit=200, counters=snapshot_counters
+            ), 'recent participants')
+        )
+    return {
+        'full_channel': full_channel,
+        'admin_participants': admin_participants,
+        'recent_participants': recent_participants,
+        'snapshot_counters': snapshot_counters
+    }
+
+async def enhance_channel_analysis(client: TelegramClient, channel, analysis: dict, emit=None, channel_posts=None, inputs: Optional[dict] = None):
     """Enhanced analysis for public groups or groups where user is admin"""
     try:
         # Check if we can access participant information
         # This works for public groups or groups where the user is admin/member
+        if inputs is None:
+            inputs = await fetch_enhanced_inputs(client, channel)
         
-        # Try to get full channel info first
-        try:
-            full_channel = await client(GetFullChannelRequest(channel))
+        analysis['participant_snapshots'] = {
+            **inputs.get('snapshot_counters', {}),
+            'overall_hit_rate': participant_snapshots.stats()['hit_rate']
+        }
+        
+        full_channel = inputs['full_channel']
+        if full_channel:
             analysis['description'] = getattr(full_channel.full_chat, 'about', analysis['description'])
             total_participants = getattr(full_channel.full_chat, 'participants_count', analysis['member_count'])
             analysis['member_count'] = total_participants
-        except Exception as e:
-            logger.debug(f"Could not get full channel info: {e}")
         
-        # Try to get participants (this requires appropriate permissions)
-        participants = []
+        # Participants are only returned with appropriate permissions
         admins = []
         bots = []
         active_users = set()
         
-        # Get admins first
-        try:
-            admin_participants = await client(GetParticipantsRequest(
-                channel=channel,
-                filter=ChannelParticipantsAdmins(),
-                offset=0,
-                limit=100,
-                hash=0
-            ))
-            
+        admin_participants = inputs['admin_participants']
+        if admin_participants:
             for participant in admin_participants.participants:
                 user_id = getattr(participant, 'user_id', None)
                 if user_id:
@@ -564,20 +1391,12 @@ async def enhance_channel_analysis(client: TelegramClient, channel, analysis: di
                             
                     except StopIteration:
                         continue
-                        
-        except Exception as e:
-            logger.debug(f"Could not get admin participants: {e}")
         
-        # Try to get recent participants (active members)
-        try:
-            recent_participants = await client(GetParticipantsRequest(
-                channel=channel,
-                filter=ChannelParticipantsRecent(),
-                offset=0,
-                limit=200,  # Get more recent members to analyze activity
-                hash=0
-            ))
-            
+        if emit:
+            await emit('admins', {'admin_count': len(admins), 'admins': admins})
+        
+        recent_participants = inputs['recent_participants']
+        if recent_participants:
             for participant in recent_participants.participants:
                 user_id = getattr(participant, 'user_id', None)
                 if user_id:
@@ -596,41 +1415,37 @@ async def enhance_channel_analysis(client: TelegramClient, channel, analysis: di
                             
                     except StopIteration:
                         continue
-                        
-        except Exception as e:
-            logger.debug(f"Could not get recent participants: {e}")
+        
+        if emit:
+            await emit('participants', {
+                'member_count': analysis['member_count'],
+                'active_members': len(active_users),
+                'bot_count': len(bots)
+            })
         
         # Use advanced KOL detection system
         logger.info(f"Analyzing {len(admins)} admins and {len(active_users)} active users for KOL potential")
         
         # Combine admins and recent participants for analysis
-        all_participants = admin_participants.participants if 'admin_participants' in locals() else []
-        if 'recent_participants' in locals():
+        all_participants = []
+        if admin_participants:
+            all_participants.extend(admin_participants.participants)
+        if recent_participants:
             all_participants.extend(recent_participants.participants)
         
         # Use advanced KOL detector to identify genuine KOLs
-        genuine_kols = await kol_detector.analyze_potential_kols(client, channel, all_participants)
+        on_kol = None
+        if emit:
+            async def on_kol(kol_metrics):
+                await emit('kol', kol_metrics_to_dict(kol_metrics))
+        
+        with time_stage('detector'):
+            genuine_kols = await kol_detector.analyze_potential_kols(
+                client, channel, all_participants, on_kol=on_kol, channel_posts=channel_posts
+            )
         
         # Convert to the expected format
-        kols = []
-        for kol_metrics in genuine_kols:
-            kol_info = {
-                'user_id': kol_metrics.user_id,
-                'username': kol_metrics.username,
-                'first_name': kol_metrics.first_name,
-                'last_name': kol_metrics.last_name,
-                'is_admin': kol_metrics.is_admin,
-                'is_verified': kol_metrics.is_verified,
-                'influence_score': kol_metrics.influence_score,
-                'engagement_rate': kol_metrics.engagement_rate,
-                'avg_views': kol_metrics.avg_views,
-                'posting_frequency': kol_metrics.posting_frequency,
-                'content_quality_score': kol_metrics.content_quality_score,
-                'bot_probability': kol_metrics.bot_probability,
-                'specialty_tags': kol_metrics.specialty_tags,
-                'follower_count': kol_metrics.follower_count
-            }
-            kols.append(kol_info)
+        kols = [kol_metrics_to_dict(kol_metrics) for kol_metrics in genuine_kols]
         
         logger.info(f"Identified {len(kols)} genuine KOLs using advanced criteria")
         
@@ -859,8 +1674,22 @@ async def identify_kols_comprehensive(client: TelegramClient, channel, admins: l
         logger.error(f"Comprehensive KOL identification failed: {e}")
         return []
 
+async def detect_bot_cached(client, username: str) -> dict:
+    target = parse_target(username)
+    cached = await bot_verdicts.lookup([target])
+    if cache_key(target) in cached:
+        logger.info(f"Bot detection served from cache for: {username}")
+        return {**cached[cache_key(target)], 'cached': True}
+    
+    analysis = await detect_bot(client, target)
+    await bot_verdicts.store(analysis)
+    analysis['cached'] = False
+    return analysis
+
 @app.get("/bot-detection/analyze/{username}")
-async def analyze_user_bot_detection(username: str, user_id: str = None):
+async def analyze_user_bot_detection(username: str, user_id: str = None, profile: bool = False,
+                                     x_admin_token: Optional[str] = Header(None)):
+    check_profiling(profile, x_admin_token)
     try:
         logger.info(f"Analyzing user for bot detection: {username}")
         
@@ -878,49 +1707,8 @@ async def analyze_user_bot_detection(username: str, user_id: str = None):
             if not await client.is_user_authorized():
                 raise HTTPException(status_code=401, detail="Not authorized. Please authenticate first.")
         
-        # Get user entity
-        user = await client.get_entity(username)
-        
-        # Basic bot detection analysis
-        analysis = {
-            'username': username,
-            'is_bot': getattr(user, 'bot', False),
-            'is_verified': getattr(user, 'verified', False),
-            'is_scam': getattr(user, 'scam', False),
-            'is_fake': getattr(user, 'fake', False),
-            'first_name': getattr(user, 'first_name', ''),
-            'last_name': getattr(user, 'last_name', ''),
-            'phone': getattr(user, 'phone', ''),
-            'bio': getattr(user, 'about', ''),
-            'common_chats_count': getattr(user, 'common_chats_count', 0),
-            'bot_probability': 0.0,
-            'analysis_factors': []
-        }
-        
-        # Calculate bot probability based on various factors
-        bot_score = 0
-        
-        if analysis['is_bot']:
-            bot_score += 100
-            analysis['analysis_factors'].append("Marked as bot by Telegram")
-        
-        if analysis['is_scam']:
-            bot_score += 80
-            analysis['analysis_factors'].append("Marked as scam account")
-        
-        if analysis['is_fake']:
-            bot_score += 70
-            analysis['analysis_factors'].append("Marked as fake account")
-        
-        if not analysis['first_name'] and not analysis['last_name']:
-            bot_score += 20
-            analysis['analysis_factors'].append("No name set")
-        
-        if not analysis['bio']:
-            bot_score += 10
-            analysis['analysis_factors'].append("No bio/description")
-        
-        analysis['bot_probability'] = min(bot_score, 100) / 100
+        detection = detect_bot_cached(client, username)
+        analysis = await (run_profiled(f"bot-detection {username}", detection) if profile else detection)
         
         logger.info(f"Bot detection completed for: {username}")
         return analysis
@@ -929,6 +1717,32 @@ async def analyze_user_bot_detection(username: str, user_id: str = None):
         logger.error(f"Error analyzing user {username}: {e}")
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.post("/bot-detection/batch")
+async def analyze_users_bot_detection_batch(request: BotDetectionBatchRequest):
+    """Bot detection for many usernames or ids, answered from cached verdicts where fresh"""
+    if not request.users:
+        raise HTTPException(status_code=400, detail="No users provided")
+    if len(request.users) > BOT_DETECTION_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {BOT_DETECTION_BATCH_LIMIT} users per batch")
+    
+    try:
+        client = await resolve_scan_client(request.user_id)
+        results = await detect_bots_batch(client, request.users, bot_verdicts, force_refresh=request.force_refresh)
+        
+        return {
+            'results': results,
+            'total': len(results),
+            'cached': sum(1 for r in results if r.get('cached')),
+            'analyzed': sum(1 for r in results if r.get('cached') is False),
+            'failed': sum(1 for r in results if 'error' in r)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in batch bot detection: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/user-session/{user_id}")
 async def get_user_session(user_id: str):
     """Get user session status"""
@@ -967,12 +1781,7 @@ async def get_user_session(user_id: str):
 async def delete_user_session(user_id: str):
     """Delete user session (logout)"""
     try:
-        client = await scanner.get_user_client(user_id)
-        if client:
-            await client.disconnect()
-            # Remove from user_clients
-            if user_id in scanner.user_clients:
-                del scanner.user_clients[user_id]
+        await scanner.user_sessions.remove(user_id)
         
         return {
             'success': True,
@@ -985,6 +1794,33 @@ async def delete_user_session(user_id: str):
             'message': 'Failed to delete session'
         }
 
+@app.get("/db/stats")
+async def database_stats():
+    """Connection pool usage, acquire wait times and query counts"""
+    if not scanner.db:
+        raise HTTPException(status_code=503, detail="Database not configured")
+    return scanner.db.stats()
+
+@app.get("/telegram/rpc-stats")
+async def telegram_rpc_stats():
+    """Telegram requests sent by this process, per TL method, with latency, errors and FloodWaits"""
+    return process_rpcs.summary()
+
+@app.get("/write-buffer/stats")
+async def write_buffer_stats():
+    """Queue depth, flush latency and dropped rows of the write-behind buffer"""
+    return write_buffer.stats()
+
+@app.get("/auth/sessions/stats")
+async def auth_session_stats():
+    """Pending OTP logins and expiry counters"""
+    return auth_store.stats()
+
+@app.get("/user-sessions/stats")
+async def user_session_stats():
+    """Live user client pool size, evictions and reconnect latency"""
+    return scanner.user_sessions.metrics()
+
 if __name__ == "__main__":
     logger.info("Starting FastAPI server...")
     uvicorn.run(
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Measure memory retained by a 10k-message window as raw Telethon Message
+objects versus the MessageRecord projection used by the scan paths.
+Messages are synthetic but carry the nested objects real channel posts have
+(peers, entities, replies, reactions, photo media).
+"""
+
+import gc
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from telethon.tl.types import (
+    Message, PeerChannel, PeerUser, MessageReplies, MessageReactions, ReactionCount, ReactionEmoji,
+    MessageEntityBold, MessageEntityUrl, MessageEntityMention, MessageMediaPhoto, Photo, PhotoSize
+)
+
+from message_records import project_messages
+
+WINDOW = 10_000
+TEXT = ("BTC reclaiming 64k, watching $ETH for a breakout above resistance. "
+        "Entry 3150, TP 3400, SL 3020. Full analysis at https://t.me/example @analyst ") * 2
+
+
+def build_messages(count: int):
+    now = datetime.now(timezone.utc)
+    messages = []
+    for i in range(count):
+        messages.append(Message(
+            id=i + 1,
+            peer_id=PeerChannel(1234567890),
+            date=now - timedelta(minutes=i),
+            message=f"{TEXT} #{i}",
+            from_id=PeerUser(1000 + i % 250),
+            views=1000 + i,
+            forwards=i % 50,
+            replies=MessageReplies(replies=i % 20, replies_pts=i),
+            reactions=MessageReactions(results=[
+                ReactionCount(reaction=ReactionEmoji('👍'), count=i % 30),
+                ReactionCount(reaction=ReactionEmoji('🔥'), count=i % 7)
+            ]),
+            entities=[MessageEntityBold(0, 3), MessageEntityUrl(120, 24), MessageEntityMention(145, 8)],
+            media=MessageMediaPhoto(photo=Photo(
+                id=i, access_hash=i * 7, file_reference=b'\x00' * 32, date=now, dc_id=2,
+                sizes=[PhotoSize('m', 320, 240, 20000), PhotoSize('x', 800, 600, 80000)]
+            )) if i % 4 == 0 else None
+        ))
+    return messages
+
+
+def retained_bytes(factory) -> int:
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+    retained = factory()
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(baseline, 'filename'))
+    del retained
+    return total
+
+
+def main():
+    raw = retained_bytes(lambda: build_messages(WINDOW))
+    projected = retained_bytes(lambda: project_messages(build_messages(WINDOW)))
+    print(f"Window of {WINDOW:,} messages")
+    print(f"  Telethon Message objects: {raw / 1024 / 1024:8.2f} MiB ({raw / WINDOW:,.0f} bytes/message)")
+    print(f"  MessageRecord projection: {projected / 1024 / 1024:8.2f} MiB ({projected / WINDOW:,.0f} bytes/message)")
+    print(f"  Reduction: {raw / max(projected, 1):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
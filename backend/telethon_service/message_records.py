@@ -0,0 +1,39 @@
+from datetime import datetime
+from typing import Iterable, List, NamedTuple, Optional
+
+
+class MessageRecord(NamedTuple):
+    """Fixed-schema projection of a Telethon Message with only the fields we analyze"""
+    id: int
+    date: datetime
+    text: str
+    views: int
+    forwards: int
+    replies: int
+    reactions: int
+    user_id: Optional[int]
+
+
+def project_message(msg) -> MessageRecord:
+    """Project one raw message; the caller should drop its reference to msg afterwards"""
+    replies = getattr(msg, 'replies', None)
+    reactions = getattr(msg, 'reactions', None)
+    from_id = getattr(msg, 'from_id', None)
+    return MessageRecord(
+        id=msg.id,
+        date=msg.date,
+        text=getattr(msg, 'message', None) or '',
+        views=getattr(msg, 'views', None) or 0,
+        forwards=getattr(msg, 'forwards', None) or 0,
+        replies=getattr(replies, 'replies', 0) if replies else 0,
+        reactions=len(getattr(reactions, 'results', None) or []) if reactions else 0,
+        user_id=getattr(from_id, 'user_id', None) if from_id else None
+    )
+
+
+def project_messages(messages: Iterable) -> List[MessageRecord]:
+    return [project_message(msg) for msg in messages]
+
+
+def truncate_text(text: str, length: int = 200) -> str:
+    return text[:length] + '...' if len(text) > length else text
@@ -0,0 +1,105 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional
+
+from telethon.tl.functions.channels import GetParticipantsRequest
+from telethon.tl.types.channels import ChannelParticipantsNotModified
+
+logger = logging.getLogger(__name__)
+
+PARTICIPANT_SNAPSHOT_LIMIT = int(os.getenv('PARTICIPANT_SNAPSHOT_LIMIT', '1000'))
+
+
+def telegram_hash(ids: Iterable[int]) -> int:
+    """Telegram's 64-bit list hash (https://core.telegram.org/api/offsets#hash-generation)"""
+    mask = 0xFFFFFFFFFFFFFFFF
+    acc = 0
+    for value in ids:
+        acc ^= acc >> 21
+        acc ^= (acc << 35) & mask
+        acc ^= acc >> 4
+        acc = (acc + value) & mask
+    # The API expects the value as a signed long
+    return acc - (1 << 64) if acc >= (1 << 63) else acc
+
+
+@dataclass
+class ParticipantSnapshot:
+    """Last full participant list returned for one channel and filter"""
+    result: Any
+    hash: int
+    size_bytes: int
+    fetched_at: float
+
+
+class ParticipantSnapshotStore:
+    """Sends the stored list hash with participant requests and reuses the snapshot when unchanged"""
+
+    def __init__(self, max_snapshots: int = PARTICIPANT_SNAPSHOT_LIMIT):
+        self.max_snapshots = max_snapshots
+        self.snapshots: "OrderedDict[tuple, ParticipantSnapshot]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_fetched = 0
+        self.bytes_avoided = 0
+
+    async def fetch(self, client, channel, participant_filter, offset: int = 0, limit: int = 100,
+                    counters: Optional[Dict[str, int]] = None):
+        """GetParticipantsRequest that falls back to the stored snapshot on ParticipantsNotModified"""
+        key = (getattr(channel, 'id', channel), repr(participant_filter.to_dict()), offset, limit)
+        snapshot = self.snapshots.get(key)
+
+        result = await client(GetParticipantsRequest(
+            channel=channel,
+            filter=participant_filter,
+            offset=offset,
+            limit=limit,
+            hash=snapshot.hash if snapshot else 0
+        ))
+
+        if isinstance(result, ChannelParticipantsNotModified):
+            if snapshot is None:
+                # Only possible if the snapshot was evicted mid-request; the caller treats it as a failure
+                raise ValueError("Participants not modified but no snapshot is stored")
+            self.snapshots.move_to_end(key)
+            self.hits += 1
+            self.bytes_avoided += snapshot.size_bytes
+            self._count(counters, 'hits', 1)
+            self._count(counters, 'bytes_avoided', snapshot.size_bytes)
+            return snapshot.result
+
+        size_bytes = len(bytes(result))
+        self.snapshots[key] = ParticipantSnapshot(
+            result=result,
+            hash=telegram_hash(getattr(p, 'user_id', 0) for p in result.participants),
+            size_bytes=size_bytes,
+            fetched_at=time.time()
+        )
+        self.snapshots.move_to_end(key)
+        while len(self.snapshots) > self.max_snapshots:
+            self.snapshots.popitem(last=False)
+
+        self.misses += 1
+        self.bytes_fetched += size_bytes
+        self._count(counters, 'misses', 1)
+        self._count(counters, 'bytes_fetched', size_bytes)
+        return result
+
+    @staticmethod
+    def _count(counters: Optional[Dict[str, int]], name: str, amount: int):
+        if counters is not None:
+            counters[name] = counters.get(name, 0) + amount
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'snapshots': len(self.snapshots),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            'bytes_fetched': self.bytes_fetched,
+            'bytes_avoided': self.bytes_avoided
+        }
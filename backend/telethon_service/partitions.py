@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import re
+from datetime import date, datetime
+from typing import Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Helpers for tables range-partitioned by month, with partitions named
+# <table>_YYYY_MM. Table names come from code, never from requests.
+
+PARTITION_MAINTENANCE_INTERVAL = 6 * 3600
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_{month:%Y_%m}"
+
+
+async def create_month_partition(db, table: str, month: date) -> bool:
+    name = partition_name(table, month)
+    try:
+        await db.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        )
+        return True
+    except Exception as e:
+        # Another worker may be creating the same partition, or rows for
+        # this month already sit in the default partition
+        logger.debug(f"Could not create partition {name}: {e}")
+        return False
+
+
+async def ensure_month_partitions(db, table: str, months_ahead: int = 2, months_back: int = 0) -> List[str]:
+    """Create any missing monthly partitions around the current month"""
+    current = month_start(datetime.utcnow())
+    created = []
+    for offset in range(-months_back, months_ahead + 1):
+        month = add_months(current, offset)
+        if await create_month_partition(db, table, month):
+            created.append(partition_name(table, month))
+    return created
+
+
+async def list_month_partitions(db, table: str) -> List[date]:
+    rows = await db.fetch_all(
+        """
+        SELECT child.relname AS name FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = :table
+        """,
+        {'table': table}
+    )
+    pattern = re.compile(rf"^{re.escape(table)}_(\d{{4}})_(\d{{2}})$")
+    months = []
+    for row in rows:
+        match = pattern.match(row['name'])
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+async def drop_month_partitions_before(db, table: str, cutoff: date) -> List[str]:
+    """Retention by DROP TABLE: instant, and leaves no dead tuples to vacuum"""
+    dropped = []
+    for month in await list_month_partitions(db, table):
+        if month < month_start(cutoff):
+            name = partition_name(table, month)
+            await db.execute(f"DROP TABLE IF EXISTS {name}")
+            dropped.append(name)
+            logger.info(f"Dropped partition {name}")
+    return dropped
+
+
+class MonthlyPartitions:
+    """Partition upkeep for one month-partitioned table
+
+    maintain() keeps the next months_ahead partitions created and drops
+    those older than retention_months; ensure() creates partitions for
+    the months of rows about to be written, so backfilled history lands
+    in its own month rather than the default partition.
+    """
+
+    def __init__(self, table: str, retention_months: int, months_ahead: int = 2):
+        self.table = table
+        self.retention_months = retention_months
+        self.months_ahead = months_ahead
+        self.known: Set[date] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def cutoff(self) -> date:
+        """Oldest month still retained"""
+        return add_months(month_start(datetime.utcnow()), -self.retention_months)
+
+    async def ensure(self, db, months: Iterable[date]):
+        for month in {month_start(value) for value in months} - self.known:
+            if await create_month_partition(db, self.table, month):
+                self.known.add(month)
+
+    async def maintain(self, db):
+        await self.ensure(db, [add_months(month_start(datetime.utcnow()), offset)
+                               for offset in range(self.months_ahead + 1)])
+        for name in await drop_month_partitions_before(db, self.table, self.cutoff()):
+            self.known = {month for month in self.known if partition_name(self.table, month) != name}
+
+    def start(self, db):
+        if not self._task:
+            self._task = asyncio.create_task(self._maintenance_loop(db))
+
+    async def _maintenance_loop(self, db):
+        while True:
+            try:
+                await self.maintain(db)
+            except Exception as e:
+                logger.warning(f"Partition maintenance for {self.table} failed: {e}")
+            await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
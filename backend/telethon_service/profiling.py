@@ -0,0 +1,215 @@
+import asyncio
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+import weakref
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from inspect import CO_COROUTINE
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Profiling is refused unless this is set and sent back in X-Admin-Token
+PROFILING_ADMIN_TOKEN = os.getenv('PROFILING_ADMIN_TOKEN', '')
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.005'))
+# When set, each report's collapsed stacks are also written here
+PROFILE_DIR = os.getenv('PROFILE_DIR', '')
+
+_active_profile: ContextVar[Optional['RequestProfile']] = ContextVar('request_profile', default=None)
+
+
+def profiling_allowed(admin_token: Optional[str]) -> bool:
+    return bool(PROFILING_ADMIN_TOKEN) and admin_token is not None and \
+        hmac.compare_digest(admin_token.encode(), PROFILING_ADMIN_TOKEN.encode())
+
+
+def code_label(code) -> str:
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)})"
+
+
+def _await_chain(coro):
+    """Labels from a suspended coroutine down to whatever it is waiting on"""
+    labels = []
+    while coro is not None:
+        code = getattr(coro, 'cr_code', None) or getattr(coro, 'gi_code', None)
+        if code is None:
+            # A bare future (I/O, sleep timer, lock) the chain is parked on
+            labels.append('<future>')
+            break
+        labels.append(code_label(code))
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return labels
+
+
+class _TaskTracker:
+    """Task factory, installed only while a profile runs, that records which
+    tasks a profiled request spawns"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.previous = loop.get_task_factory()
+        self.users = 0
+
+    def __call__(self, loop, coro, **kwargs):
+        if self.previous is not None:
+            task = self.previous(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        profile = _active_profile.get()
+        if profile is not None:
+            profile.tasks.add(task)
+        return task
+
+
+_trackers: Dict[int, _TaskTracker] = {}
+
+
+class RequestProfile:
+    """Sampling profile of one request's tasks
+
+    A thread samples the event-loop thread every interval. When the loop is
+    running code from one of the request's tasks, the sample counts as CPU
+    for that Python stack; meanwhile each of the request's suspended tasks
+    counts as await time for its await chain. Time the loop spends on other
+    requests or waiting for I/O is reported separately. Output includes
+    collapsed stacks ("frame;frame count") for flamegraph.pl or speedscope.
+    """
+
+    def __init__(self, name: str, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.name = name
+        self.interval = interval
+        self.tasks: 'weakref.WeakSet[asyncio.Task]' = weakref.WeakSet()
+        self.cpu_stacks: Counter = Counter()
+        self.await_stacks: Counter = Counter()
+        self.coroutine_cpu: Counter = Counter()
+        self.coroutine_await: Counter = Counter()
+        self.samples = 0
+        self.request_cpu = 0
+        self.other_cpu = 0
+        self.idle = 0
+
+    async def run(self, coro):
+        """Await coro as a profiled task; returns (result, report)"""
+        loop = asyncio.get_running_loop()
+        tracker = _trackers.get(id(loop))
+        if tracker is None:
+            tracker = _trackers[id(loop)] = _TaskTracker(loop)
+            loop.set_task_factory(tracker)
+        tracker.users += 1
+
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample_loop, args=(threading.get_ident(), stop), daemon=True)
+        token = _active_profile.set(self)
+        started, cpu_started = time.perf_counter(), time.process_time()
+        try:
+            task = asyncio.ensure_future(coro)
+        finally:
+            _active_profile.reset(token)
+        sampler.start()
+        try:
+            result = await task
+        finally:
+            stop.set()
+            sampler.join()
+            tracker.users -= 1
+            if not tracker.users:
+                loop.set_task_factory(tracker.previous)
+                del _trackers[id(loop)]
+        wall = time.perf_counter() - started
+        return result, self.report(wall, time.process_time() - cpu_started)
+
+    def _sample_loop(self, thread_id: int, stop: threading.Event):
+        while not stop.wait(self.interval):
+            try:
+                self._sample(thread_id)
+            except Exception as e:
+                logger.debug(f"Profile sample failed: {e}")
+
+    def _sample(self, thread_id: int):
+        frame = sys._current_frames().get(thread_id)
+        tasks = [task for task in list(self.tasks) if not task.done()]
+        task_frames = {}
+        for task in tasks:
+            coro_frame = getattr(task.get_coro(), 'cr_frame', None)
+            if coro_frame is not None:
+                task_frames[id(coro_frame)] = task
+        self.samples += 1
+
+        stack = []
+        running_task = None
+        in_coroutine = False
+        while frame is not None:
+            stack.append(frame)
+            in_coroutine = in_coroutine or bool(frame.f_code.co_flags & CO_COROUTINE)
+            if id(frame) in task_frames:
+                running_task = task_frames[id(frame)]
+                break
+            frame = frame.f_back
+
+        if running_task is not None:
+            labels = [code_label(f.f_code) for f in reversed(stack)]
+            self.request_cpu += 1
+            self.cpu_stacks[';'.join(labels)] += 1
+            for label in set(labels):
+                self.coroutine_cpu[label] += 1
+        elif in_coroutine:
+            self.other_cpu += 1
+        else:
+            self.idle += 1
+
+        for task in tasks:
+            if task is running_task:
+                continue
+            chain = _await_chain(task.get_coro())
+            self.await_stacks[';'.join(chain)] += 1
+            for label in set(chain) - {'<future>'}:
+                self.coroutine_await[label] += 1
+
+    def collapsed(self) -> str:
+        lines = [f"cpu;{stack} {count}" for stack, count in self.cpu_stacks.most_common()]
+        lines += [f"await;{stack} {count}" for stack, count in self.await_stacks.most_common()]
+        return '\n'.join(lines)
+
+    def report(self, wall: float, process_cpu: float) -> Dict[str, Any]:
+        per_sample = wall / self.samples * 1000 if self.samples else 0.0
+        labels = set(self.coroutine_cpu) | set(self.coroutine_await)
+        coroutines = sorted(
+            ({
+                'coroutine': label,
+                'cpu_ms': round(self.coroutine_cpu[label] * per_sample, 1),
+                'await_ms': round(self.coroutine_await[label] * per_sample, 1)
+            } for label in labels),
+            key=lambda row: -(row['cpu_ms'] + row['await_ms'])
+        )
+        report = {
+            'name': self.name,
+            'wall_ms': round(wall * 1000, 1),
+            'process_cpu_ms': round(process_cpu * 1000, 1),
+            'samples': self.samples,
+            'sample_interval_ms': self.interval * 1000,
+            'request_cpu_ms': round(self.request_cpu * per_sample, 1),
+            'other_requests_cpu_ms': round(self.other_cpu * per_sample, 1),
+            'loop_idle_ms': round(self.idle * per_sample, 1),
+            'coroutines': coroutines[:40],
+            'collapsed_stacks': self.collapsed()
+        }
+        if PROFILE_DIR:
+            report['stored_at'] = self.store()
+        return report
+
+    def store(self) -> Optional[str]:
+        safe_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in self.name)[:80]
+        path = os.path.join(PROFILE_DIR, f"{datetime.utcnow():%Y%m%dT%H%M%S}_{safe_name}.collapsed")
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(self.collapsed() + '\n')
+            return path
+        except OSError as e:
+            logger.warning(f"Could not store profile {path}: {e}")
+            return None
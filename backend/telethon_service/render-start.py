@@ -53,6 +53,11 @@ def main():
     # Get configuration from environment
     port = int(os.getenv('PORT', 10000))
     host = os.getenv('HOST', '0.0.0.0')
+    workers = int(os.getenv('WORKERS', '1'))
+    if workers > 1:
+        # Workers coordinate Telegram session ownership through Postgres leases
+        os.environ.setdefault('CLUSTER_MODE', '1')
+        logger.info(f"👥 Multi-worker mode with {workers} workers")
     
     # Add startup event to initialize scanner
     @app.on_event("startup")
@@ -69,7 +74,7 @@ def main():
         log_level="info",
         access_log=True,
         reload=False,  # Disable reload in production
-        workers=1      # Single worker for free tier
+        workers=workers  # WORKERS=1 on the free tier
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,494 @@
+import base64
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from message_records import MessageRecord
+
+logger = logging.getLogger(__name__)
+
+# Typed data access for channels, posts, scans and KOLs. Each query is a
+# module constant so it compiles once and stays in the pool's statement cache.
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """TIMESTAMP columns are stored as naive UTC"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _json(value) -> Dict[str, Any]:
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return {}
+    return value or {}
+
+
+# Channels
+
+@dataclass
+class ChannelSummary:
+    channel_id: int
+    channel_name: str
+    title: Optional[str]
+    member_count: int
+    scans: int
+    last_scanned_at: Optional[datetime]
+
+
+CHANNEL_SUMMARY_COLUMNS = """
+    channel_id, MAX(channel_name) AS channel_name, MAX(channel_title) AS title,
+    (ARRAY_AGG(member_count ORDER BY scanned_at DESC))[1] AS member_count,
+    COUNT(*) AS scans, MAX(scanned_at) AS last_scanned_at
+"""
+
+GET_CHANNEL = f"""
+    SELECT {CHANNEL_SUMMARY_COLUMNS}
+    FROM channel_scans WHERE channel_id = :channel_id AND status = 'completed'
+    GROUP BY channel_id
+"""
+
+LIST_CHANNELS = f"""
+    SELECT {CHANNEL_SUMMARY_COLUMNS}
+    FROM channel_scans WHERE channel_id IS NOT NULL AND status = 'completed'
+    GROUP BY channel_id ORDER BY MAX(scanned_at) DESC LIMIT :limit
+"""
+
+
+async def get_channel(db, channel_id: int) -> Optional[ChannelSummary]:
+    row = await db.fetch_one(GET_CHANNEL, {'channel_id': channel_id})
+    return ChannelSummary(**dict(row)) if row else None
+
+
+async def list_channels(db, limit: int = 50) -> List[ChannelSummary]:
+    rows = await db.fetch_all(LIST_CHANNELS, {'limit': limit})
+    return [ChannelSummary(**dict(row)) for row in rows]
+
+
+# Posts
+
+@dataclass
+class PostRecord:
+    channel_id: int
+    message_id: int
+    username: str
+    text: str
+    views: int
+    forwards: int
+    date: Optional[datetime]
+    channel_title: Optional[str] = None
+    telegram_username: Optional[str] = None
+    engagement_rate: float = 0.0
+    author_id: Optional[int] = None
+    id: Optional[int] = None
+
+
+UPSERT_POST = """
+    INSERT INTO user_posts (channel_id, message_id, username, telegram_username, text, views, forwards,
+                            date, channel_title, engagement_rate, author_id)
+    VALUES (:channel_id, :message_id, :username, :telegram_username, :text, :views, :forwards,
+            :date, :channel_title, :engagement_rate, :author_id)
+    ON CONFLICT (channel_id, message_id, date) DO UPDATE
+    SET views = EXCLUDED.views, forwards = EXCLUDED.forwards, text = EXCLUDED.text,
+        engagement_rate = EXCLUDED.engagement_rate, fetched_at = CURRENT_TIMESTAMP
+"""
+
+POST_COLUMNS = """
+    id, channel_id, message_id, username, text, views, forwards, date, channel_title,
+    telegram_username, engagement_rate, author_id
+"""
+
+# user_posts is partitioned by month of date; a date bound in the WHERE
+# clause lets the planner skip every partition outside the window
+CHANNEL_POSTS = f"""
+    SELECT {POST_COLUMNS}
+    FROM user_posts WHERE channel_id = :channel_id AND date >= :since
+    ORDER BY date DESC LIMIT :limit
+"""
+
+
+def posts_from_records(channel, records: Iterable[MessageRecord]) -> List[PostRecord]:
+    """Map a channel's MessageRecords to user_posts rows"""
+    username = getattr(channel, 'username', None) or str(channel.id)
+    title = getattr(channel, 'title', None)
+    return [
+        PostRecord(
+            channel_id=channel.id,
+            message_id=post.id,
+            username=username,
+            text=post.text,
+            views=post.views,
+            forwards=post.forwards,
+            date=post.date,
+            channel_title=title,
+            telegram_username=getattr(channel, 'username', None),
+            engagement_rate=round(min((post.forwards + post.replies + post.reactions) / post.views * 100, 999.99), 2)
+            if post.views else 0.0,
+            author_id=post.user_id
+        )
+        for post in records
+    ]
+
+
+async def upsert_posts(db, posts: List[PostRecord]):
+    """Insert posts, refreshing counters of ones already stored; posts without a date are skipped"""
+    values = []
+    for post in posts:
+        if post.date is None:
+            continue
+        row = post.__dict__.copy()
+        row['date'] = _naive_utc(post.date)
+        row['channel_title'] = (post.channel_title or '')[:255] or None
+        values.append(row)
+    await db.execute_many(UPSERT_POST, values)
+
+
+async def channel_posts(db, channel_id: int, limit: int = 100, days: int = 30) -> List[PostRecord]:
+    since = datetime.utcnow() - timedelta(days=days)
+    rows = await db.fetch_all(CHANNEL_POSTS, {'channel_id': channel_id, 'since': since, 'limit': limit})
+    return [_post_from_row(row) for row in rows]
+
+
+def _post_from_row(row) -> PostRecord:
+    return PostRecord(**{**dict(row), 'engagement_rate': float(row['engagement_rate'] or 0)})
+
+
+# Scans
+
+@dataclass
+class ScanSummary:
+    scan_id: str
+    channel_name: str
+    channel_id: Optional[int]
+    title: Optional[str]
+    member_count: int
+    messages_analyzed: int
+    kols_found: int
+    status: str
+    scanned_at: Optional[datetime]
+
+
+INSERT_SCAN = """
+    INSERT INTO channel_scans (channel_name, channel_id, channel_title, member_count, scan_type,
+                               scan_results, messages_analyzed, kols_found, status, completed_at)
+    VALUES (:channel_name, :channel_id, :channel_title, :member_count, :scan_type,
+            CAST(:scan_results AS JSONB), :messages_analyzed, :kols_found, 'completed', CURRENT_TIMESTAMP)
+    RETURNING uuid
+"""
+
+RECENT_SCANS = """
+    SELECT uuid::text AS scan_id, channel_name, channel_id, channel_title AS title, member_count,
+           messages_analyzed, kols_found, status, scanned_at
+    FROM channel_scans WHERE lower(channel_name) = lower(:channel_name)
+    ORDER BY created_at DESC LIMIT :limit
+"""
+
+SCAN_RESULTS = "SELECT scan_results FROM channel_scans WHERE uuid = :scan_id"
+
+
+async def record_scan(db, channel_name: str, analysis: Dict[str, Any], scan_type: str = 'general') -> str:
+    """Store a finished scan and return its id"""
+    return str(await db.fetch_val(INSERT_SCAN, {
+        'channel_name': channel_name,
+        'channel_id': analysis.get('channel_id'),
+        'channel_title': (analysis.get('title') or '')[:255],
+        'member_count': analysis.get('member_count') or 0,
+        'scan_type': scan_type,
+        'scan_results': json.dumps(analysis, default=str),
+        'messages_analyzed': analysis.get('message_count') or 0,
+        'kols_found': analysis.get('kol_count') or 0
+    }))
+
+
+async def recent_scans(db, channel_name: str, limit: int = 10) -> List[ScanSummary]:
+    rows = await db.fetch_all(RECENT_SCANS, {'channel_name': channel_name.lstrip('@'), 'limit': limit})
+    return [ScanSummary(**dict(row)) for row in rows]
+
+
+async def scan_results(db, scan_id: str) -> Optional[Dict[str, Any]]:
+    row = await db.fetch_one(SCAN_RESULTS, {'scan_id': scan_id})
+    return _json(row['scan_results']) if row else None
+
+
+# KOLs
+
+@dataclass
+class KolRecord:
+    telegram_username: str
+    username: str
+    display_name: Optional[str] = None
+    influence_score: int = 0
+    tags: List[str] = field(default_factory=list)
+    stats: Dict[str, Any] = field(default_factory=dict)
+    best_channel: Optional[str] = None
+    last_activity: Optional[datetime] = None
+
+
+# A KOL keeps its best score across channels; tags and stats follow the
+# scan that produced it, while last_activity tracks the latest sighting
+UPSERT_KOL = """
+    INSERT INTO kols (telegram_username, username, display_name, influence_score, tags, stats,
+                      best_channel, last_activity)
+    VALUES (:telegram_username, :username, :display_name, :influence_score, :tags,
+            CAST(:stats AS JSONB), :best_channel, :last_activity)
+    ON CONFLICT (telegram_username) DO UPDATE
+    SET influence_score = GREATEST(kols.influence_score, EXCLUDED.influence_score),
+        display_name = COALESCE(EXCLUDED.display_name, kols.display_name),
+        tags = CASE WHEN EXCLUDED.influence_score >= kols.influence_score THEN EXCLUDED.tags ELSE kols.tags END,
+        stats = CASE WHEN EXCLUDED.influence_score >= kols.influence_score THEN EXCLUDED.stats ELSE kols.stats END,
+        best_channel = CASE WHEN EXCLUDED.influence_score >= kols.influence_score
+                            THEN EXCLUDED.best_channel ELSE kols.best_channel END,
+        last_activity = GREATEST(kols.last_activity, EXCLUDED.last_activity)
+"""
+
+KOL_COLUMNS = "id, telegram_username, username, display_name, influence_score, tags, stats, best_channel, last_activity"
+
+GET_KOL = f"""
+    SELECT {KOL_COLUMNS}
+    FROM kols WHERE telegram_username = :telegram_username
+"""
+
+
+def kol_from_dict(kol: Dict[str, Any], channel: Optional[str] = None) -> KolRecord:
+    """Map a KOL dict from the scan API to a kols row"""
+    handle = kol.get('username') or f"id{kol['user_id']}"
+    name = ' '.join(part for part in (kol.get('first_name'), kol.get('last_name')) if part)
+    return KolRecord(
+        telegram_username=handle,
+        username=handle,
+        display_name=name or None,
+        influence_score=int(round(kol.get('influence_score') or 0)),
+        tags=list(kol.get('specialty_tags') or []),
+        stats={key: kol.get(key) for key in (
+            'user_id', 'engagement_rate', 'avg_views', 'posting_frequency', 'content_quality_score',
+            'bot_probability', 'follower_count', 'is_admin', 'is_verified'
+        )},
+        best_channel=channel,
+        last_activity=datetime.utcnow()
+    )
+
+
+async def upsert_kols(db, kols: List[KolRecord]):
+    await db.execute_many(UPSERT_KOL, [
+        {**kol.__dict__, 'stats': json.dumps(kol.stats, default=str), 'last_activity': _naive_utc(kol.last_activity)}
+        for kol in kols
+    ])
+
+
+def _kol_from_row(row) -> KolRecord:
+    data = dict(row)
+    data.pop('id', None)
+    return KolRecord(**{**data, 'tags': list(row['tags'] or []), 'stats': _json(row['stats'])})
+
+
+async def get_kol(db, telegram_username: str) -> Optional[KolRecord]:
+    row = await db.fetch_one(GET_KOL, {'telegram_username': telegram_username.lstrip('@')})
+    return _kol_from_row(row) if row else None
+
+
+# Leaderboard: keyset pagination over (sort column, id) so every page is an
+# index range scan no matter how deep, instead of OFFSET re-reading earlier rows
+
+LEADERBOARD_SORTS = {
+    'score': 'influence_score',
+    'recent': 'last_activity'
+}
+
+
+def _leaderboard_query(sort: str, after: bool, specialty: bool) -> str:
+    column = LEADERBOARD_SORTS[sort]
+    conditions = [f"{column} IS NOT NULL"]
+    if specialty:
+        conditions.append("tags @> ARRAY[CAST(:specialty AS TEXT)]")
+    if after:
+        conditions.append(f"({column}, id) < (:after_value, :after_id)")
+    return f"""
+        SELECT {KOL_COLUMNS}
+        FROM kols WHERE {' AND '.join(conditions)}
+        ORDER BY {column} DESC, id DESC LIMIT :limit
+    """
+
+
+def _encode_keyset(value, row_id: int) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, row_id]).encode()).decode()
+
+
+def _decode_keyset(cursor: str, parse) -> Tuple[Any, int]:
+    """Raises ValueError for cursors this endpoint did not issue"""
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return parse(value), int(row_id)
+    except (TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+def encode_cursor(sort: str, row) -> str:
+    return _encode_keyset(row[LEADERBOARD_SORTS[sort]], row['id'])
+
+
+def decode_cursor(sort: str, cursor: str) -> Tuple[Any, int]:
+    return _decode_keyset(cursor, datetime.fromisoformat if sort == 'recent' else int)
+
+
+async def leaderboard_page(db, sort: str = 'score', limit: int = 50, specialty: Optional[str] = None,
+                           cursor: Optional[str] = None) -> Tuple[List[KolRecord], Optional[str]]:
+    """One page of KOLs, best first, and the cursor for the next page"""
+    values: Dict[str, Any] = {'limit': limit + 1}
+    if specialty:
+        values['specialty'] = specialty
+    if cursor:
+        values['after_value'], values['after_id'] = decode_cursor(sort, cursor)
+    rows = await db.fetch_all(_leaderboard_query(sort, bool(cursor), bool(specialty)), values)
+    next_cursor = encode_cursor(sort, rows[limit - 1]) if len(rows) > limit else None
+    return [_kol_from_row(row) for row in rows[:limit]], next_cursor
+
+
+# Post search: full-text matches come from the GIN index on the generated
+# search_vector column; cashtags and addresses, which the text parser splits
+# or drops, are matched as substrings through the trigram index instead
+
+SEARCH_MODES = ('auto', 'words', 'phrase', 'substring')
+
+_LITERAL_TERM = re.compile(r'^(\$[A-Za-z][A-Za-z0-9]{1,15}|0x[0-9a-fA-F]{6,}|[1-9A-HJ-NP-Za-km-z]{25,})$')
+
+
+def search_mode_for(query: str) -> str:
+    """Substring search for a lone cashtag or address, web-style word search otherwise"""
+    return 'substring' if _LITERAL_TERM.match(query.strip()) else 'words'
+
+
+def _like_pattern(query: str) -> str:
+    escaped = query.strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+def _search_query(mode: str, channel_id: bool, channel: bool, author: bool, since: bool, until: bool,
+                  after: bool) -> str:
+    if mode == 'substring':
+        conditions = ["text ILIKE :pattern"]
+    else:
+        parser = 'phraseto_tsquery' if mode == 'phrase' else 'websearch_to_tsquery'
+        conditions = [f"search_vector @@ {parser}('simple', :query)"]
+    if channel_id:
+        conditions.append("channel_id = :channel_id")
+    if channel:
+        conditions.append("username = :channel")
+    if author:
+        conditions.append("author_id = :author_id")
+    if since:
+        conditions.append("date >= :since")
+    if until:
+        conditions.append("date < :until")
+    if after:
+        # The plain bound prunes partitions newer than the cursor; the row comparison can't
+        conditions.append("date <= :after_date AND (date, id) < (:after_date, :after_id)")
+    return f"""
+        SELECT {POST_COLUMNS}
+        FROM user_posts WHERE {' AND '.join(conditions)}
+        ORDER BY date DESC, id DESC LIMIT :limit
+    """
+
+
+async def search_posts(db, query: str, mode: str = 'auto', channel_id: Optional[int] = None,
+                       channel: Optional[str] = None, author_id: Optional[int] = None,
+                       since: Optional[datetime] = None, until: Optional[datetime] = None,
+                       limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[PostRecord], Optional[str]]:
+    """One page of stored posts matching query, newest first, and the cursor for the next page"""
+    if mode == 'auto':
+        mode = search_mode_for(query)
+    values: Dict[str, Any] = {'limit': limit + 1}
+    if mode == 'substring':
+        values['pattern'] = _like_pattern(query)
+    else:
+        values['query'] = query.strip()
+    if channel_id is not None:
+        values['channel_id'] = channel_id
+    if channel:
+        values['channel'] = channel.lstrip('@')
+    if author_id is not None:
+        values['author_id'] = author_id
+    if since:
+        values['since'] = _naive_utc(since)
+    if until:
+        values['until'] = _naive_utc(until)
+    if cursor:
+        values['after_date'], values['after_id'] = _decode_keyset(cursor, datetime.fromisoformat)
+    sql = _search_query(mode, channel_id is not None, bool(channel), author_id is not None,
+                        bool(since), bool(until), bool(cursor))
+    rows = await db.fetch_all(sql, values)
+    next_cursor = _encode_keyset(rows[limit - 1]['date'], rows[limit - 1]['id']) if len(rows) > limit else None
+    return [_post_from_row(row) for row in rows[:limit]], next_cursor
+
+
+# Post history: stored posts for one channel or author, newest first, with
+# aggregates over the same window. Reads never go to Telegram.
+
+POST_SUMMARY_COLUMNS = """
+    COUNT(*) AS posts, MIN(date) AS first_post_at, MAX(date) AS last_post_at,
+    COALESCE(SUM(views), 0) AS total_views, COALESCE(AVG(views), 0) AS avg_views,
+    COALESCE(AVG(forwards), 0) AS avg_forwards, COALESCE(AVG(engagement_rate), 0) AS avg_engagement_rate,
+    COUNT(DISTINCT author_id) AS authors, COUNT(DISTINCT channel_id) AS channels
+"""
+
+
+def _history_conditions(values: Dict[str, Any], filters: Dict[str, Any], since: Optional[datetime],
+                        until: Optional[datetime]) -> List[str]:
+    """filters maps user_posts columns (from code, never requests) to required values"""
+    conditions = []
+    for column, value in filters.items():
+        if value is not None:
+            conditions.append(f"{column} = :{column}")
+            values[column] = value
+    if since:
+        conditions.append("date >= :since")
+        values['since'] = _naive_utc(since)
+    if until:
+        conditions.append("date < :until")
+        values['until'] = _naive_utc(until)
+    return conditions
+
+
+async def post_history_page(db, filters: Dict[str, Any], since: Optional[datetime] = None,
+                            until: Optional[datetime] = None, key: str = 'message_id', limit: int = 50,
+                            cursor: Optional[str] = None) -> Tuple[List[PostRecord], Optional[str]]:
+    """One page ordered by (date, key) descending, and the cursor for the next page"""
+    values: Dict[str, Any] = {'limit': limit + 1}
+    conditions = _history_conditions(values, filters, since, until)
+    if cursor:
+        values['after_date'], values['after_key'] = _decode_keyset(cursor, datetime.fromisoformat)
+        conditions.append(f"date <= :after_date AND (date, {key}) < (:after_date, :after_key)")
+    rows = await db.fetch_all(f"""
+        SELECT {POST_COLUMNS}
+        FROM user_posts WHERE {' AND '.join(conditions)}
+        ORDER BY date DESC, {key} DESC LIMIT :limit
+    """, values)
+    next_cursor = _encode_keyset(rows[limit - 1]['date'], rows[limit - 1][key]) if len(rows) > limit else None
+    return [_post_from_row(row) for row in rows[:limit]], next_cursor
+
+
+async def post_history_summary(db, filters: Dict[str, Any], since: Optional[datetime] = None,
+                               until: Optional[datetime] = None) -> Dict[str, Any]:
+    values: Dict[str, Any] = {}
+    conditions = _history_conditions(values, filters, since, until)
+    row = await db.fetch_one(
+        f"SELECT {POST_SUMMARY_COLUMNS} FROM user_posts WHERE {' AND '.join(conditions)}", values
+    )
+    return {
+        'posts': int(row['posts']),
+        'first_post_at': row['first_post_at'].isoformat() if row['first_post_at'] else None,
+        'last_post_at': row['last_post_at'].isoformat() if row['last_post_at'] else None,
+        'total_views': int(row['total_views']),
+        'avg_views': round(float(row['avg_views']), 2),
+        'avg_forwards': round(float(row['avg_forwards']), 2),
+        'avg_engagement_rate': round(float(row['avg_engagement_rate']), 2),
+        'authors': int(row['authors']),
+        'channels': int(row['channels'])
+    }
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ScanRunner = Callable[[str, Optional[str]], Awaitable[Dict[str, Any]]]
+
+# Metrics compared between consecutive scans to estimate result volatility
+VOLATILITY_FIELDS = ['member_count', 'active_members', 'kol_count', 'admin_count']
+
+
+@dataclass
+class ScheduleEntry:
+    """Adaptive re-scan state for one channel"""
+    channel: str
+    user_id: Optional[str] = None
+    interval: float = 3600.0
+    next_due: float = field(default_factory=time.time)
+    message_rate: float = 0.0  # messages per hour
+    volatility: float = 0.5  # 0 = results never change, 1 = change completely every scan
+    last_scanned: Optional[float] = None
+    last_result: Dict[str, Any] = field(default_factory=dict)
+    scans: int = 0
+    failures: int = 0
+    running: bool = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'channel': self.channel,
+            'interval_seconds': round(self.interval),
+            'next_due': datetime.fromtimestamp(self.next_due).isoformat(),
+            'last_scanned': datetime.fromtimestamp(self.last_scanned).isoformat() if self.last_scanned else None,
+            'message_rate_per_hour': round(self.message_rate, 2),
+            'volatility': round(self.volatility, 3),
+            'scans': self.scans,
+            'failures': self.failures,
+            'running': self.running
+        }
+
+
+class RescanScheduler:
+    """Re-scans registered channels at a rate driven by their activity and volatility"""
+
+    def __init__(self, runner: ScanRunner, workers: int = 2, rpc_budget_per_hour: int = 600,
+                 rpcs_per_scan: int = 10, min_interval: float = 300, max_interval: float = 86400,
+                 target_new_messages: float = 50, tick: float = 5.0):
+        self.runner = runner
+        self.workers = workers
+        self.rpc_budget_per_hour = rpc_budget_per_hour
+        self.rpcs_per_scan = rpcs_per_scan
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_new_messages = target_new_messages
+        self.tick = tick
+        self.entries: Dict[str, ScheduleEntry] = {}
+        self._spent = deque()  # [timestamp, rpcs] charged within the last hour
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+
+    def add(self, channel: str, user_id: Optional[str] = None) -> ScheduleEntry:
+        key = channel.lstrip('@').lower()
+        entry = self.entries.get(key)
+        if not entry:
+            entry = self.entries[key] = ScheduleEntry(channel=channel, user_id=user_id)
+            logger.info(f"Scheduled adaptive re-scans for {channel}")
+        elif user_id:
+            entry.user_id = user_id
+        return entry
+
+    def remove(self, channel: str) -> bool:
+        return self.entries.pop(channel.lstrip('@').lower(), None) is not None
+
+    def budget_used(self) -> int:
+        cutoff = time.time() - 3600
+        while self._spent and self._spent[0][0] < cutoff:
+            self._spent.popleft()
+        return sum(rpcs for _, rpcs in self._spent)
+
+    def budget_status(self) -> Dict[str, Any]:
+        used = self.budget_used()
+        return {
+            'rpc_budget_per_hour': self.rpc_budget_per_hour,
+            'rpcs_used_last_hour': used,
+            'rpcs_remaining': max(self.rpc_budget_per_hour - used, 0),
+            'estimated_rpcs_per_scan': self.rpcs_per_scan,
+            'workers': self.workers,
+            'running_scans': len(self._inflight)
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        entries = sorted(self.entries.values(), key=lambda e: e.next_due)
+        return {'budget': self.budget_status(), 'channels': [e.to_dict() for e in entries]}
+
+    async def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._loop())
+            logger.info(f"Re-scan scheduler started ({self.workers} workers, {self.rpc_budget_per_hour} RPC/hour)")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for task in list(self._inflight):
+            task.cancel()
+        await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    async def _loop(self):
+        while True:
+            try:
+                self._dispatch_due()
+            except Exception as e:
+                logger.error(f"Re-scan scheduler error: {e}")
+            await asyncio.sleep(self.tick)
+
+    def _dispatch_due(self):
+        now = time.time()
+        due = sorted(
+            (e for e in self.entries.values() if not e.running and e.next_due <= now),
+            key=lambda e: e.next_due
+        )
+        for entry in due:
+            if len(self._inflight) >= self.workers:
+                break
+            if self.budget_used() + self.rpcs_per_scan > self.rpc_budget_per_hour:
+                logger.debug("Re-scan RPC budget exhausted for this hour; deferring due scans")
+                break
+            # Reserve the budget before running so concurrent scans cannot overspend it
+            reservation = [now, self.rpcs_per_scan]
+            self._spent.append(reservation)
+            entry.running = True
+            task = asyncio.create_task(self._run(entry, reservation))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _run(self, entry: ScheduleEntry, reservation: list):
+        try:
+            result = await self.runner(entry.channel, entry.user_id)
+            self._charge(reservation, result)
+            self._update(entry, result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            entry.failures += 1
+            # Back off on repeated failures without leaving the schedule
+            entry.interval = min(entry.interval * 2, self.max_interval)
+            logger.warning(f"Scheduled re-scan of {entry.channel} failed: {e}")
+        finally:
+            entry.running = False
+            entry.next_due = time.time() + entry.interval
+
+    def _charge(self, reservation: list, result: Dict[str, Any]):
+        """Replace the estimated charge with the requests the scan actually sent,
+        and move the per-scan estimate towards them"""
+        actual = (result.get('rpc') or {}).get('calls')
+        if actual is None:
+            return
+        reservation[1] = actual
+        self.rpcs_per_scan = max(1, round(0.7 * self.rpcs_per_scan + 0.3 * actual))
+
+    def _update(self, entry: ScheduleEntry, result: Dict[str, Any]):
+        now = time.time()
+        entry.message_rate = self._message_rate(result, entry.message_rate)
+
+        if entry.last_result:
+            changes = []
+            for key in VOLATILITY_FIELDS:
+                previous, current = entry.last_result.get(key) or 0, result.get(key) or 0
+                if previous or current:
+                    changes.append(min(abs(current - previous) / max(previous, current, 1), 1.0))
+            change = sum(changes) / len(changes) if changes else 0.0
+            # Exponential moving average so a single odd scan does not swing the schedule
+            entry.volatility = 0.7 * entry.volatility + 0.3 * min(change * 10, 1.0)
+
+        entry.last_result = {key: result.get(key) for key in VOLATILITY_FIELDS}
+        entry.last_scanned = now
+        entry.scans += 1
+        entry.interval = self._interval(entry)
+
+    def _message_rate(self, result: Dict[str, Any], previous: float) -> float:
+        """Messages per hour estimated from the timestamps of the scan's recent activity"""
+        dates = []
+        for item in result.get('recent_activity', []):
+            try:
+                dates.append(datetime.fromisoformat(item['date']))
+            except (KeyError, TypeError, ValueError):
+                continue
+        if len(dates) < 2:
+            return previous * 0.5
+        span_hours = (max(dates) - min(dates)).total_seconds() / 3600
+        return (len(dates) - 1) / max(span_hours, 1 / 60)
+
+    def _interval(self, entry: ScheduleEntry) -> float:
+        """Time until enough new messages are expected, shortened for volatile results"""
+        if entry.message_rate > 0:
+            interval = self.target_new_messages / entry.message_rate * 3600
+        else:
+            interval = self.max_interval
+        interval *= 1.5 - entry.volatility
+        return max(self.min_interval, min(interval, self.max_interval))
+
+
+def create_rescan_scheduler(runner: ScanRunner) -> RescanScheduler:
+    """Build a scheduler configured from the environment"""
+    return RescanScheduler(
+        runner,
+        workers=int(os.getenv('RESCAN_WORKERS', '2')),
+        rpc_budget_per_hour=int(os.getenv('RESCAN_RPC_BUDGET_PER_HOUR', '600')),
+        rpcs_per_scan=int(os.getenv('RESCAN_RPCS_PER_SCAN', '10')),
+        min_interval=float(os.getenv('RESCAN_MIN_INTERVAL', '300')),
+        max_interval=float(os.getenv('RESCAN_MAX_INTERVAL', '86400'))
+    )
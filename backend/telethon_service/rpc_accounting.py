@@ -0,0 +1,149 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from prometheus_client import Counter, Histogram
+from telethon import TelegramClient
+from telethon.errors import FloodError
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_RPCS = Counter('kol_telegram_rpc_total', 'Telegram requests by TL method and outcome', ['method', 'outcome'])
+TELEGRAM_RPC_SECONDS = Histogram(
+    'kol_telegram_rpc_seconds', 'Telegram request latency by TL method', ['method'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+TELEGRAM_FLOOD_WAIT_SECONDS = Counter(
+    'kol_telegram_flood_wait_seconds_total', 'FloodWait seconds Telegram demanded, by TL method', ['method']
+)
+
+
+class RpcBudgetExceeded(Exception):
+    """Raised instead of sending a request once the scan's max_rpcs are spent"""
+
+
+@dataclass
+class MethodStats:
+    calls: int = 0
+    errors: int = 0
+    flood_waits: int = 0
+    flood_wait_seconds: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'flood_waits': self.flood_waits,
+            'flood_wait_seconds': self.flood_wait_seconds,
+            'avg_ms': round(self.total_seconds / self.calls * 1000, 1) if self.calls else 0,
+            'max_ms': round(self.max_seconds * 1000, 1)
+        }
+
+
+class RpcLedger:
+    """Telegram requests sent, per TL method, optionally capped at max_rpcs"""
+
+    def __init__(self, max_rpcs: Optional[int] = None):
+        self.max_rpcs = max_rpcs
+        self.methods: Dict[str, MethodStats] = {}
+        self.calls = 0
+        self.denied = 0
+
+    @property
+    def exhausted(self) -> bool:
+        return self.max_rpcs is not None and self.calls >= self.max_rpcs
+
+    def reserve(self, method: str):
+        """Count a request before it is sent, so concurrent requests can't overrun the budget"""
+        if self.exhausted:
+            self.denied += 1
+            raise RpcBudgetExceeded(f"RPC budget of {self.max_rpcs} spent; skipped {method}")
+        self.calls += 1
+        self.methods.setdefault(method, MethodStats()).calls += 1
+
+    def record(self, method: str, seconds: float, error: Optional[Exception] = None):
+        stats = self.methods.setdefault(method, MethodStats())
+        stats.total_seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+        if error is not None:
+            stats.errors += 1
+            if isinstance(error, FloodError):
+                stats.flood_waits += 1
+                stats.flood_wait_seconds += getattr(error, 'seconds', 0) or 0
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'max_rpcs': self.max_rpcs,
+            'budget_exhausted': self.exhausted,
+            'denied': self.denied,
+            'errors': sum(stats.errors for stats in self.methods.values()),
+            'flood_wait_seconds': sum(stats.flood_wait_seconds for stats in self.methods.values()),
+            'methods': {
+                method: stats.to_dict()
+                for method, stats in sorted(self.methods.items(), key=lambda item: -item[1].calls)
+            }
+        }
+
+
+# Every request this process sends, and the ledger of the scan (if any) that caused it
+process_rpcs = RpcLedger()
+_scan_ledger: ContextVar[Optional[RpcLedger]] = ContextVar('scan_rpc_ledger', default=None)
+
+
+@contextmanager
+def scan_rpc_ledger(max_rpcs: Optional[int] = None):
+    """Attribute Telegram requests made in this context, and tasks it spawns, to one scan"""
+    ledger = RpcLedger(max_rpcs)
+    token = _scan_ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _scan_ledger.reset(token)
+
+
+def _method_name(request) -> str:
+    if isinstance(request, (list, tuple)):
+        return type(request[0]).__name__ if request else 'empty'
+    return type(request).__name__
+
+
+class AccountedTelegramClient(TelegramClient):
+    """TelegramClient that counts every request by TL method, including
+    those issued by high-level helpers such as get_messages"""
+
+    async def __call__(self, request, ordered=False, flood_sleep_threshold=None):
+        method = _method_name(request)
+        ledger = _scan_ledger.get()
+        if ledger is not None:
+            try:
+                ledger.reserve(method)
+            except RpcBudgetExceeded:
+                TELEGRAM_RPCS.labels(method, 'budget').inc()
+                raise
+        process_rpcs.reserve(method)
+
+        started = time.perf_counter()
+        error = None
+        try:
+            return await super().__call__(request, ordered=ordered, flood_sleep_threshold=flood_sleep_threshold)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            for target in (process_rpcs, ledger):
+                if target is not None:
+                    target.record(method, elapsed, error)
+            TELEGRAM_RPC_SECONDS.labels(method).observe(elapsed)
+            if isinstance(error, FloodError):
+                TELEGRAM_RPCS.labels(method, 'flood_wait').inc()
+                TELEGRAM_FLOOD_WAIT_SECONDS.labels(method).inc(getattr(error, 'seconds', 0) or 0)
+                logger.warning(f"FloodWait of {getattr(error, 'seconds', '?')}s on {method}")
+            else:
+                TELEGRAM_RPCS.labels(method, 'error' if error is not None else 'ok').inc()
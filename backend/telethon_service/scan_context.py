@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import math
+from typing import Any, Dict, Optional, Tuple
+
+from message_records import project_messages
+
+logger = logging.getLogger(__name__)
+
+# Telegram returns at most this many messages per history request
+MESSAGES_PER_REQUEST = 100
+
+
+class ScanContext:
+    """Per-scan fetch layer that never downloads the same data twice
+
+    Wraps a TelegramClient for the lifetime of one scan and can be passed
+    anywhere a client is expected. Entity lookups and raw TL requests are
+    memoized by (method, args). Message history is projected to
+    MessageRecords on receipt and kept per channel as the largest window
+    fetched so far; smaller windows are served as slices of it.
+    """
+
+    def __init__(self, client, min_message_window: int = 0):
+        self.client = client
+        self.min_message_window = min_message_window
+        self.rpc_calls = 0
+        self.rpcs_saved = 0
+        self._cache: Dict[Tuple, asyncio.Task] = {}
+        self._windows: Dict[Any, Tuple[int, asyncio.Task]] = {}
+
+    def __getattr__(self, name):
+        # Anything not memoized goes straight to the underlying client
+        return getattr(self.client, name)
+
+    async def _memoize(self, key: Tuple, fetch, cost: int = 1):
+        task = self._cache.get(key)
+        if task is not None:
+            self.rpcs_saved += cost
+            return await task
+
+        self.rpc_calls += cost
+        task = asyncio.ensure_future(fetch())
+        self._cache[key] = task
+        try:
+            return await task
+        except BaseException:
+            # Failed fetches are not cached so a later caller can retry
+            self._cache.pop(key, None)
+            raise
+
+    async def get_entity(self, entity):
+        return await self._memoize(('get_entity', _entity_key(entity)), lambda: self.client.get_entity(entity))
+
+    async def __call__(self, request, *args, **kwargs):
+        if args or kwargs:
+            self.rpc_calls += 1
+            return await self.client(request, *args, **kwargs)
+        key = (type(request).__name__, repr(request.to_dict()))
+        return await self._memoize(key, lambda: self.client(request))
+
+    async def get_messages(self, entity, limit: Optional[int] = None, **kwargs):
+        """Raw Telethon messages, not memoized; prefer get_message_records"""
+        self.rpc_calls += _history_cost(limit or 1)
+        return await self.client.get_messages(entity, limit=limit, **kwargs)
+
+    async def get_message_records(self, entity, limit: int):
+        """The newest limit messages of a channel as MessageRecords"""
+        channel_key = _entity_key(entity)
+        cached = self._windows.get(channel_key)
+        if cached is not None:
+            window_limit, task = cached
+            if window_limit >= limit:
+                messages = await task
+                self.rpcs_saved += _history_cost(limit)
+                return messages[:limit]
+            if task.done() and not task.exception() and len(task.result()) < window_limit:
+                # The channel has fewer messages than the window asked for; nothing more to fetch
+                self.rpcs_saved += _history_cost(limit)
+                return task.result()[:limit]
+
+        window_limit = max(limit, self.min_message_window)
+        self.rpc_calls += _history_cost(window_limit)
+        task = asyncio.ensure_future(self._fetch_records(entity, window_limit))
+        self._windows[channel_key] = (window_limit, task)
+        try:
+            messages = await task
+        except BaseException:
+            self._windows.pop(channel_key, None)
+            raise
+        return messages[:limit]
+
+    async def _fetch_records(self, entity, limit: int):
+        # The raw Message objects are released as soon as they are projected
+        return project_messages(await self.client.get_messages(entity, limit=limit))
+
+    def stats(self) -> Dict[str, int]:
+        return {'rpc_calls': self.rpc_calls, 'rpcs_saved': self.rpcs_saved}
+
+
+def _entity_key(entity) -> Any:
+    """Stable cache key for usernames, ids, peers and entity objects"""
+    if isinstance(entity, str):
+        return entity.lstrip('@').lower()
+    for attr in ('id', 'channel_id', 'user_id', 'chat_id'):
+        value = getattr(entity, attr, None)
+        if value is not None:
+            return value
+    return entity
+
+
+def _history_cost(limit: int) -> int:
+    return max(1, math.ceil(limit / MESSAGES_PER_REQUEST))
@@ -0,0 +1,372 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Ordered stages of a channel scan; a job resumes after the last completed one
+SCAN_STAGES = ['basic', 'enhanced']
+TERMINAL_STATUSES = ('completed', 'failed')
+
+# NOTIFY channels: new work for scan workers, and progress for whoever waits on a job
+QUEUED_CHANNEL = 'scan_jobs_queued'
+UPDATES_CHANNEL = 'scan_job_updates'
+
+StageCallback = Callable[[str, Dict[str, Any]], Awaitable[None]]
+JobRunner = Callable[[Dict[str, Any], Dict[str, Any], StageCallback], Awaitable[Dict[str, Any]]]
+
+
+def _row_to_dict(row) -> Dict[str, Any]:
+    """Convert a database record into a plain dict, decoding JSONB columns"""
+    data = dict(row._mapping) if hasattr(row, '_mapping') else dict(row)
+    for key in ('scan_results', 'progress'):
+        if isinstance(data.get(key), str):
+            try:
+                data[key] = json.loads(data[key])
+            except ValueError:
+                data[key] = {}
+    return data
+
+
+class ScanJobQueue:
+    """Postgres-backed queue of channel scan jobs stored in channel_scans
+
+    With listen() the queue also holds a LISTEN connection: idle workers
+    wake as soon as a job is enqueued and waiters see stage updates
+    immediately, so API processes and scan-worker processes can hand work
+    to each other without polling. Without it everything still works on
+    poll_interval.
+    """
+
+    def __init__(self, db, runner: JobRunner, workers: int = 2, poll_interval: float = 2.0,
+                 stale_after: int = 60, max_attempts: int = 3):
+        self.db = db
+        self.runner = runner
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.heartbeat_interval = max(stale_after / 4, 1)
+        self.max_attempts = max_attempts
+        self._tasks: List[asyncio.Task] = []
+        self._running = False
+        self._listener: Optional[asyncpg.Connection] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._job_events: Dict[str, List[asyncio.Event]] = {}
+
+    @property
+    def available(self) -> bool:
+        return self.db is not None and getattr(self.db, 'is_connected', False)
+
+    async def enqueue(self, channel_name: str, user_id: Optional[str] = None, max_rpcs: Optional[int] = None) -> str:
+        """Persist a new queued job and return its id"""
+        job_id = str(uuid.uuid4())
+        progress = {'stages': SCAN_STAGES, 'completed_stages': [], 'percent': 0, 'max_rpcs': max_rpcs}
+        await self.db.execute(
+            query="""
+                INSERT INTO channel_scans (uuid, channel_name, scan_type, status, stage, progress, requested_by)
+                VALUES (:uuid, :channel_name, 'job', 'queued', 'queued', CAST(:progress AS JSONB), :requested_by)
+            """,
+            values={
+                'uuid': job_id,
+                'channel_name': channel_name,
+                'progress': json.dumps(progress),
+                'requested_by': user_id,
+            }
+        )
+        await self._notify(QUEUED_CHANNEL, job_id)
+        logger.info(f"Queued scan job {job_id} for {channel_name}")
+        return job_id
+
+    async def watch(self, job_id: str, timeout: float) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the job each time its stage or status changes, until it finishes or timeout passes"""
+        deadline = time.monotonic() + timeout
+        event = asyncio.Event()
+        self._job_events.setdefault(job_id, []).append(event)
+        last_state = None
+        try:
+            while True:
+                job = await self.get(job_id)
+                if job is None:
+                    return
+                state = (job['status'], job['stage'])
+                if state != last_state:
+                    last_state = state
+                    yield job
+                if job['status'] in TERMINAL_STATUSES:
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                event.clear()
+                wait = remaining if self._listener else min(remaining, self.poll_interval)
+                try:
+                    await asyncio.wait_for(event.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            waiters = self._job_events.get(job_id, [])
+            if event in waiters:
+                waiters.remove(event)
+            if not waiters:
+                self._job_events.pop(job_id, None)
+
+    async def listen(self, dsn: str):
+        """Open a LISTEN connection for queue and progress notifications"""
+        if self._listener:
+            return
+        try:
+            self._listener = await asyncpg.connect(dsn)
+            await self._listener.add_listener(QUEUED_CHANNEL, self._on_queued)
+            await self._listener.add_listener(UPDATES_CHANNEL, self._on_update)
+            logger.info("Listening for scan job notifications")
+        except Exception as e:
+            logger.warning(f"Scan job notifications unavailable, polling instead: {e}")
+            self._listener = None
+
+    def _on_queued(self, connection, pid, channel, payload):
+        if self._wakeup:
+            self._wakeup.set()
+
+    def _on_update(self, connection, pid, channel, payload):
+        for event in self._job_events.get(payload, []):
+            event.set()
+
+    async def _notify(self, channel: str, payload: str):
+        try:
+            await self.db.execute(
+                query="SELECT pg_notify(:channel, :payload)",
+                values={'channel': channel, 'payload': payload}
+            )
+        except Exception as e:
+            logger.debug(f"Scan job notification failed: {e}")
+
+    async def _notify_update(self, row_id: int):
+        try:
+            await self.db.execute(
+                query="SELECT pg_notify(:channel, uuid::text) FROM channel_scans WHERE id = :id",
+                values={'channel': UPDATES_CHANNEL, 'id': row_id}
+            )
+        except Exception as e:
+            logger.debug(f"Scan job notification failed: {e}")
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Fetch the current state of a job"""
+        row = await self.db.fetch_one(
+            query="""
+                SELECT uuid, channel_name, status, stage, progress, scan_results, attempts, error,
+                       created_at, started_at, updated_at, completed_at
+                FROM channel_scans WHERE uuid = :uuid AND scan_type = 'job'
+            """,
+            values={'uuid': job_id}
+        )
+        if not row:
+            return None
+
+        job = _row_to_dict(row)
+        return {
+            'job_id': str(job['uuid']),
+            'channel': job['channel_name'],
+            'status': job['status'],
+            'stage': job['stage'],
+            'progress': job['progress'] or {},
+            'attempts': job['attempts'],
+            'error': job['error'],
+            'created_at': job['created_at'].isoformat() if job['created_at'] else None,
+            'started_at': job['started_at'].isoformat() if job['started_at'] else None,
+            'updated_at': job['updated_at'].isoformat() if job['updated_at'] else None,
+            'completed_at': job['completed_at'].isoformat() if job['completed_at'] else None,
+            'result': job['scan_results'] if job['status'] == 'completed' else None
+        }
+
+    async def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker_loop(i)) for i in range(self.workers)]
+        logger.info(f"Started {self.workers} scan job workers")
+
+    async def stop(self):
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def close(self):
+        await self.stop()
+        if self._listener:
+            await self._listener.close()
+            self._listener = None
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        """Claim the oldest queued job, or a running one whose heartbeat went stale"""
+        row = await self.db.fetch_one(
+            query="""
+                UPDATE channel_scans
+                SET status = 'running', attempts = attempts + 1,
+                    started_at = COALESCE(started_at, CURRENT_TIMESTAMP), updated_at = CURRENT_TIMESTAMP
+                WHERE id = (
+                    SELECT id FROM channel_scans
+                    WHERE status = 'queued'
+                       OR (status = 'running' AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => :stale))
+                    ORDER BY created_at
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING id, uuid, channel_name, requested_by, progress, scan_results, attempts
+            """,
+            values={'stale': float(self.stale_after)}
+        )
+        return _row_to_dict(row) if row else None
+
+    async def _worker_loop(self, worker_index: int):
+        while self._running:
+            try:
+                self._wakeup.clear()
+                job = await self._claim()
+                if not job:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Scan job worker {worker_index} error: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _process(self, job: Dict[str, Any]):
+        job_id = str(job['uuid'])
+
+        if job['attempts'] > self.max_attempts:
+            await self._finish(job['id'], 'failed', error=f"Gave up after {self.max_attempts} attempts")
+            return
+
+        progress = job['progress'] or {}
+        checkpoint = {
+            'completed_stages': progress.get('completed_stages', []),
+            'analysis': job['scan_results'] or {},
+            'max_rpcs': progress.get('max_rpcs')
+        }
+        if checkpoint['completed_stages']:
+            logger.info(f"Resuming scan job {job_id} after stages {checkpoint['completed_stages']}")
+
+        async def on_stage(stage: str, analysis: Dict[str, Any]):
+            completed = checkpoint['completed_stages']
+            if stage not in completed:
+                completed.append(stage)
+            await self._checkpoint(job['id'], stage, completed, analysis, checkpoint['max_rpcs'])
+
+        heartbeat = asyncio.create_task(self._heartbeat(job['id']))
+        try:
+            result = await self.runner(job, checkpoint, on_stage)
+            await self._finish(job['id'], 'completed', result=result)
+            logger.info(f"Scan job {job_id} completed")
+        except asyncio.CancelledError:
+            # Leave the job as running; its stale heartbeat lets it be reclaimed after restart
+            raise
+        except Exception as e:
+            error_msg = str(e) or type(e).__name__
+            status = 'failed' if job['attempts'] >= self.max_attempts else 'queued'
+            await self._finish(job['id'], status, error=error_msg)
+            logger.warning(f"Scan job {job_id} attempt {job['attempts']} failed: {error_msg}")
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, row_id: int):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.db.execute(
+                    query="UPDATE channel_scans SET updated_at = CURRENT_TIMESTAMP WHERE id = :id AND status = 'running'",
+                    values={'id': row_id}
+                )
+            except Exception as e:
+                logger.debug(f"Scan job heartbeat failed: {e}")
+
+    async def _checkpoint(self, row_id: int, stage: str, completed: List[str], analysis: Dict[str, Any],
+                          max_rpcs: Optional[int] = None):
+        progress = {
+            'stages': SCAN_STAGES,
+            'completed_stages': completed,
+            'percent': int(len(completed) / len(SCAN_STAGES) * 100),
+            'max_rpcs': max_rpcs
+        }
+        await self.db.execute(
+            query="""
+                UPDATE channel_scans
+                SET stage = :stage, progress = CAST(:progress AS JSONB), scan_results = CAST(:results AS JSONB),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = :id
+            """,
+            values={
+                'id': row_id,
+                'stage': stage,
+                'progress': json.dumps(progress),
+                'results': json.dumps(analysis, default=str)
+            }
+        )
+        await self._notify_update(row_id)
+
+    async def _finish(self, row_id: int, status: str, result: Optional[Dict[str, Any]] = None,
+                      error: Optional[str] = None):
+        if status == 'completed':
+            progress = {'stages': SCAN_STAGES, 'completed_stages': SCAN_STAGES, 'percent': 100}
+            await self.db.execute(
+                query="""
+                    UPDATE channel_scans
+                    SET status = 'completed', stage = 'completed', progress = CAST(:progress AS JSONB),
+                        scan_results = CAST(:results AS JSONB), channel_id = :channel_id,
+                        channel_title = :channel_title, member_count = :member_count,
+                        messages_analyzed = :messages_analyzed, kols_found = :kols_found, error = NULL,
+                        scanned_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP,
+                        completed_at = CURRENT_TIMESTAMP
+                    WHERE id = :id
+                """,
+                values={
+                    'id': row_id,
+                    'progress': json.dumps(progress),
+                    'results': json.dumps(result, default=str),
+                    'channel_id': result.get('channel_id'),
+                    'channel_title': (result.get('title') or '')[:255],
+                    'member_count': result.get('member_count') or 0,
+                    'messages_analyzed': result.get('message_count') or 0,
+                    'kols_found': result.get('kol_count') or 0
+                }
+            )
+        else:
+            completed_at = 'CURRENT_TIMESTAMP' if status == 'failed' else 'NULL'
+            await self.db.execute(
+                query=f"""
+                    UPDATE channel_scans
+                    SET status = :status, error = :error, updated_at = CURRENT_TIMESTAMP,
+                        completed_at = {completed_at}
+                    WHERE id = :id
+                """,
+                values={'id': row_id, 'status': status, 'error': error}
+            )
+        await self._notify_update(row_id)
+        if status == 'queued':
+            # Retry: let an idle worker pick it up straight away
+            await self._notify(QUEUED_CHANNEL, str(row_id))
+
+
+def create_scan_job_queue(db, runner: JobRunner) -> ScanJobQueue:
+    """Build a queue configured from the environment"""
+    return ScanJobQueue(
+        db,
+        runner,
+        workers=int(os.getenv('SCAN_JOB_WORKERS', '2')),
+        poll_interval=float(os.getenv('SCAN_JOB_POLL_INTERVAL', '2')),
+        stale_after=int(os.getenv('SCAN_JOB_STALE_SECONDS', '60')),
+        max_attempts=int(os.getenv('SCAN_JOB_MAX_ATTEMPTS', '3'))
+    )
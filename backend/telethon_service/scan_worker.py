@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Dedicated scan worker: owns the Telegram clients and runs queued scans.
+Pair with API processes started with SERVICE_ROLE=api; they enqueue scans
+in channel_scans and are woken through Postgres LISTEN/NOTIFY when a
+worker checkpoints or finishes one. Each tier can be scaled and restarted
+on its own. The worker still serves HTTP on SCAN_WORKER_PORT so API
+processes can forward session-bound requests (bot detection, watches,
+schedules) and so it can be health-checked.
+"""
+
+import os
+import sys
+import logging
+
+os.environ['SERVICE_ROLE'] = 'scan-worker'
+
+import uvicorn
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    port = int(os.getenv('SCAN_WORKER_PORT', '10001'))
+    host = os.getenv('SCAN_WORKER_HOST', '127.0.0.1')
+    logger.info(f"🛠️ Starting scan worker on {host}:{port} with {os.getenv('SCAN_JOB_WORKERS', '2')} job workers")
+
+    uvicorn.run(
+        "main:app",
+        host=host,
+        port=port,
+        log_level="info",
+        reload=False,
+        workers=1
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from partitions import MonthlyPartitions
+
+logger = logging.getLogger(__name__)
+
+METRIC_SAMPLE_RETENTION_MONTHS = int(os.getenv('METRIC_SAMPLE_RETENTION_MONTHS', '3'))
+
+CHANNEL_METRICS = ('member_count', 'avg_views', 'avg_forwards', 'engagement_rate', 'active_members',
+                   'kol_count', 'admin_count', 'bot_count')
+KOL_METRICS = ('influence_score', 'engagement_rate', 'avg_views', 'posting_frequency', 'follower_count')
+
+# Buckets served from rollups; week and month are folded from the daily rows
+BUCKETS = ('raw', 'hour', 'day', 'week', 'month')
+DEFAULT_WINDOWS = {'raw': 7, 'hour': 7, 'day': 365, 'week': 730, 'month': 1825}
+
+Sample = Tuple[str, int, str, float]
+
+# One statement per sample writes the raw row and bumps both rollups
+RECORD_SAMPLE = """
+    WITH sample AS (
+        INSERT INTO metric_samples (entity_type, entity_id, metric, value, recorded_at)
+        VALUES (:entity_type, :entity_id, :metric, :value, :recorded_at)
+        RETURNING entity_type, entity_id, metric, value, recorded_at
+    )
+    INSERT INTO metric_rollups (entity_type, entity_id, metric, bucket, bucket_start,
+                                samples, total, min_value, max_value, last_value, last_at)
+    SELECT entity_type, entity_id, metric, b.bucket, date_trunc(b.bucket, recorded_at),
+           1, value, value, value, value, recorded_at
+    FROM sample CROSS JOIN (VALUES ('hour'), ('day')) AS b(bucket)
+    ON CONFLICT (entity_type, entity_id, metric, bucket, bucket_start) DO UPDATE
+    SET samples = metric_rollups.samples + 1,
+        total = metric_rollups.total + EXCLUDED.total,
+        min_value = LEAST(metric_rollups.min_value, EXCLUDED.min_value),
+        max_value = GREATEST(metric_rollups.max_value, EXCLUDED.max_value),
+        last_value = CASE WHEN EXCLUDED.last_at >= metric_rollups.last_at
+                          THEN EXCLUDED.last_value ELSE metric_rollups.last_value END,
+        last_at = GREATEST(metric_rollups.last_at, EXCLUDED.last_at)
+"""
+
+RAW_SERIES = """
+    SELECT recorded_at AS bucket_start, 1 AS samples, value AS avg, value AS min, value AS max, value AS last
+    FROM metric_samples
+    WHERE entity_type = :entity_type AND entity_id = :entity_id AND metric = :metric
+      AND recorded_at >= :start AND recorded_at < :end
+    ORDER BY recorded_at
+"""
+
+ROLLUP_SERIES = """
+    SELECT bucket_start, samples, total / samples AS avg, min_value AS min, max_value AS max, last_value AS last
+    FROM metric_rollups
+    WHERE entity_type = :entity_type AND entity_id = :entity_id AND metric = :metric AND bucket = :bucket
+      AND bucket_start >= :start AND bucket_start < :end
+    ORDER BY bucket_start
+"""
+
+FOLDED_SERIES = """
+    SELECT date_trunc(CAST(:fold AS TEXT), bucket_start) AS bucket_start, SUM(samples) AS samples,
+           SUM(total) / SUM(samples) AS avg, MIN(min_value) AS min, MAX(max_value) AS max,
+           (ARRAY_AGG(last_value ORDER BY last_at DESC))[1] AS last
+    FROM metric_rollups
+    WHERE entity_type = :entity_type AND entity_id = :entity_id AND metric = :metric AND bucket = 'day'
+      AND bucket_start >= :start AND bucket_start < :end
+    GROUP BY 1 ORDER BY 1
+"""
+
+
+def _mean(values: List[float]) -> float:
+    return sum(values) / len(values) if values else 0.0
+
+
+def channel_samples(analysis: Dict[str, Any]) -> List[Sample]:
+    """Metric samples for a finished scan: the channel's and each identified KOL's"""
+    channel_id = analysis.get('channel_id')
+    if not channel_id:
+        return []
+    activity = analysis.get('recent_activity') or []
+    views = [post.get('views') or 0 for post in activity]
+    forwards = [post.get('forwards') or 0 for post in activity]
+    derived = {
+        'avg_views': _mean(views),
+        'avg_forwards': _mean(forwards),
+        'engagement_rate': sum(forwards) / sum(views) * 100 if sum(views) else 0.0
+    }
+    samples = []
+    for metric in CHANNEL_METRICS:
+        value = derived[metric] if metric in derived else analysis.get(metric)
+        if value is not None:
+            samples.append(('channel', channel_id, metric, float(value)))
+    for kol in analysis.get('kol_details') or []:
+        for metric in KOL_METRICS:
+            if kol.get(metric) is not None and kol.get('user_id'):
+                samples.append(('kol', kol['user_id'], metric, float(kol[metric])))
+    return samples
+
+
+class MetricsStore:
+    """Scan snapshots in metric_samples with hourly and daily rollups
+
+    metric_samples is range-partitioned by month and only kept for
+    METRIC_SAMPLE_RETENTION_MONTHS; metric_rollups is updated in the same
+    statement as each insert, so long-range charts read at most one row
+    per bucket and never touch raw samples.
+    """
+
+    def __init__(self, db=None, retention_months: int = METRIC_SAMPLE_RETENTION_MONTHS):
+        self.db = db
+        self.partitions = MonthlyPartitions('metric_samples', retention_months)
+        self.recorded = 0
+
+    @property
+    def available(self) -> bool:
+        return self.db is not None and getattr(self.db, 'is_connected', False)
+
+    @staticmethod
+    def sample_rows(samples: List[Sample], at: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        recorded_at = at or datetime.utcnow()
+        return [
+            {'entity_type': entity_type, 'entity_id': entity_id, 'metric': metric, 'value': value,
+             'recorded_at': recorded_at}
+            for entity_type, entity_id, metric, value in samples
+        ]
+
+    async def write(self, db, rows: List[Dict[str, Any]]):
+        await db.execute_many(RECORD_SAMPLE, rows)
+        self.recorded += len(rows)
+
+    async def record(self, samples: List[Sample], at: Optional[datetime] = None):
+        if not samples or not self.available:
+            return
+        await self.write(self.db, self.sample_rows(samples, at))
+
+    async def series(self, entity_type: str, entity_id: int, metric: str, bucket: str,
+                     start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        end = end or datetime.utcnow()
+        start = start or end - timedelta(days=DEFAULT_WINDOWS[bucket])
+        values = {'entity_type': entity_type, 'entity_id': entity_id, 'metric': metric, 'start': start, 'end': end}
+        if bucket == 'raw':
+            rows = await self.db.fetch_all(RAW_SERIES, values)
+        elif bucket in ('hour', 'day'):
+            rows = await self.db.fetch_all(ROLLUP_SERIES, {**values, 'bucket': bucket})
+        else:
+            rows = await self.db.fetch_all(FOLDED_SERIES, {**values, 'fold': bucket})
+        return [
+            {
+                'bucket_start': row['bucket_start'].isoformat(),
+                'samples': int(row['samples']),
+                'avg': round(float(row['avg']), 4),
+                'min': float(row['min']),
+                'max': float(row['max']),
+                'last': float(row['last'])
+            }
+            for row in rows
+        ]
+
+    async def start(self):
+        if self.available:
+            self.partitions.start(self.db)
+
+    async def stop(self):
+        await self.partitions.stop()
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from telethon import TelegramClient
+from telethon.sessions import StringSession
+
+from cluster import user_session_key
+from rpc_accounting import AccountedTelegramClient
+
+logger = logging.getLogger(__name__)
+
+USER_CLIENT_MAX_LIVE = int(os.getenv('USER_CLIENT_MAX_LIVE', '50'))
+USER_CLIENT_IDLE_TIMEOUT = int(os.getenv('USER_CLIENT_IDLE_TIMEOUT', '900'))
+
+
+def session_name_for(user_id: str) -> str:
+    return f"user_{user_id}_session"
+
+
+@dataclass
+class LiveClient:
+    client: TelegramClient
+    last_used: float
+
+
+class UserClientPool:
+    """Persisted user sessions with a bounded LRU of connected clients
+
+    Authenticated sessions are saved as StringSession data in
+    telegram_sessions (and kept in memory when the database is down).
+    At most max_live clients stay connected; others are reconnected lazily
+    on use and idle ones are disconnected by a background reaper. With
+    leases, a client is only connected by the worker holding its lease.
+    """
+
+    def __init__(self, api_id: int, api_hash: str, db=None, leases=None, max_live: int = USER_CLIENT_MAX_LIVE,
+                 idle_timeout: int = USER_CLIENT_IDLE_TIMEOUT):
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.db = db
+        self.leases = leases
+        self.max_live = max_live
+        self.idle_timeout = idle_timeout
+        self.live: "OrderedDict[str, LiveClient]" = OrderedDict()
+        self._sessions: Dict[str, str] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._reconnect_latencies = deque(maxlen=200)
+        self.reconnects = 0
+        self.evictions = 0
+        self.idle_disconnects = 0
+        self._reaper: Optional[asyncio.Task] = None
+
+    @property
+    def db_available(self) -> bool:
+        return self.db is not None and getattr(self.db, 'is_connected', False)
+
+    def _lock(self, user_id: str) -> asyncio.Lock:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
+
+    async def get(self, user_id: str) -> Optional[TelegramClient]:
+        """Connected client for the user, reconnecting from the stored session if needed"""
+        live = self.live.get(user_id)
+        if live:
+            live.last_used = time.time()
+            self.live.move_to_end(user_id)
+            return live.client
+
+        async with self._lock(user_id):
+            # Another request may have reconnected while we waited for the lock
+            live = self.live.get(user_id)
+            if live:
+                live.last_used = time.time()
+                return live.client
+
+            session_string = await self._load(user_id)
+            if not session_string:
+                return None
+            if self.leases and not await self.leases.acquire(user_session_key(user_id)):
+                logger.info(f"Session for {user_id} is owned by another worker")
+                return None
+
+            started = time.perf_counter()
+            client = AccountedTelegramClient(StringSession(session_string), self.api_id, self.api_hash)
+            await client.connect()
+            if not await client.is_user_authorized():
+                logger.warning(f"Stored session for {user_id} is no longer authorized")
+                await client.disconnect()
+                await self._delete(user_id)
+                await self._release_lease(user_id)
+                return None
+            self._reconnect_latencies.append(time.perf_counter() - started)
+            self.reconnects += 1
+
+            await self._add_live(user_id, client)
+            logger.info(f"Reconnected client for {user_id} in {self._reconnect_latencies[-1] * 1000:.0f}ms")
+            return client
+
+    async def store(self, user_id: str, client: TelegramClient, phone_number: Optional[str] = None):
+        """Persist an authenticated client's session and keep it connected"""
+        session_string = client.session.save()
+        self._sessions[user_id] = session_string
+        await self._save(user_id, session_string, phone_number)
+        if self.leases:
+            # The worker that completed the login takes the session over
+            await self.leases.acquire(user_session_key(user_id), force=True)
+
+        previous = self.live.pop(user_id, None)
+        if previous and previous.client is not client:
+            await self._disconnect(previous.client)
+        await self._add_live(user_id, client)
+        logger.info(f"Stored client for {user_id}. Live clients: {len(self.live)}")
+
+    async def remove(self, user_id: str):
+        """Log the user out: disconnect and forget the stored session"""
+        live = self.live.pop(user_id, None)
+        if live:
+            await self._disconnect(live.client)
+        self._sessions.pop(user_id, None)
+        await self._delete(user_id)
+        await self._release_lease(user_id)
+
+    async def drop(self, user_id: str):
+        """Disconnect without logging out, e.g. after another worker took the session over"""
+        live = self.live.pop(user_id, None)
+        if live:
+            await self._disconnect(live.client)
+        # The new owner may have stored a fresher session
+        self._sessions.pop(user_id, None)
+
+    async def has_session(self, user_id: str) -> bool:
+        return user_id in self.live or await self._load(user_id) is not None
+
+    async def _add_live(self, user_id: str, client: TelegramClient):
+        self.live[user_id] = LiveClient(client=client, last_used=time.time())
+        self.live.move_to_end(user_id)
+        while len(self.live) > self.max_live:
+            evicted_id, evicted = self.live.popitem(last=False)
+            self.evictions += 1
+            logger.info(f"Evicting least recently used client for {evicted_id}")
+            await self._disconnect(evicted.client)
+            await self._release_lease(evicted_id)
+
+    async def _release_lease(self, user_id: str):
+        if self.leases:
+            await self.leases.release(user_session_key(user_id))
+
+    async def _disconnect(self, client: TelegramClient):
+        try:
+            await client.disconnect()
+        except Exception as e:
+            logger.debug(f"Error disconnecting client: {e}")
+
+    async def _load(self, user_id: str) -> Optional[str]:
+        if user_id in self._sessions:
+            return self._sessions[user_id]
+        if not self.db_available:
+            return None
+        try:
+            row = await self.db.fetch_one(
+                query="""
+                    UPDATE telegram_sessions SET last_used = CURRENT_TIMESTAMP
+                    WHERE session_name = :session_name AND is_authenticated
+                    RETURNING session_data
+                """,
+                values={'session_name': session_name_for(user_id)}
+            )
+        except Exception as e:
+            logger.warning(f"Could not load session for {user_id}: {e}")
+            return None
+        if not row or not row['session_data']:
+            return None
+        session_string = bytes(row['session_data']).decode()
+        self._sessions[user_id] = session_string
+        return session_string
+
+    async def _save(self, user_id: str, session_string: str, phone_number: Optional[str]):
+        if not self.db_available:
+            return
+        try:
+            await self.db.execute(
+                query="""
+                    INSERT INTO telegram_sessions (session_name, session_data, phone_number, is_authenticated, last_used)
+                    VALUES (:session_name, :session_data, :phone_number, TRUE, CURRENT_TIMESTAMP)
+                    ON CONFLICT (session_name) DO UPDATE
+                    SET session_data = EXCLUDED.session_data,
+                        phone_number = COALESCE(EXCLUDED.phone_number, telegram_sessions.phone_number),
+                        is_authenticated = TRUE, last_used = CURRENT_TIMESTAMP
+                """,
+                values={
+                    'session_name': session_name_for(user_id),
+                    'session_data': session_string.encode(),
+                    'phone_number': phone_number
+                }
+            )
+        except Exception as e:
+            logger.warning(f"Could not persist session for {user_id}: {e}")
+
+    async def _delete(self, user_id: str):
+        if not self.db_available:
+            return
+        try:
+            await self.db.execute(
+                query="DELETE FROM telegram_sessions WHERE session_name = :session_name",
+                values={'session_name': session_name_for(user_id)}
+            )
+        except Exception as e:
+            logger.warning(f"Could not delete session for {user_id}: {e}")
+
+    async def start(self):
+        if not self._reaper:
+            self._reaper = asyncio.create_task(self._reap_idle())
+
+    async def _reap_idle(self):
+        interval = max(min(self.idle_timeout / 4, 60), 1)
+        while True:
+            await asyncio.sleep(interval)
+            cutoff = time.time() - self.idle_timeout
+            for user_id, live in list(self.live.items()):
+                if live.last_used < cutoff and not self._lock(user_id).locked():
+                    self.live.pop(user_id, None)
+                    self.idle_disconnects += 1
+                    await self._disconnect(live.client)
+                    await self._release_lease(user_id)
+                    logger.info(f"Disconnected idle client for {user_id}")
+
+    async def close(self):
+        if self._reaper:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+            self._reaper = None
+        for live in self.live.values():
+            await self._disconnect(live.client)
+        self.live.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        latencies = sorted(self._reconnect_latencies)
+        return {
+            'live_clients': len(self.live),
+            'max_live_clients': self.max_live,
+            'known_sessions': len(self._sessions),
+            'reconnects': self.reconnects,
+            'evictions': self.evictions,
+            'idle_disconnects': self.idle_disconnects,
+            'reconnect_latency_ms': {
+                'avg': round(sum(latencies) / len(latencies) * 1000, 1) if latencies else None,
+                'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1) if latencies else None
+            }
+        }
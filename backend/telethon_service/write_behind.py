@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+WRITE_BUFFER_MAX_ROWS = int(os.getenv('WRITE_BUFFER_MAX_ROWS', '20000'))
+WRITE_BUFFER_BATCH_SIZE = int(os.getenv('WRITE_BUFFER_BATCH_SIZE', '500'))
+WRITE_BUFFER_FLUSH_INTERVAL = float(os.getenv('WRITE_BUFFER_FLUSH_INTERVAL', '1.0'))
+# How long a producer waits for room in a full buffer before its rows are dropped
+WRITE_BUFFER_PUT_TIMEOUT = float(os.getenv('WRITE_BUFFER_PUT_TIMEOUT', '5'))
+WRITE_BUFFER_MAX_ATTEMPTS = int(os.getenv('WRITE_BUFFER_MAX_ATTEMPTS', '3'))
+WRITE_BUFFER_SHUTDOWN_TIMEOUT = float(os.getenv('WRITE_BUFFER_SHUTDOWN_TIMEOUT', '15'))
+
+Writer = Callable[[Any, List[Any]], Awaitable[Any]]
+
+
+class WriteBehindBuffer:
+    """Bounded write-behind queue that batches rows per table off the request path
+
+    Producers put() rows and return as soon as they are queued; a single
+    flusher hands each table's rows to its registered bulk writer in
+    batches of batch_size, every flush_interval or sooner once a table
+    has a full batch. When max_rows are pending, put() waits for the
+    flusher to make room (backpressure) and drops the rows after
+    put_timeout. A failed batch is retried up to max_attempts times.
+    While the buffer isn't running, rows are written inline.
+    """
+
+    def __init__(self, db=None, max_rows: int = WRITE_BUFFER_MAX_ROWS, batch_size: int = WRITE_BUFFER_BATCH_SIZE,
+                 flush_interval: float = WRITE_BUFFER_FLUSH_INTERVAL, put_timeout: float = WRITE_BUFFER_PUT_TIMEOUT,
+                 max_attempts: int = WRITE_BUFFER_MAX_ATTEMPTS):
+        self.db = db
+        self.max_rows = max_rows
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_attempts = max_attempts
+        self._writers: Dict[str, Writer] = {}
+        self._pending: Dict[str, Deque[Any]] = {}
+        self._attempts: Dict[str, int] = {}
+        self.depth = 0
+        self._wake: Optional[asyncio.Event] = None
+        self._drained: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.queued = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dropped = 0
+        self.backpressure_waits = 0
+        self.inline_writes = 0
+        self.flush_times: Deque[float] = deque(maxlen=500)
+        self.max_depth = 0
+
+    @property
+    def available(self) -> bool:
+        return self.db is not None and getattr(self.db, 'is_connected', False)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def register(self, table: str, writer: Writer):
+        """writer is awaited as writer(db, rows) with up to batch_size rows"""
+        self._writers[table] = writer
+        self._pending.setdefault(table, deque())
+        self._attempts.setdefault(table, 0)
+
+    async def put(self, table: str, rows: List[Any]):
+        """Queue rows for table; never raises"""
+        if not rows or not self.available:
+            return
+        if not self.running:
+            await self._write_inline(table, rows)
+            return
+
+        if self.depth and self.depth + len(rows) > self.max_rows:
+            self.backpressure_waits += 1
+            deadline = time.monotonic() + self.put_timeout
+            # A lone oversized put is still admitted once the buffer is empty
+            while self.depth and self.depth + len(rows) > self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.running:
+                    self.dropped += len(rows)
+                    logger.warning(f"Write buffer full ({self.depth} rows), dropped {len(rows)} {table} rows")
+                    return
+                self._drained.clear()
+                self._wake.set()
+                try:
+                    await asyncio.wait_for(self._drained.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+        self._pending[table].extend(rows)
+        self.depth += len(rows)
+        self.queued += len(rows)
+        self.max_depth = max(self.max_depth, self.depth)
+        if len(self._pending[table]) >= self.batch_size:
+            self._wake.set()
+
+    async def _write_inline(self, table: str, rows: List[Any]):
+        try:
+            await self._writers[table](self.db, rows)
+            self.inline_writes += len(rows)
+        except Exception as e:
+            logger.warning(f"Could not write {len(rows)} {table} rows: {e}")
+
+    async def _flush_batch(self, table: str) -> bool:
+        queue = self._pending[table]
+        batch = [queue.popleft() for _ in range(min(self.batch_size, len(queue)))]
+        started = time.perf_counter()
+        try:
+            await self._writers[table](self.db, batch)
+        except Exception as e:
+            self.failed_flushes += 1
+            self._attempts[table] += 1
+            if self._attempts[table] < self.max_attempts:
+                queue.extendleft(reversed(batch))
+                logger.warning(f"Flushing {len(batch)} {table} rows failed, will retry: {e}")
+                return False
+            self._attempts[table] = 0
+            self.depth -= len(batch)
+            self.dropped += len(batch)
+            logger.error(f"Dropped {len(batch)} {table} rows after {self.max_attempts} failed flushes: {e}")
+            return False
+        self.flush_times.append(time.perf_counter() - started)
+        self._attempts[table] = 0
+        self.depth -= len(batch)
+        self.flushed += len(batch)
+        self.flushes += 1
+        return True
+
+    async def flush(self):
+        """Write everything pending, one batch at a time per table"""
+        for table, queue in self._pending.items():
+            while queue:
+                if not await self._flush_batch(table):
+                    break
+                self._drained.set()
+        self._drained.set()
+
+    async def _flush_loop(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Write buffer flush failed: {e}")
+
+    async def start(self):
+        if self._task or not self.available:
+            return
+        self._closing = False
+        self._wake = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._task = asyncio.create_task(self._flush_loop())
+        logger.info(f"Write-behind buffer started (batch {self.batch_size}, every {self.flush_interval}s)")
+
+    async def stop(self, timeout: float = WRITE_BUFFER_SHUTDOWN_TIMEOUT):
+        """Stop the flusher and drain what's pending, giving up after timeout"""
+        if not self._task:
+            return
+        # Let the flusher finish its current batch rather than cancelling it mid-write
+        self._closing = True
+        self._wake.set()
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._task = None
+        self._drained.set()
+        if self.depth:
+            logger.error(f"Write buffer shut down with {self.depth} rows unwritten")
+            self.dropped += self.depth
+        else:
+            logger.info(f"Write buffer drained ({self.flushed} rows written)")
+
+    async def _drain(self):
+        await self._task
+        while self.depth:
+            before = self.depth
+            await self.flush()
+            if self.depth == before:
+                await asyncio.sleep(0.5)
+
+    def stats(self) -> Dict[str, Any]:
+        times = sorted(self.flush_times)
+        return {
+            'running': self.running,
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'max_rows': self.max_rows,
+            'pending_by_table': {table: len(queue) for table, queue in self._pending.items()},
+            'queued': self.queued,
+            'flushed': self.flushed,
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'dropped': self.dropped,
+            'backpressure_waits': self.backpressure_waits,
+            'inline_writes': self.inline_writes,
+            'flush_ms_avg': round(sum(times) / len(times) * 1000, 2) if times else 0,
+            'flush_ms_p95': round(times[min(len(times) - 1, int(len(times) * 0.95))] * 1000, 2) if times else 0,
+            'flush_ms_max': round(times[-1] * 1000, 2) if times else 0
+        }